@@ -19,7 +19,7 @@ from Agents import  Agent
 def get_InspectorAgent(model):
     """
     "This inspector agent analyzes images of aircraft parts to classify whether the part displayed is broken or not. 
-    For this, the agent expects an image_path in string format."
+    For this, the agent expects an image_path in string format: a file path or the handle of an uploaded image (blob://...)."
     """ 
 
     response_schema = {
@@ -69,6 +69,7 @@ def get_InspectorAgent(model):
     INSTRUCTIONS = """
                     You are an inspector agent that analyzes images of aircraft parts to determine whether they are broken or not. 
                     Use the tools at your disposal to run the analysis for an incoming image_path string.
+                    The image_path may be the handle of an uploaded image such as "blob://3f2a9c0d1e7b4a55/TL-2000_StingSport.jpg"; pass it to the tools unchanged.
                     Populate the "aircraft_model" field in your response with the Aircraft Model mentioned in the image filename. 
                     Mention the aircraft model in your overall response.  
                 """
@@ -82,7 +83,8 @@ def get_InspectorAgent(model):
                     to return a JSON array with image descriptions and damage information.
 
                     Args:
-                        image_path (str): The path to the image file to be analyzed.
+                        image_path (str): The path to the image file to be analyzed, or the
+                                          handle of an uploaded image (blob://...).
 
                     Returns:
                         tuple: A tuple containing the image description and a boolean value 
@@ -150,11 +152,25 @@ def get_DocumentAgent(model):
 
     INSTRUCTIONS = """
                     You are a document agent that answers user questions and retrieves requested information.
+                    Prefer search_documents, which searches the manuals and the safety reports at once and returns several answers, over calling the individual search functions.
                     Avoid just returning the document and page number. If possible, summarize the contents returned to you back to the user.
                 """
 
 
-    tools = """def search_manuals(query):
+    tools = """def search_documents(query, corpora="manuals, safety_reports", top_k=5):
+                \"\"\"
+                Searches aircraft manuals and annual safety reports at the same time and returns the best answers.
+
+                Args:
+                    query: The search query text.
+                    corpora: Comma-separated corpora to search: 'manuals', 'safety_reports' or both (default).
+                    top_k: The number of answers to return (default 5).
+
+                Returns:
+                    str: One line per answer, best first, with the corpus, the relevance score, the filename
+                         in which the info was found, the page number, and the answer to the question.
+                \"\"\"
+            def search_manuals(query):
                 \"\"\"
                 Performs a search query to retrieve information for a question on aircraft manuals. 
 
@@ -234,13 +250,13 @@ def get_ScheduleAgent(model):
     INSTRUCTIONS = """
                     You are a scheduler agent. Your task is to find licensed employees by their names that can support with structural repairs, engine maintenance, or annual inspection, depending on what is asked by the user. 
                     - do not refer to the employees by their ID. instead, use their names.
-                    - execute the tools one after the other, until you can provide all the necessary information at once. 
+                    - execute the tools until you can provide all the necessary information at once. Call tools that do not depend on each other in the same response, e.g. find_qualified_employees('Engine Maintenance') together with get_upcoming_events('workshop'). 
                     - Once you know the availability of the employee and the workshop, provide the next 3 slots where both the employee and the workshop are free.  
                     - If the user writes "I need to schedule for Engine Maintenance." put the prompt "I need to schedule for Engine Maintenance." into the agents_prompt field.
                     - It is your job to provide the exact dates back to the user. 
                     
                     Use the tools available to you to: 
-                    1. Find the 'Employee Name' with the proper license by checking the 'Specialization' to do the task the user asked for. If there are multiple employees that meet the requirement, provide their names to the user and let them know you are proceeding with one of them (select at random).
+                    1. Find the names of the employees with the proper license for the task the user asked for with find_qualified_employees. Only use get_employees if you need more details about the employees. If there are multiple employees that meet the requirement, provide their names to the user and let them know you are proceeding with one of them (select at random).
                     2. Retrieve the availability of this employee by using their name, e.g. John Smith.  
                     3. Retrieve the availability of the workshop. 
                     4. Provide the dates for the next available slots for both the employee and the workshop in the format DD.MM.YYYY. 
@@ -248,27 +264,42 @@ def get_ScheduleAgent(model):
                 """
 
 
-    tools = """def get_employees(): 
-                    \"\"\"Retrieves employee data from BigQuery and returns a DataFrame.
+    tools = """def get_employees(specialization=None, license_type=None, license_valid_on=None, limit=20):
+                    \"\"\"Retrieves the employees matching the given filters from BigQuery.
 
                     Fetches employee information, including their specializations and licenses,
-                    from the 'employees' table in the 'ascm' dataset in BigQuery.
+                    from the 'employees' table in the 'ascm' dataset in BigQuery. The filters
+                    run in BigQuery, so only the matching employees are returned.
 
                     Args:
-                        project_id: The ID of the Google Cloud project where the BigQuery dataset
-                                    is located. This should be provided as an argument to the
-                                    function or set as an environment variable.
+                        specialization: Optional part of the specialization, e.g. 'Engine Maintenance'
+                                        or 'structural'. Case-insensitive.
+                        license_type: Optional part of the license held, e.g. 'A&P' or 'IA'. Case-insensitive.
+                        license_valid_on: Optional date 'YYYY-MM-DD' (or 'today') on which the
+                                          license must still be valid.
+                        limit: The maximum number of employees returned (default 20).
 
                     Returns:
-                        A Pandas DataFrame containing the employee data, including the following
-                        columns:
-                        - Employee ID
+                        A list of dictionaries, one per employee, with the keys:
                         - Employee Name
                         - License Held
                         - License Expiration Date
-                        - Contact Number
                         - Specialization
                     \"\"\"
+                def find_qualified_employees(specialization, license_valid_on="today", license_type=None):
+                    \"\"\"Finds the employees of a specialization whose license is valid on a date.
+
+                    Args:
+                        specialization: The specialization, or a part of it, e.g. 'Engine Maintenance'
+                                        or 'structural repair'. Case-insensitive.
+                        license_valid_on: The date 'YYYY-MM-DD' (or 'today', the default) on which
+                                          the license must still be valid.
+                        license_type: Optional part of the license held, e.g. 'A&P' or 'IA'.
+
+                    Returns:
+                        A list of the names of the matching employees, the longest valid license
+                        first, or a message listing the known specializations if none match.
+                    \"\"\"
                 def get_upcoming_events(calendar_instance):
                     \"\"\"Retrieves upcoming events from a specified public Google Calendar.
 
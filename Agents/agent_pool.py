@@ -0,0 +1,111 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import threading
+
+from Tools.python_functions import config
+
+
+class AgentPool:
+    """
+    A pool of primed sub-agent sessions.
+
+    Each agent type is primed once. Every acquire hands out a fresh fork of the
+    primed agent, so a delegation starts from a clean conversation without a
+    priming model call, and the sub-agent history no longer accumulates a copy
+    of the system prompt per delegation.
+
+    Attributes:
+        agents: A dictionary of agent name to Agent instance.
+        pool_sizes: A dictionary of agent name to the number of warm forks kept ready.
+        default_size: The number of warm forks for agents not in pool_sizes.
+    """
+
+    def __init__(self, agents, pool_sizes=None, default_size=None):
+        """
+        Initializes the pool. Agents are primed on their first acquire.
+        """
+        if pool_sizes is None:
+            pool_sizes = config.get("agent_pool_sizes") or {}
+        if default_size is None:
+            default_size = config.get("agent_pool_default_size", 1)
+
+        self.agents = agents
+        self.pool_sizes = pool_sizes
+        self.default_size = default_size
+        self._primed = {}
+        self._ready = collections.defaultdict(collections.deque)
+        self._agent_locks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def size(self, agent_name):
+        """Returns the configured number of warm forks for an agent."""
+        return self.pool_sizes.get(agent_name, self.default_size)
+
+    def _agent_lock(self, agent_name):
+        with self._lock:
+            return self._agent_locks[agent_name]
+
+    def _primed_agent(self, agent_name):
+        # Priming may create a context cache, so it holds only the lock of this
+        # agent type and not the pool lock
+        with self._agent_lock(agent_name):
+            primed = self._primed.get(agent_name)
+            if primed is None:
+                primed = self.agents.get(agent_name)
+                if primed is None:
+                    return None
+                self._primed[agent_name] = primed
+            # Refreshes the template's prefix (e.g. an expired context cache) so
+            # the forks, which never create a cache of their own, can share it
+            primed.prime()
+            return primed
+
+    def _refill(self, agent_name, primed):
+        ready = self._ready[agent_name]
+        while len(ready) < self.size(agent_name):
+            ready.append(primed.fork())
+
+    def acquire(self, agent_name):
+        """
+        Returns a fresh, primed session of the given agent.
+
+        Args:
+            agent_name: The name of the agent, e.g. 'ScheduleAgent'.
+
+        Returns:
+            An Agent instance, or None if the agent is unknown.
+        """
+        primed = self._primed_agent(agent_name)
+        if primed is None:
+            return None
+
+        with self._lock:
+            try:
+                agent = self._ready[agent_name].popleft()
+            except IndexError:
+                agent = primed.fork()
+            self._refill(agent_name, primed)
+        return agent
+
+    async def acquire_async(self, agent_name):
+        """
+        Awaitable variant of `acquire`.
+
+        Priming or refreshing the template may create or delete a context cache,
+        which are blocking network calls, so they run on a worker thread.
+        """
+        return await asyncio.to_thread(self.acquire, agent_name)
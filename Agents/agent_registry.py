@@ -0,0 +1,94 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections.abc
+import inspect
+import threading
+
+from Tools.model_backends import get_backend
+from . import agent_definitions
+
+
+_lock = threading.RLock()
+_models = {}
+_agents = {}
+_factories = None
+
+
+def get_model(model_name):
+    """Returns the process-wide model handle of the configured backend for a model name."""
+    backend = get_backend()
+    with _lock:
+        key = (id(backend), model_name)
+        if key not in _models:
+            _models[key] = backend.get_model(model_name)
+        return _models[key]
+
+
+def agent_factories():
+    """
+    Discovers the agent factories (the get_* functions in agent_definitions).
+
+    Returns:
+        A dictionary of agent name to factory function, e.g. 'InspectorAgent': get_InspectorAgent.
+    """
+    global _factories
+    with _lock:
+        if _factories is None:
+            _factories = {
+                name.replace("get_", "", 1): obj
+                for name, obj in inspect.getmembers(agent_definitions, inspect.isfunction)
+                if name.startswith("get_") and obj.__module__ == agent_definitions.__name__
+            }
+        return _factories
+
+
+class AgentRegistry(collections.abc.Mapping):
+    """
+    A read-only mapping of agent name to Agent that constructs agents lazily.
+
+    Agent descriptions are taken from the factory docstrings, so listing the
+    available agents does not construct any of them. An agent is built (and
+    primed) on first access and then shared by all registries of the process
+    for the same model, together with its model handle. Agents
+    handed out by the registry are templates: converse with a fork of them
+    (see Agent.fork and AgentPool), not with the agent itself.
+
+    Attributes:
+        model_name: The name of the Gemini model used by the agents.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def descriptions(self):
+        """Returns a dictionary of agent name to a description of what the agent does."""
+        return {name: inspect.getdoc(factory) for name, factory in agent_factories().items()}
+
+    def __getitem__(self, agent_name):
+        factory = agent_factories()[agent_name]
+        key = (agent_name, self.model_name, id(get_backend()))
+        with _lock:
+            if key not in _agents:
+                agent = factory(get_model(self.model_name))
+                agent.name = agent_name
+                agent.prime()
+                _agents[key] = agent
+            return _agents[key]
+
+    def __iter__(self):
+        return iter(agent_factories())
+
+    def __len__(self):
+        return len(agent_factories())
@@ -12,10 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import copy
 import json
+import queue
 
 from .session_handler import start_chat  
-from Tools import return_tool_instruction, run_function 
+from .streaming import ResponseFieldParser
+from .tracing import span
+from . import usage
+from Tools import return_tool_instruction, run_function_async
+from Tools.async_utils import background_loop, run_sync
+from Tools.python_functions import config
+
+BUDGET_MESSAGE = "I stopped working on this request because {} was exceeded. Please narrow down the request or start a new session."
 
 def create_agent(model, response_schema, persona, instructions, tools):
     """Creates and returns an Agent instance with the given parameters."""
@@ -33,66 +43,238 @@ class Agent:
         persona: The persona of the agent.
         instructions: The instructions for the agent.
         tools: A string describing the available tools.
+        name: The name of the agent used in traces and usage reports, e.g. 'ScheduleAgent'.
         chat_session: The ChatSession instance for managing the conversation.
+        usage: The UsageLedger with the token usage and budgets of the conversations
+               started by this agent (see Agents.usage).
     """
 
-    def __init__(self, model, response_schema, persona, instructions, tools):
+    def __init__(self, model, response_schema, persona, instructions, tools, **session_kwargs):
         """
         Initializes a new Agent instance.
+
+        Any further keyword arguments (e.g. prefix_mode) are passed on to the ChatSession.
         """
         self.model = model
         self.response_schema = response_schema
         self.persona = persona
         self.instructions = instructions
         self.tools = tools
-        self.chat_session = start_chat(self.model, self.response_schema)
+        self.name = type(self).__name__
+        self.chat_session = start_chat(self.model, self.response_schema, **session_kwargs)
+        self.usage = usage.UsageLedger.from_config()
 
-    def start_conversation(self):
+    def system_prompt(self):
         """
-        Starts the conversation with the agent by sending the initial prompts.
+        Returns the static priming prompt built from the persona, instructions and tools.
         """
         guidelines = "<SYSTEM_MESSAGE> THIS IS A SYSTEM MESSAGE. BELOW IS YOUR DESCRIPTION FOR OPERATION. FOLLOW THESE INSTRUCTIONS AND AWAIT THE USER INPUT. YOU WILL BE PROVIDED WITH THE FULL CHAT HISTORY. MAKE SURE TO EMPHASIZE THE LATEST USER AND SYSTEM INPUTS MORE. </SYSTEM_MESSAGE> "
         persona_prompt = "<PERSONA>" + self.persona + "</PERSONA>"
         instruction_prompt = "<INSTRUCTIONS>" + self.instructions + "</INSTRUCTIONS>"
         tool_prompt = return_tool_instruction(self.tools)
+        return guidelines + persona_prompt + instruction_prompt + tool_prompt
+
+    def start_conversation(self):
+        """
+        Starts the conversation with the agent by sending the initial prompts.
+
+        If the chat session uses a cached prefix, the prompts are registered with
+        the model instead and no model call is made.
+        """
+        if self.chat_session.uses_cached_prefix:
+            self.chat_session.set_prefix(self.system_prompt())
+            return ""
+
+        with usage.bind(self.usage, self.name):
+            response = self.chat_session.send_message(self.system_prompt(), role='user', pin=True)
+        return response.text
+
+    def prime(self):
+        """
+        Primes the chat session with the initial prompts without calling the model.
 
-        response = self.chat_session.send_message(
-            guidelines + persona_prompt + instruction_prompt + tool_prompt, role='user'
-        )
+        The model's acknowledgement of the priming prompt is never kept in the
+        history, so a primed session is equivalent to one that went through
+        start_conversation. Priming an already primed agent does nothing.
+        """
+        if self.chat_session.uses_cached_prefix:
+            self.chat_session.set_prefix(self.system_prompt())
+        elif not self.chat_session.pinned:
+            self.chat_session.add_message(self.system_prompt(), role='user', pin=True)
+
+    def fork(self):
+        """
+        Returns a copy of the agent with a forked chat session (see ChatSession.fork).
+        """
+        forked = copy.copy(self)
+        forked.chat_session = self.chat_session.fork()
+        forked.usage = usage.UsageLedger.from_config()
+        return forked
+
+    async def start_conversation_async(self):
+        """
+        Awaitable variant of `start_conversation`.
+        """
+        if self.chat_session.uses_cached_prefix:
+            await self.chat_session.set_prefix_async(self.system_prompt())
+            return ""
+
+        with usage.bind(self.usage, self.name):
+            response = await self.chat_session.send_message_async(self.system_prompt(), role='user', pin=True)
         return response.text
 
+    async def run_functions(self, function_calls, on_event=None):
+        """
+        Executes the function calls of one agent turn concurrently.
+
+        At most `max_parallel_tools` (from settings.yaml, default 4) calls run at
+        the same time. A failing call does not cancel the others; its error is
+        returned in place of its result.
+
+        Args:
+            function_calls: The response items with execute_function set to "True".
+            on_event: Optional callback that receives a progress event per call.
+
+        Returns:
+            A list with the result of every call, in the order of function_calls.
+        """
+        semaphore = asyncio.Semaphore(config.get("max_parallel_tools", 4))
+
+        async def run(call):
+            with span("tool.call", tool=call['function_name'], agent=self.name) as tool_span:
+                async with semaphore:
+                    tool_span.mark_started()
+                    if on_event is not None:
+                        on_event({"type": "progress", "text": f"running {call['function_name']}"})
+                    try:
+                        result = await run_function_async(call['function'], call['function_name'], call['function_args'])
+                    except Exception as e:
+                        result = f"Error executing {call['function_name']}: {e}"
+                        tool_span.set(failed=True)
+                    tool_span.set(request_chars=len(call['function'] or call['function_args']), response_chars=len(str(result)))
+                    usage.record_tool(call['function_name'], result)
+                    return result
+
+        return await asyncio.gather(*(run(call) for call in function_calls))
+
+    async def _send_async(self, message, on_event=None):
+        """
+        Sends a message to the chat session, streaming the 'response' field of
+        the reply to on_event as token events if a callback is given.
+        """
+        if on_event is None:
+            return await self.chat_session.send_message_async(message)
+
+        parser = ResponseFieldParser("response")
+
+        def on_chunk(chunk):
+            for item, text in parser.feed(chunk):
+                on_event({"type": "token", "item": item, "text": text})
+
+        on_event({"type": "message_start"})
+        return await self.chat_session.send_message_async(message, on_chunk=on_chunk)
+
     def send_message(self, message):
         """
         Sends a message to the agent and processes the response, potentially
         executing a tool function if instructed by the agent.
+
+        This is a blocking wrapper around `send_message_async`.
+        """
+        return run_sync(self.send_message_async(message))
+
+    def stream_message(self, message):
         """
+        Sends a message to the agent and yields events while the turn runs.
+
+        Events are dictionaries with a 'type' key:
+            - 'message_start': a new model response starts streaming.
+            - 'token': 'text' is the next piece of the 'response' field of array item 'item'.
+            - 'progress': 'text' describes the tool or agent that is running.
+            - 'final': the turn is done; 'response' and 'trace' hold the return
+              values of `send_message`.
+        """
+        events = queue.Queue()
+        done = object()
+
+        async def run():
+            try:
+                return await self.send_message_async(message, on_event=events.put)
+            finally:
+                events.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(run(), background_loop())
+        while (event := events.get()) is not done:
+            yield event
+
+        response, response_list = future.result()
+        yield {"type": "final", "response": response, "trace": response_list}
+
+    async def send_message_async(self, message, on_event=None):
+        """
+        Sends a message to the agent and processes the response, potentially
+        executing a tool function if instructed by the agent.
+
+        Args:
+            message: The user message.
+            on_event: Optional callback receiving the streaming events described
+                      in `stream_message`.
+        """
+        with span("agent.turn", agent=self.name, request_chars=len(message)) as turn_span, \
+                usage.bind(self.usage, self.name) as ledger:
+            if ledger is self.usage:
+                ledger.start_turn()
+            response, response_list = await self._turn_async(message, on_event)
+            turn_span.set(response_chars=len(response), model_calls=len(response_list))
+            return response, response_list
+
+    def budget_exceeded(self):
+        """
+        Returns the graceful response to give if a token or cost budget of the
+        current session is exceeded, else None.
+        """
+        ledger = usage.active_ledger()
+        exceeded = ledger.exceeded() if ledger is not None else None
+        if exceeded is None:
+            return None
+        print(f"\nStopping {self.name}: {exceeded} was exceeded.\n")
+        return BUDGET_MESSAGE.format(exceeded)
+
+    async def _turn_async(self, message, on_event):
         response_list = list() 
-        response = self.chat_session.send_message(f"<USER_INPUT> {message} </USER_INPUT> ")
+        if (budget_response := self.budget_exceeded()) is not None:
+            return budget_response, response_list
+        if self.chat_session.uses_cached_prefix:
+            # Re-registers the prefix only if the persona, instructions or tools changed
+            # or its context cache expired
+            await self.chat_session.set_prefix_async(self.system_prompt())
+        response = await self._send_async(f"<USER_INPUT> {message} </USER_INPUT> ", on_event)
         data = json.loads(response.text)
         response_list.append(data)
 
         idx = (len(data))-1
-        execute_function = data[idx]['execute_function']
-        function = data[idx]['function']
-        function_name = data[idx]['function_name']
-        function_args = data[idx]['function_args']
+        function_calls = [item for item in data if item.get('execute_function') == "True"]
 
-        while execute_function == "True":
+        while function_calls:
             print("\nInternal response: ", str(data[idx]))
-            print("\nNow executing function.\n")
-            function_response = run_function(function, function_name, function_args)
-            response = self.chat_session.send_message(
-                f"Here is the response from your function execution: <SYSTEM_INPUT>{str(function_response)}</SYSTEM_INPUT>", role='user'
-            )
+            print(f"\nNow executing {len(function_calls)} function(s).\n")
+            function_responses = await self.run_functions(function_calls, on_event)
+            if len(function_responses) == 1:
+                message = f"Here is the response from your function execution: <SYSTEM_INPUT>{str(function_responses[0])}</SYSTEM_INPUT>"
+            else:
+                results = "\n".join(
+                    f"{call['function'] or call['function_name']}: {str(function_response)}"
+                    for call, function_response in zip(function_calls, function_responses)
+                )
+                message = f"Here are the responses from your function executions: <SYSTEM_INPUT>{results}</SYSTEM_INPUT>"
+
+            if (budget_response := self.budget_exceeded()) is not None:
+                return budget_response, response_list
+            response = await self._send_async(message, on_event)
             data = json.loads(response.text)
             response_list.append(data)
 
             idx = (len(data))-1
-            execute_function = data[idx]['execute_function']
-            function = data[idx]['function']
-            function_name = data[idx]['function_name']
-            function_args = data[idx]['function_args']
+            function_calls = [item for item in data if item.get('execute_function') == "True"]
 
         return str(data[idx]), response_list
-        # else:
-        #     return response
\ No newline at end of file
@@ -0,0 +1,101 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+
+TOOL_OUTPUT_PATTERN = re.compile(r"<SYSTEM_INPUT>(.*?)</SYSTEM_INPUT>", re.DOTALL)
+COMPACTED_MARKER = "[compacted tool output"
+
+
+class HistoryManager:
+    """
+    Keeps the prompt size of a ChatSession within a token budget.
+
+    The pinned priming messages and the last `keep_last_turns` messages are
+    always kept verbatim. Tool outputs (<SYSTEM_INPUT> blocks) in older messages
+    are collapsed into short stubs, and if the history is still over budget the
+    oldest unpinned messages are dropped.
+
+    Attributes:
+        token_budget: Maximum estimated prompt tokens per request.
+        keep_last_turns: Number of most recent messages kept verbatim.
+        stub_chars: Number of characters of a compacted tool output kept as a preview.
+        chars_per_token: Characters per token used for the token estimate.
+    """
+
+    def __init__(self, token_budget, keep_last_turns=6, stub_chars=200, chars_per_token=4):
+        self.token_budget = token_budget
+        self.keep_last_turns = keep_last_turns
+        self.stub_chars = stub_chars
+        self.chars_per_token = chars_per_token
+        self.dropped_messages = 0
+
+    def estimate_tokens(self, text):
+        """Returns a rough token estimate for a text."""
+        return len(text) // self.chars_per_token + 1
+
+    def history_tokens(self, history):
+        """Returns the estimated token count of a list of Content messages."""
+        return sum(self.estimate_tokens(message_text(message)) for message in history)
+
+    def compact_text(self, text):
+        """Collapses every tool output in a message into a short stub."""
+        def stub(match):
+            output = match.group(1).strip()
+            if len(output) <= self.stub_chars or output.startswith(COMPACTED_MARKER):
+                return match.group(0)
+            return (f"<SYSTEM_INPUT>{COMPACTED_MARKER}, {len(output)} characters omitted] "
+                    f"{output[:self.stub_chars]}...</SYSTEM_INPUT>")
+
+        return TOOL_OUTPUT_PATTERN.sub(stub, text)
+
+    def compact(self, history, pinned=0):
+        """
+        Returns the history reduced to fit the token budget.
+
+        Args:
+            history: The list of Content messages of the session.
+            pinned: Number of leading messages (the priming prefix) that are never touched.
+
+        Returns:
+            A new list of Content messages.
+        """
+        head = history[:pinned]
+        body = history[pinned:]
+        split = max(len(body) - self.keep_last_turns, 0)
+        older, recent = body[:split], body[split:]
+
+        compacted = []
+        for message in older:
+            text = message_text(message)
+            short_text = self.compact_text(text)
+            if short_text != text:
+                # Rebuild the message with the same (backend specific) classes
+                part_class = type(message.parts[0])
+                message = type(message)(role=message.role, parts=[part_class.from_text(short_text)])
+            compacted.append(message)
+
+        budget = self.token_budget - self.history_tokens(head) - self.history_tokens(recent)
+        tokens = self.history_tokens(compacted)
+        while compacted and tokens > budget:
+            tokens -= self.estimate_tokens(message_text(compacted.pop(0)))
+            self.dropped_messages += 1
+
+        return head + compacted + recent
+
+
+def message_text(message):
+    """Returns the concatenated text of a Content message."""
+    return "".join(part.text or "" for part in message.parts)
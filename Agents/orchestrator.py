@@ -12,49 +12,47 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import inspect
+import asyncio
 import json
 import os
 import sys
-from vertexai.generative_models import GenerativeModel
 
 from Tools import return_agent_instruction
+from .agent_pool import AgentPool
+from .agent_registry import AgentRegistry, get_model
+from .tracing import span
 
 # Add the path to your Agents module
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import Agents  
 
 def get_available_agents(model):
-    """Dynamically discovers and returns a dictionary of available agents."""
-    agents = {}
-    for name, obj in inspect.getmembers(Agents):
-        if inspect.isfunction(obj) and name.startswith("get_"):
-            agent_name = name.replace("get_", "")
-            try:
-                # Assuming all agent functions take 'model' as an argument
-                agent = obj(GenerativeModel(model))
-                agents[agent_name] = agent
-            except Exception as e:
-                print(f"Error creating agent {agent_name}: {e}")
-    return agents
+    """
+    Returns a lazy AgentRegistry of the available agents.
+
+    Agents are only constructed when they are first delegated to.
+    """
+    return AgentRegistry(model)
 
 class OrchestratorAgent(Agents.Agent):
     """
     An orchestrator agent that manages and calls other agents using an LLM.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, **session_kwargs):
         """
         Initializes the OrchestratorAgent with an LLM model and available agents.
+
+        Any further keyword arguments (e.g. prefix_mode) are passed on to the ChatSession.
         """
         # Generate tools string dynamically
         agents = get_available_agents(model)
         tools_string = "\nAvailable Agents:\n"
-        for agent_name, agent_instance in agents.items():
-            tools_string += f"- {agent_name}: {agent_instance.instructions}\n"
+        for agent_name, description in agents.descriptions().items():
+            tools_string += f"- {agent_name}: {description}\n"
 
         super().__init__(
-            model=GenerativeModel(model),
+            model=get_model(model),
             response_schema = {
                 "type": "array",
                 "items": {
@@ -91,79 +89,116 @@ class OrchestratorAgent(Agents.Agent):
                        to perform different tasks if needed.""",
             instructions="""Analyze the user's message and determine which agent can best fulfill the request. 
                            Call the appropriate agent and return its response. Summarize what the agent did back to the user in your response. 
+                           If the request needs several agents that do not depend on each other's results, call all of them at once by returning one item per agent. Their responses will be provided back to you together.
                            Do not execute the same agent twice. If the first execution did not return the expected result, return "Something went wrong" to the user.
                            If no agent should be called, set the execute_function parameter to False.
                            Make sure to provide the previous agents' response indicated to you by <SYSTEM_MESSAGE> back to the user to answer the initial query.""",
             tools=tools_string,
+            **session_kwargs,
         )
         self.agents = agents
+        self.agent_pool = AgentPool(agents)
 
 
-    def start_conversation(self):
+    def system_prompt(self):
         """
-        Starts the conversation with the agent by sending the initial prompts.
+        Returns the static priming prompt built from the persona, instructions and agents.
         """
         guidelines = "<SYSTEM_MESSAGE> THIS IS A SYSTEM MESSAGE. BELOW IS YOUR DESCRIPTION FOR OPERATION. FOLLOW THESE INSTRUCTIONS AND AWAIT THE USER INPUT. YOU WILL BE PROVIDED WITH THE FULL CHAT HISTORY. MAKE SURE TO EMPHASIZE THE LATEST USER AND SYSTEM INPUTS MORE. </SYSTEM_MESSAGE> "
         persona_prompt = "<PERSONA>" + self.persona + "</PERSONA>"
         instruction_prompt = "<INSTRUCTIONS>" + self.instructions + "</INSTRUCTIONS>"
         tool_prompt = return_agent_instruction(self.tools)
+        return guidelines + persona_prompt + instruction_prompt + tool_prompt
 
-        response = self.chat_session.send_message(
-            guidelines + persona_prompt + instruction_prompt + tool_prompt
-        )
-        return response.text
+    async def delegate(self, target_agent, agent_prompt, on_event=None):
+        """
+        Sends a prompt to a fresh session of a sub-agent.
 
-    def send_message(self, message):
+        Args:
+            target_agent: The name of the agent, e.g. 'InspectorAgent'.
+            agent_prompt: The message to forward to the agent.
+            on_event: Optional callback for progress events of the sub-agent.
+
+        Returns:
+            A tuple of the agent's response and its internal response list.
+        """
+        with span("agent.delegate", target_agent=target_agent, request_chars=len(agent_prompt)) as delegate_span:
+            agent = await self.agent_pool.acquire_async(target_agent)
+            delegate_span.mark_started()
+            if agent is None:
+                delegate_span.set(failed=True)
+                return f"Agent '{target_agent}' not found.", []
+
+            sub_agent_events = None
+            if on_event is not None:
+                on_event({"type": "progress", "text": f"asking {target_agent}"})
+                # Only the orchestrator's own response is streamed to the user
+                sub_agent_events = lambda event: on_event(event) if event["type"] == "progress" else None
+
+            # The pooled agent is already primed, so no start_conversation is needed
+            try:
+                response, response_list = await agent.send_message_async(agent_prompt, on_event=sub_agent_events)
+            except Exception as e:
+                delegate_span.set(failed=True)
+                return f"Error executing {target_agent}: {e}", []
+            delegate_span.set(response_chars=len(str(response)))
+            return response, response_list
+
+    async def _turn_async(self, message, on_event):
         """
-        Sends a message to the agent and processes the response, potentially
-        executing a tool function if instructed by the agent.
+        Processes a user message, potentially executing one or more agents if
+        instructed by the model (see `Agent.send_message_async`).
+
+        All delegations of one step run concurrently, and their responses are
+        returned to the model in a single message.
         """
         max_loop = 2 
         i = 0 
 
         response_list = list() 
-        response = self.chat_session.send_message(f"<USER_INPUT> {message} </USER_INPUT> ")
+        if (budget_response := self.budget_exceeded()) is not None:
+            return budget_response, response_list
+        if self.chat_session.uses_cached_prefix:
+            await self.chat_session.set_prefix_async(self.system_prompt())
+        response = await self._send_async(f"<USER_INPUT> {message} </USER_INPUT> ", on_event)
         data = json.loads(response.text)
         response_list.append(data)
 
         idx = (len(data))-1
-        execute_agent = data[idx]['execute_agent']
-        target_agent = data[idx]['target_agent']
-        agent_prompt = data[idx]['agent_prompt']
-        user_response = data[idx]['response']
+        delegations = [item for item in data if item.get('execute_agent') == "True" and item.get('target_agent')]
 
-        while execute_agent == "True" and i < max_loop:
+        while delegations and i < max_loop:
             print("\nInternal response: ", str(data[idx]))
-            print("\nNow executing agent.\n")
-
-            if target_agent:
-            # Retrieve the target agent
-                # try: 
-                target_agent = self.agents.get(target_agent)
-                if target_agent:
-                    # Call the target agent's start_conversation and send_message method
-                    response = target_agent.start_conversation()
-                    response, subagents_list = target_agent.send_message(agent_prompt)
-                    response_list.append(subagents_list)
-
-                # except Exception as e: 
-                #     return str(data[idx]), response_list
-
-            response = self.chat_session.send_message(
-                f"Here is the full response from the agent execution: <SYSTEM_INPUT>{str(response)}</SYSTEM_INPUT>"
+            print(f"\nNow executing {len(delegations)} agent(s).\n")
+
+            results = await asyncio.gather(
+                *(self.delegate(item['target_agent'], item['agent_prompt'], on_event) for item in delegations)
             )
+            for _, subagents_list in results:
+                response_list.append(subagents_list)
+
+            if len(results) == 1:
+                message = f"Here is the full response from the agent execution: <SYSTEM_INPUT>{str(results[0][0])}</SYSTEM_INPUT>"
+            else:
+                agent_responses = "\n".join(
+                    f"{item['target_agent']}: {str(agent_response)}"
+                    for item, (agent_response, _) in zip(delegations, results)
+                )
+                message = f"Here are the full responses from the agent executions: <SYSTEM_INPUT>{agent_responses}</SYSTEM_INPUT>"
+
+            if (budget_response := self.budget_exceeded()) is not None:
+                return budget_response, response_list
+            response = await self._send_async(message, on_event)
             
             try: 
                 data = json.loads(response.text)
                 response_list.append(data)
 
                 idx = (len(data))-1
-                execute_agent = data[idx]['execute_agent']
-                target_agent = data[idx]['target_agent']
+                delegations = [item for item in data if item.get('execute_agent') == "True" and item.get('target_agent')]
             
             except: return str(data[idx]['response']), response_list
             
             i+=1 
 
         return str(data[idx]['response']), response_list
-
@@ -0,0 +1,128 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import tempfile
+
+from Tools.python_functions import config
+from .history_manager import message_text
+
+
+# Replay modes:
+#   "off"    - always call the model
+#   "record" - call the model and store every response
+#   "replay" - serve stored responses only; a missing response raises ReplayMissError
+#   "auto"   - serve stored responses and record the missing ones
+REPLAY_MODES = ("off", "record", "replay", "auto")
+
+USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "total_token_count", "cached_content_token_count")
+
+
+class ReplayMissError(LookupError):
+    """Raised in replay mode when no response was recorded for a request."""
+
+
+class RecordedUsage:
+    """The token counts of a recorded response, shaped like Gemini's usage_metadata."""
+
+    def __init__(self, **counts):
+        for field in USAGE_FIELDS:
+            setattr(self, field, counts.get(field, 0))
+
+
+class ReplayStore:
+    """
+    A content-addressed store of model responses for deterministic offline runs.
+
+    Requests are keyed by a hash of everything that determines the output of a
+    temperature 0 request: the model name, the registered prefix, the history,
+    the generation config and the response schema. Responses are stored as JSON
+    files under `directory/<key[:2]>/<key>.json`.
+
+    Attributes:
+        directory: The root directory of the store.
+        mode: One of REPLAY_MODES.
+    """
+
+    def __init__(self, directory, mode="off"):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Unknown replay mode '{mode}'. Valid options are: {REPLAY_MODES}")
+        self.directory = directory
+        self.mode = mode
+
+    @classmethod
+    def from_config(cls):
+        """Creates the store configured by 'llm_replay_mode' and 'llm_replay_dir' in settings.yaml."""
+        # An unquoted `off` in YAML is read as False
+        mode = config.get("llm_replay_mode") or "off"
+        return cls(config.get("llm_replay_dir", ".cache/replay"), mode)
+
+    @property
+    def active(self):
+        return self.mode != "off"
+
+    def request_key(self, model_name, prefix_key, history, generation_config):
+        """
+        Returns the hash identifying a request.
+
+        Args:
+            model_name: The resource name of the model.
+            prefix_key: The hash of the registered agent prefix, or None.
+            history: The list of Content messages sent.
+            generation_config: The GenerationConfig, including the response schema.
+        """
+        request = {
+            "model": model_name,
+            "prefix": prefix_key,
+            "history": [[message.role, message_text(message)] for message in history],
+            "generation_config": generation_config.to_dict(),
+        }
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def load(self, key):
+        """
+        Returns the recorded (text, RecordedUsage) for a key, or None if the
+        mode does not replay or nothing was recorded.
+
+        Raises:
+            ReplayMissError: In replay mode, if nothing was recorded for the key.
+        """
+        if self.mode not in ("replay", "auto"):
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            if self.mode == "replay":
+                raise ReplayMissError(f"No recorded response for request {key} in {self.directory}.")
+            return None
+        return record["text"], RecordedUsage(**record.get("usage", {}))
+
+    def save(self, key, text, usage_metadata=None):
+        """Stores a response if the mode records."""
+        if self.mode not in ("record", "auto"):
+            return
+        usage = {field: getattr(usage_metadata, field, 0) for field in USAGE_FIELDS} if usage_metadata else {}
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically so concurrent runs never read a partial file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), delete=False) as f:
+            json.dump({"text": text, "usage": usage}, f, ensure_ascii=False)
+        os.replace(f.name, path)
@@ -13,68 +13,376 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import copy
+import datetime
+import hashlib
 
-from vertexai.generative_models import (
-    Content,
-    GenerationConfig,
-    Part,
-)
+from Tools.model_backends import get_backend
+from Tools.python_functions import config
+from .history_manager import HistoryManager
+from .replay_store import ReplayStore
+from .tracing import span
+from . import usage
 
 
+# How the static agent prefix (guidelines, persona, instructions, tools) is sent:
+#   "history"            - as the first user message of the history (resent every turn)
+#   "system_instruction" - as the model's system instruction. This keeps the prefix out
+#                          of the history (and its compaction), but it is still sent and
+#                          billed as input tokens with every request.
+#   "context_cache"      - as a Vertex AI context cache, billed at the cached-token price,
+#                          falling back to a system instruction if the cache cannot be
+#                          created (e.g. the prefix is below the minimum cacheable token count)
+PREFIX_MODES = ("history", "system_instruction", "context_cache")
+
+
+class ModelResponse:
+    """
+    A model response assembled by the session (streamed or replayed).
+
+    Attributes:
+        text: The full response text.
+        usage_metadata: The token usage reported for the response.
+    """
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
 
 class ChatSession:
     """
     A simple chat session manager for interacting with a Gemini model.
     """
 
-    def __init__(self, model, response_schema):
+    def __init__(self, model, response_schema, prefix_mode=None, cache_ttl_minutes=None,
+                 history_manager=None, replay_store=None, backend=None):
         """
         Initializes a new chat session.
 
         Args:
-          model: The Gemini GenerativeModel instance.
+          model: The model handle, e.g. a Gemini GenerativeModel.
           response_schema: The schema for the expected response.
+          prefix_mode: How the static agent prefix is sent, one of PREFIX_MODES.
+                       Defaults to the 'chat_prefix_mode' setting.
+          cache_ttl_minutes: Lifetime of a context cache. Defaults to the
+                             'chat_prefix_cache_ttl_minutes' setting.
+          history_manager: A HistoryManager bounding the prompt size. Defaults to one
+                           built from the 'history_token_budget' setting, or none
+                           (unbounded history) if that is not set.
+          replay_store: A ReplayStore to record or replay responses. Defaults to
+                        the one configured by 'llm_replay_mode' in settings.yaml.
+          backend: The ModelBackend the model belongs to. Defaults to the one
+                   configured by 'model_backend' in settings.yaml.
         """
+        if prefix_mode is None:
+            prefix_mode = config.get("chat_prefix_mode", "history")
+        if prefix_mode not in PREFIX_MODES:
+            raise ValueError(f"Unknown prefix_mode '{prefix_mode}'. Valid options are: {PREFIX_MODES}")
+        if cache_ttl_minutes is None:
+            cache_ttl_minutes = config.get("chat_prefix_cache_ttl_minutes", 60)
+        if history_manager is None and config.get("history_token_budget"):
+            history_manager = HistoryManager(
+                token_budget=config["history_token_budget"],
+                keep_last_turns=config.get("history_keep_last_turns", 6),
+            )
+
         self.model = model
+        self.backend = backend if backend is not None else get_backend()
         self.response_schema = response_schema
+        self.prefix_mode = prefix_mode
+        self.cache_ttl = datetime.timedelta(minutes=cache_ttl_minutes)
         self.history = []
+        self.history_manager = history_manager
+        self.replay_store = replay_store if replay_store is not None else ReplayStore.from_config()
+        # Number of leading history messages (the priming prefix) exempt from compaction
+        self.pinned = 0
+
+        self._prefix_key = None
+        self._prefixed_model = None
+        self._cached_content = None
+        self._prefix_chars = 0
+        # The session this one was forked from. Forks share its registered prefix
+        # and never create or delete a context cache of their own.
+        self._template = None
 
-    def send_message(self, message, role='user'):
+    @property
+    def uses_cached_prefix(self):
+        """Whether the agent prefix is registered with the model instead of sent in the history."""
+        return self.prefix_mode != "history"
+
+    def set_prefix(self, prefix):
+        """
+        Registers the static agent prefix with the model.
+
+        The prefix is only (re-)registered when its content changed or its context
+        cache expired, so this is cheap to call before every turn. Only a context
+        cache saves input tokens; a system instruction is sent with every request.
+
+        Args:
+          prefix: The full priming prompt of the agent.
+        """
+        key = self._hash_prefix(prefix)
+        if self._prefix_current(key):
+            return
+
+        self._drop_cached_content()
+        model_name = self.model._model_name
+
+        if self._template is not None:
+            self._adopt_template_prefix(key, prefix)
+            return
+
+        if self.prefix_mode == "context_cache":
+            try:
+                self._cached_content, self._prefixed_model = self.backend.create_cached_model(
+                    model_name, prefix, self.cache_ttl
+                )
+            except Exception as e:
+                print(f"Could not create context cache, using a system instruction instead: {e}")
+                self._cached_content = None
+
+        if self._cached_content is None:
+            self._prefixed_model = self.backend.get_model(model_name, system_instruction=prefix)
+
+        self._prefix_key = key
+        self._prefix_chars = len(prefix)
+
+    async def set_prefix_async(self, prefix):
+        """
+        Awaitable variant of `set_prefix`.
+
+        Creating and deleting a context cache are blocking network calls, so a
+        (re-)registration runs on a worker thread instead of the event loop.
+        """
+        if not self._prefix_current(self._hash_prefix(prefix)):
+            await asyncio.to_thread(self.set_prefix, prefix)
+
+    @staticmethod
+    def _hash_prefix(prefix):
+        return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def _prefix_current(self, key):
+        return key == self._prefix_key and not self._cache_expired()
+
+    def _adopt_template_prefix(self, key, prefix):
+        """
+        Takes over the registered prefix of the template session, which owns and
+        refreshes the context cache (see AgentPool.acquire). If the template has
+        no valid cache for this prefix, a system instruction is used instead.
+        """
+        template = self._template
+        if key == template._prefix_key and not template._cache_expired():
+            self._cached_content = template._cached_content
+            self._prefixed_model = template._prefixed_model
+        else:
+            self._prefixed_model = self.backend.get_model(self.model._model_name, system_instruction=prefix)
+        self._prefix_key = key
+        self._prefix_chars = len(prefix)
+
+    def _cache_expired(self):
+        if self._cached_content is None:
+            return False
+        # Refresh slightly ahead of the expiry so a turn never hits a dropped cache.
+        expire_time = self._cached_content.expire_time
+        return datetime.datetime.now(expire_time.tzinfo) >= expire_time - datetime.timedelta(minutes=1)
+
+    def _drop_cached_content(self):
+        if self._cached_content is not None and self._template is None:
+            try:
+                self._cached_content.delete()
+            except Exception as e:
+                print(f"Could not delete context cache: {e}")
+        self._cached_content = None
+        self._prefixed_model = None
+        self._prefix_key = None
+
+    def fork(self):
+        """
+        Returns a new session that continues from the current state of this one.
+
+        The fork shares the model, the registered prefix and a copy of the
+        history, so forking a primed session requires no model call. The context
+        cache stays owned by the template session that was forked.
+        """
+        forked = copy.copy(self)
+        forked.history = list(self.history)
+        forked.history_manager = copy.copy(self.history_manager)
+        forked._template = self._template if self._template is not None else self
+        return forked
+
+    def add_message(self, message, role='user', pin=False):
+        """
+        Appends a message to the history without calling the model.
+
+        Args:
+          message: The message to append.
+          pin: Whether the message is part of the priming prefix and must never
+               be compacted away.
+        """
+        user_message = self.backend.text_message(role, message)
+        self.history.append(user_message)
+        if pin:
+            self.pinned = len(self.history)
+
+    def generation_config(self):
+        """Returns the GenerationConfig used for every request of the session."""
+        return self.backend.generation_config(
+            temperature=0, 
+            top_k=1,
+            top_p=0.1,
+            response_mime_type="application/json",
+            response_schema=self.response_schema,
+        )
+
+    def _prepare_request(self, message, role, pin):
+        """Appends the message, applies the history budget and returns the model to call."""
+        self.add_message(message, role=role, pin=pin)
+
+        if self.history_manager is not None:
+            self.history = self.history_manager.compact(self.history, self.pinned)
+
+        return self._prefixed_model if self._prefixed_model is not None else self.model
+
+    def _prefix_chars_sent(self):
+        """Returns the characters of the static prefix sent with a request, for the usage ledger."""
+        if self.uses_cached_prefix:
+            return self._prefix_chars
+        return sum(len(part.text or "") for content in self.history[:self.pinned] for part in content.parts)
+
+    def _trace_request(self, llm_span, model, message):
+        if not llm_span.recording:
+            return
+        llm_span.set(
+            model=model._model_name,
+            prefix_mode=self.prefix_mode,
+            history_messages=len(self.history),
+            request_chars=len(message),
+            prompt_chars=sum(len(part.text or "") for content in self.history for part in content.parts),
+        )
+
+    @staticmethod
+    def _trace_response(llm_span, response, replayed=False):
+        if not llm_span.recording:
+            return
+        usage = response.usage_metadata
+        llm_span.set(
+            replayed=replayed,
+            response_chars=len(response.text),
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            cached_tokens=getattr(usage, "cached_content_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+        )
+
+    def _replay_key(self, model):
+        if not self.replay_store.active:
+            return None
+        return self.replay_store.request_key(
+            model._model_name, self._prefix_key, self.history, self.generation_config()
+        )
+
+    def send_message(self, message, role='user', pin=False):
         """
         Sends a message to the model and retrieves the response.
 
         Args:
           message: The message to send to the model.
+          pin: Whether the message is part of the priming prefix and must never
+               be compacted away.
         """
-        user_message = Content(role=role, parts=[Part.from_text(message)])
-        self.history.append(user_message)
+        with span("llm.generate") as llm_span:
+            model = self._prepare_request(message, role, pin)
+            self._trace_request(llm_span, model, message)
+            replay_key = self._replay_key(model)
+            if replay_key is not None:
+                recorded = self.replay_store.load(replay_key)
+                if recorded is not None:
+                    response = ModelResponse(*recorded)
+                    self._trace_response(llm_span, response, replayed=True)
+                    return response
+
+            response = model.generate_content(
+                self.history,
+                generation_config=self.generation_config(),
+            )
+            # llm_message = self.backend.text_message('model', response.text)
+            # self.history.append(llm_message)
+
+            if replay_key is not None:
+                self.replay_store.save(replay_key, response.text, response.usage_metadata)
+            self._trace_response(llm_span, response)
+            usage.record_call(model._model_name, response.usage_metadata, prefix_chars=self._prefix_chars_sent())
+            return response 
 
-        response = self.model.generate_content(
+    async def send_message_async(self, message, role='user', pin=False, on_chunk=None):
+        """
+        Awaitable variant of `send_message`.
+
+        Args:
+          on_chunk: Optional callback. If given, the response is streamed and
+                    the callback is called with every text chunk as it arrives.
+        """
+        with span("llm.generate") as llm_span:
+            model = self._prepare_request(message, role, pin)
+            self._trace_request(llm_span, model, message)
+            replay_key = self._replay_key(model)
+            if replay_key is not None:
+                recorded = self.replay_store.load(replay_key)
+                if recorded is not None:
+                    if on_chunk is not None:
+                        on_chunk(recorded[0])
+                    response = ModelResponse(*recorded)
+                    self._trace_response(llm_span, response, replayed=True)
+                    return response
+
+            if on_chunk is None:
+                response = await model.generate_content_async(
+                    self.history,
+                    generation_config=self.generation_config(),
+                )
+            else:
+                response = await self._stream_async(model, on_chunk, llm_span)
+
+            if replay_key is not None:
+                self.replay_store.save(replay_key, response.text, response.usage_metadata)
+            self._trace_response(llm_span, response)
+            usage.record_call(model._model_name, response.usage_metadata, prefix_chars=self._prefix_chars_sent())
+            return response
+
+    async def _stream_async(self, model, on_chunk, llm_span):
+        chunks = []
+        usage_metadata = None
+        stream = await model.generate_content_async(
             self.history,
-            generation_config=GenerationConfig(
-                temperature=0, 
-                top_k=1,
-                top_p=0.1,
-                response_mime_type="application/json",
-                response_schema=self.response_schema,
-            ),
+            generation_config=self.generation_config(),
+            stream=True,
         )
-        # llm_message = Content(role='model', parts=[Part.from_text(response)])
-        # self.history.append(llm_message)
-
-        return response 
+        async for chunk in stream:
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text, e.g. the final one carrying only the finish reason
+                continue
+            if not chunks:
+                llm_span.set(time_to_first_chunk_ms=llm_span.duration_ms)
+            chunks.append(text)
+            on_chunk(text)
+        return ModelResponse("".join(chunks), usage_metadata)
 
 
 
-def start_chat(model, response_schema):
+def start_chat(model, response_schema, **kwargs):
     """
     Creates a new chat session.
 
     Args:
       model: The Gemini GenerativeModel instance.
       response_schema: The schema for the expected response.
+      **kwargs: Further ChatSession options, e.g. prefix_mode.
 
     Returns:
       A ChatSession instance.
     """
-    return ChatSession(model, response_schema)
\ No newline at end of file
+    return ChatSession(model, response_schema, **kwargs)
@@ -0,0 +1,141 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class ResponseFieldParser:
+    """
+    An incremental parser that extracts one string field from a streamed agent response.
+
+    Agent responses follow the response schemas of this project: a JSON array of
+    objects. The parser is fed the raw text chunks as they arrive and returns the
+    decoded characters of the given field of every array item as soon as they
+    are complete, without waiting for the whole document.
+
+    Attributes:
+        field: The name of the string field to extract, e.g. 'response'.
+        item: The index of the array item currently being parsed.
+    """
+
+    def __init__(self, field="response"):
+        self.field = field
+        self.item = -1
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._unicode = None
+        self._high_surrogate = None
+        self._capture = False
+        self._string = []
+        self._expect_key = False
+        self._key = None
+
+    def feed(self, chunk):
+        """
+        Parses the next chunk of the response.
+
+        Args:
+            chunk: The next piece of the raw JSON text.
+
+        Returns:
+            A list of (item index, text) tuples with the newly decoded characters
+            of the field. Empty if the chunk did not contain any.
+        """
+        deltas = []
+        text = []
+
+        for char in chunk:
+            if self._in_string:
+                decoded = self._string_char(char)
+                if decoded is None:
+                    continue
+                if decoded is False:
+                    # End of the string
+                    if self._capture and text:
+                        deltas.append((self.item, "".join(text)))
+                        text = []
+                    self._end_string()
+                    continue
+                if self._capture:
+                    text.append(decoded)
+                else:
+                    self._string.append(decoded)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string = []
+                # Only capture values of the field of the top-level array items
+                self._capture = (
+                    not self._expect_key
+                    and self._stack == ['[', '{']
+                    and self._key == self.field
+                )
+            elif char in '[{':
+                self._stack.append(char)
+                if char == '{':
+                    self._expect_key = True
+                    if self._stack == ['[', '{']:
+                        self.item += 1
+            elif char in ']}':
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+            elif char == ':':
+                self._expect_key = False
+            elif char == ',':
+                self._expect_key = bool(self._stack) and self._stack[-1] == '{'
+
+        if self._capture and text:
+            deltas.append((self.item, "".join(text)))
+        return deltas
+
+    def _end_string(self):
+        if self._expect_key and self._stack and self._stack[-1] == '{':
+            self._key = "".join(self._string)
+        self._in_string = False
+        self._capture = False
+        self._string = []
+
+    def _string_char(self, char):
+        """Returns the decoded character, None if more input is needed, or False at the closing quote."""
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) < 4:
+                return None
+            code = int(self._unicode, 16)
+            self._unicode = None
+            if 0xD800 <= code < 0xDC00:
+                self._high_surrogate = code
+                return None
+            if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            return chr(code)
+
+        if self._escape:
+            self._escape = False
+            if char == 'u':
+                self._unicode = ""
+                return None
+            return _ESCAPES.get(char, char)
+
+        if char == '\\':
+            self._escape = True
+            return None
+        if char == '"':
+            return False
+        return char
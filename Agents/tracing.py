@@ -0,0 +1,345 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from Tools.python_functions import config
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation of a trace, e.g. a user turn, a model call, a tool execution
+    or a sub-agent delegation.
+
+    Attributes:
+        name: The name of the operation, e.g. 'llm.generate'.
+        trace_id: 32 hex characters shared by all spans of a user turn.
+        span_id: 16 hex characters identifying the span.
+        parent_id: The span_id of the parent span, or None for the root span.
+        start_ns: Start time in nanoseconds since the epoch.
+        end_ns: End time in nanoseconds since the epoch, None while running.
+        attributes: A dictionary of str, int, float or bool values, e.g. token counts
+                    and payload sizes.
+        error: The error message if the operation raised, else None.
+    """
+
+    recording = True
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        """Sets attributes of the span. None values are skipped."""
+        self.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+    def mark_started(self):
+        """
+        Marks the end of the waiting phase (e.g. for a semaphore or a pool slot),
+        recorded as the 'queue_time_ms' attribute.
+        """
+        self.attributes["queue_time_ms"] = (time.time_ns() - self.start_ns) / 1e6
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NonRecordingSpan:
+    """Stands in for the spans of unsampled traces, so instrumented code needs no checks."""
+
+    recording = False
+    duration_ms = 0.0
+
+    def set(self, **attributes):
+        pass
+
+    def mark_started(self):
+        pass
+
+
+NON_RECORDING_SPAN = NonRecordingSpan()
+
+
+########################################################################################################################
+# EXPORTERS
+########################################################################################################################
+
+class FileExporter:
+    """Appends every finished span as one JSON line to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans, service_name="ascm"):
+    """Returns the spans as an OTLP/JSON ExportTraceServiceRequest."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "ascm.agents"},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,  # SPAN_KIND_INTERNAL
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }],
+    }
+
+
+class OTLPJsonExporter:
+    """
+    Exports traces in the OTLP/JSON format.
+
+    With an endpoint (e.g. 'http://localhost:4318/v1/traces' of an OpenTelemetry
+    collector) every trace is posted to it, otherwise it is appended as one JSON
+    line to a file.
+    """
+
+    def __init__(self, endpoint=None, path=None, service_name="ascm", timeout=5.0):
+        if endpoint is None and path is None:
+            raise ValueError("OTLPJsonExporter needs an endpoint or a path.")
+        self.endpoint = endpoint
+        self.path = path
+        self.service_name = service_name
+        self.timeout = timeout
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, spans):
+        payload = to_otlp(spans, self.service_name)
+        if self.endpoint is not None:
+            import httpx
+            httpx.post(self.endpoint, json=payload, timeout=self.timeout).raise_for_status()
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(payload) + "\n")
+
+
+########################################################################################################################
+# TRACER
+########################################################################################################################
+
+class Tracer:
+    """
+    Creates spans and hands every finished trace to the exporters.
+
+    Spans nest through a context variable, so the spans of concurrent tool calls
+    and delegations (asyncio tasks copy the context) get the right parent. The
+    sampling decision is made once per trace at its root span. Exports run on a
+    background thread, so a slow collector never blocks the event loop.
+
+    Attributes:
+        exporters: Objects with an `export(spans)` method.
+        sample_rate: The fraction of traces that are recorded, between 0 and 1.
+    """
+
+    def __init__(self, exporters=(), sample_rate=1.0):
+        self.exporters = list(exporters)
+        self.sample_rate = sample_rate
+        self._traces = {}
+        self._lock = threading.Lock()
+        self._queue = None
+
+    @property
+    def enabled(self):
+        return bool(self.exporters) and self.sample_rate > 0
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Runs the body of the with statement in a child span of the current span.
+
+        Yields:
+            The Span, or a NonRecordingSpan if the trace is not sampled.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            sampled = self.enabled and random.random() < self.sample_rate
+            if not sampled:
+                token = _current_span.set(NON_RECORDING_SPAN)
+                try:
+                    yield NON_RECORDING_SPAN
+                finally:
+                    _current_span.reset(token)
+                return
+            span = Span(name, f"{random.getrandbits(128):032x}", None, attributes)
+            with self._lock:
+                self._traces[span.trace_id] = []
+        elif not parent.recording:
+            yield parent
+            return
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                # A span that outlived its root, e.g. of a detached task
+                return
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._traces[span.trace_id]
+        self._submit(spans)
+
+    def _submit(self, spans):
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                threading.Thread(target=self._export_forever, name="trace-exporter", daemon=True).start()
+                atexit.register(self.flush)
+        self._queue.put(spans)
+
+    def _export_forever(self):
+        while True:
+            spans = self._queue.get()
+            try:
+                for exporter in self.exporters:
+                    try:
+                        exporter.export(spans)
+                    except Exception as e:
+                        print(f"Could not export trace with {type(exporter).__name__}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Blocks until all finished traces are exported."""
+        if self._queue is not None:
+            self._queue.join()
+
+
+def current_span():
+    """Returns the active span, or a NonRecordingSpan outside of a recorded trace."""
+    return _current_span.get() or NON_RECORDING_SPAN
+
+
+########################################################################################################################
+# TRACER SELECTION
+########################################################################################################################
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def tracer_from_config():
+    """
+    Builds the tracer configured in settings.yaml:
+        tracing_exporter: none | file | otlp
+        tracing_file: The output file of the file exporter (and of the otlp exporter without endpoint).
+        tracing_otlp_endpoint: The OTLP/HTTP traces endpoint of a collector.
+        tracing_sample_rate: The fraction of user turns that are traced.
+    """
+    exporter = config.get("tracing_exporter") or "none"
+    path = config.get("tracing_file", ".cache/traces.jsonl")
+    if exporter == "none":
+        exporters = []
+    elif exporter == "file":
+        exporters = [FileExporter(path)]
+    elif exporter == "otlp":
+        exporters = [OTLPJsonExporter(endpoint=config.get("tracing_otlp_endpoint"), path=path)]
+    else:
+        raise ValueError(f"Unknown tracing_exporter '{exporter}'. Valid options are: none, file, otlp")
+    return Tracer(exporters, sample_rate=config.get("tracing_sample_rate", 1.0))
+
+
+def get_tracer():
+    """Returns the process-wide tracer configured in settings.yaml."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = tracer_from_config()
+        return _tracer
+
+
+def set_tracer(tracer):
+    """Replaces the process-wide tracer, e.g. with one exporting to a test file."""
+    global _tracer
+    with _tracer_lock:
+        _tracer = tracer
+
+
+def span(name, **attributes):
+    """Shortcut for `get_tracer().span(...)`."""
+    return get_tracer().span(name, **attributes)
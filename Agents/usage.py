@@ -0,0 +1,251 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import contextlib
+import contextvars
+import threading
+
+from Tools.python_functions import config
+
+
+_active_ledger = contextvars.ContextVar("active_ledger", default=None)
+_active_agent = contextvars.ContextVar("active_agent", default=None)
+
+
+class TokenUsage:
+    """
+    Token counts and cost of a group of model calls.
+
+    Attributes:
+        calls: The number of model calls.
+        prompt_tokens: Input tokens, including the cached ones.
+        cached_tokens: Input tokens served from a context cache.
+        prefix_tokens: Estimated input tokens of the static agent prefix.
+        cached_prefix_tokens: The part of prefix_tokens served from a context cache.
+        output_tokens: Generated tokens.
+        cost: The cost in USD according to the 'token_prices' setting.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefix_tokens = 0
+        self.cached_prefix_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.output_tokens
+
+    def add(self, prompt_tokens, cached_tokens, output_tokens, cost, prefix_tokens=0, cached_prefix_tokens=0):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.prefix_tokens += prefix_tokens
+        self.cached_prefix_tokens += cached_prefix_tokens
+        self.output_tokens += output_tokens
+        self.cost += cost
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "prefix_tokens": self.prefix_tokens,
+            "cached_prefix_tokens": self.cached_prefix_tokens,
+            "uncached_prefix_tokens": self.prefix_tokens - self.cached_prefix_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class UsageLedger:
+    """
+    Token accounting and budgets of one user session (e.g. one OrchestratorAgent).
+
+    The ledger of the agent that receives the user message is active for the
+    whole turn, so the model calls of sub-agents are booked on it too, under
+    their own agent name. Tool results are booked with the tokens they add to
+    the prompt of the following model calls.
+
+    Attributes:
+        session_token_budget: Maximum tokens of the session, or None for no limit.
+        turn_token_budget: Maximum tokens of one user turn, or None for no limit.
+        session_cost_budget: Maximum cost of the session in USD, or None for no limit.
+        prices: A dictionary of model name to USD per million 'input', 'cached_input'
+                and 'output' tokens.
+        chars_per_token: Used to estimate the tokens of tool results and agent prefixes.
+        total: The TokenUsage of the whole session.
+        by_agent: A dictionary of agent name to TokenUsage.
+        by_tool: A dictionary of tool name to a dictionary with its 'calls' and 'result_tokens'.
+        records: Per-call records (agent, model and token counts) of the session.
+    """
+
+    def __init__(self, session_token_budget=None, turn_token_budget=None, session_cost_budget=None,
+                 prices=None, chars_per_token=4):
+        self.session_token_budget = session_token_budget
+        self.turn_token_budget = turn_token_budget
+        self.session_cost_budget = session_cost_budget
+        self.prices = prices or {}
+        self.chars_per_token = chars_per_token
+        self.total = TokenUsage()
+        self.by_agent = collections.defaultdict(TokenUsage)
+        self.by_tool = collections.defaultdict(lambda: {"calls": 0, "result_tokens": 0})
+        self.records = []
+        self._turn_start_tokens = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """Creates a ledger with the budgets and prices configured in settings.yaml."""
+        return cls(
+            session_token_budget=config.get("session_token_budget"),
+            turn_token_budget=config.get("turn_token_budget"),
+            session_cost_budget=config.get("session_cost_budget"),
+            prices=config.get("token_prices"),
+        )
+
+    def cost(self, model_name, prompt_tokens, cached_tokens, output_tokens):
+        """
+        Returns the cost of a model call in USD, or 0 if the model has no configured price.
+
+        The model name may be a full resource path (e.g.
+        'publishers/google/models/gemini-1.5-pro-001'); prices are looked up by its last segment.
+        """
+        price = self.prices.get(model_name) or self.prices.get(model_name.rsplit("/", 1)[-1])
+        if not price:
+            return 0.0
+        uncached_tokens = prompt_tokens - cached_tokens
+        return (
+            uncached_tokens * price.get("input", 0)
+            + cached_tokens * price.get("cached_input", price.get("input", 0))
+            + output_tokens * price.get("output", 0)
+        ) / 1_000_000
+
+    def record_call(self, agent_name, model_name, usage_metadata, prefix_chars=0):
+        """
+        Books a model call from its usage_metadata.
+
+        Args:
+            prefix_chars: The characters of the static agent prefix sent with the
+                          call. Its tokens are estimated and booked as cached as far
+                          as the call was served from a context cache.
+        """
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        prefix_tokens = prefix_chars // self.chars_per_token
+        cached_prefix_tokens = min(cached_tokens, prefix_tokens)
+        cost = self.cost(model_name, prompt_tokens, cached_tokens, output_tokens)
+        with self._lock:
+            self.total.add(prompt_tokens, cached_tokens, output_tokens, cost, prefix_tokens, cached_prefix_tokens)
+            self.by_agent[agent_name].add(
+                prompt_tokens, cached_tokens, output_tokens, cost, prefix_tokens, cached_prefix_tokens
+            )
+            self.records.append({
+                "agent": agent_name,
+                "model": model_name,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "prefix_tokens": prefix_tokens,
+                "cached_prefix_tokens": cached_prefix_tokens,
+                "output_tokens": output_tokens,
+                "cost": cost,
+            })
+
+    def record_tool(self, tool_name, result):
+        """Books a tool call with the estimated prompt tokens of its result."""
+        with self._lock:
+            self.by_tool[tool_name]["calls"] += 1
+            self.by_tool[tool_name]["result_tokens"] += len(str(result)) // self.chars_per_token
+
+    def start_turn(self):
+        """Starts counting the tokens of a new user turn for the turn budget."""
+        self._turn_start_tokens = self.total.total_tokens
+
+    def exceeded(self):
+        """
+        Returns a description of the exceeded budget, or None while all budgets hold.
+        """
+        total_tokens = self.total.total_tokens
+        if self.session_token_budget is not None and total_tokens >= self.session_token_budget:
+            return f"the session token budget ({total_tokens} of {self.session_token_budget} tokens used)"
+        turn_tokens = total_tokens - self._turn_start_tokens
+        if self.turn_token_budget is not None and turn_tokens >= self.turn_token_budget:
+            return f"the token budget of this request ({turn_tokens} of {self.turn_token_budget} tokens used)"
+        if self.session_cost_budget is not None and self.total.cost >= self.session_cost_budget:
+            return f"the session cost budget (${self.total.cost:.4f} of ${self.session_cost_budget:.4f} used)"
+        return None
+
+    def report(self):
+        """Returns the aggregated usage of the session by agent and by tool, highest spend first."""
+        with self._lock:
+            return {
+                "total": self.total.to_dict(),
+                "by_agent": {
+                    name: usage.to_dict()
+                    for name, usage in sorted(self.by_agent.items(), key=lambda item: -item[1].total_tokens)
+                },
+                "by_tool": {
+                    name: dict(usage)
+                    for name, usage in sorted(self.by_tool.items(), key=lambda item: -item[1]["result_tokens"])
+                },
+            }
+
+
+@contextlib.contextmanager
+def bind(ledger, agent_name):
+    """
+    Books the model and tool calls made in the body of the with statement under
+    the given agent.
+
+    The ledger only becomes active if no ledger is active yet, so sub-agents
+    book on the ledger of the session that delegated to them.
+
+    Yields:
+        The active ledger.
+    """
+    ledger_token = None
+    if _active_ledger.get() is None:
+        ledger_token = _active_ledger.set(ledger)
+    agent_token = _active_agent.set(agent_name)
+    try:
+        yield _active_ledger.get()
+    finally:
+        _active_agent.reset(agent_token)
+        if ledger_token is not None:
+            _active_ledger.reset(ledger_token)
+
+
+def active_ledger():
+    """Returns the ledger of the current turn, or None outside of an agent turn."""
+    return _active_ledger.get()
+
+
+def record_call(model_name, usage_metadata, prefix_chars=0):
+    """Books a model call on the active ledger, if any."""
+    ledger = _active_ledger.get()
+    if ledger is not None and usage_metadata is not None:
+        ledger.record_call(_active_agent.get(), model_name, usage_metadata, prefix_chars)
+
+
+def record_tool(tool_name, result):
+    """Books a tool call on the active ledger, if any."""
+    ledger = _active_ledger.get()
+    if ledger is not None:
+        ledger.record_tool(tool_name, result)
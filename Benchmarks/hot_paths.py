@@ -0,0 +1,257 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks of the agent framework hot paths, run against local fakes.
+
+Usage (from the repository root):
+    python -m Benchmarks.hot_paths                    # run and compare against the baseline
+    python -m Benchmarks.hot_paths --save-baseline    # run and store the results as the new baseline
+    python -m Benchmarks.hot_paths --only dispatch    # run the benchmarks whose name contains 'dispatch'
+
+The model calls go to a zero-latency ScriptedBackend, so only the framework's
+own overhead is measured. Results are written as JSON; the run exits with
+status 1 if any benchmark is slower than the baseline by more than the tolerance,
+and with status 2 if there is no baseline to compare against.
+
+Benchmarks/baseline.json is committed with the repository. Timings depend on the
+machine, so refresh it with --save-baseline on the machine that runs the
+comparison (e.g. the CI runner) and commit it along with intended performance changes.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The tools read their data files relative to the repository root
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from Tools.model_backends import ScriptedBackend, set_backend
+
+set_backend(ScriptedBackend())
+
+import Agents
+from Agents.agent_registry import get_model
+from Agents.session_handler import start_chat
+from Tools import TOOL_REGISTRY, args_string_to_dict, return_tool_instruction, run_function
+from Tools.python_functions import getBOM, get_preference_status
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, "results", "latest.json")
+
+AGENT_RESPONSE = json.dumps([
+    {
+        "understanding": "The user needs an engine maintenance slot.",
+        "chain_of_thought": "I need the employees and both calendars before I can propose slots. " * 4,
+        "response": "",
+        "function": "get_upcoming_events('workshop')",
+        "function_name": "get_upcoming_events",
+        "function_args": "'workshop'",
+        "execute_function": "True",
+    }
+] * 3)
+
+TOOL_OUTPUT = json.dumps([{"summary": "Engine maintenance", "start": {"dateTime": "2024-10-01T09:00:00Z"}}] * 20)
+
+
+def bench_echo(query, top_k=3):
+    """A no-op tool to measure dispatch overhead."""
+    return query
+
+
+TOOL_REGISTRY.register(bench_echo)
+
+
+def measure(function, min_time=0.2, repeat=5):
+    """
+    Times a function like timeit: calibrates the number of calls per round so a
+    round takes at least min_time, then returns per-call statistics over `repeat` rounds.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10 or number >= 1_000_000:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+
+    return {
+        "median_us": statistics.median(rounds),
+        "min_us": min(rounds),
+        "max_us": max(rounds),
+        "calls_per_round": number,
+        "rounds": repeat,
+    }
+
+
+########################################################################################################################
+# BENCHMARKS
+########################################################################################################################
+
+def bench_args_string_to_dict():
+    return measure(lambda: args_string_to_dict("'Engine Maintenance, Structural Repair', top_k=5, valid_on='2024-10-01'"))
+
+
+def bench_run_function_dispatch():
+    return measure(lambda: run_function("bench_echo('a, b = c', top_k=5)", "bench_echo", ""))
+
+
+def bench_run_function_fallback_args():
+    return measure(lambda: run_function("", "bench_echo", "'a, b = c', top_k=5"))
+
+
+def bench_agent_system_prompt():
+    agent = Agents.get_ScheduleAgent(get_model("gemini-1.5-pro-001"))
+    return measure(agent.system_prompt)
+
+
+def bench_return_tool_instruction():
+    agent = Agents.get_DocumentAgent(get_model("gemini-1.5-pro-001"))
+    return measure(lambda: return_tool_instruction(agent.tools))
+
+
+def bench_json_loads_agent_response():
+    return measure(lambda: json.loads(AGENT_RESPONSE))
+
+
+def bench_getbom_uncached():
+    return measure(getBOM.__wrapped__, min_time=0.5)
+
+
+def bench_get_preference_status_uncached():
+    return measure(get_preference_status.__wrapped__, min_time=0.5)
+
+
+def _history_turn_cost(turns):
+    """Returns the cost of one send_message after `turns` tool round-trips."""
+    session = start_chat(get_model("gemini-1.5-pro-001"), {"type": "array"})
+    for _ in range(turns):
+        session.send_message(f"Here is the response from your function execution: <SYSTEM_INPUT>{TOOL_OUTPUT}</SYSTEM_INPUT>")
+    history = list(session.history)
+
+    def turn():
+        session.history = list(history)
+        session.send_message("<USER_INPUT> next </USER_INPUT>")
+
+    return measure(turn)
+
+
+def bench_chat_history_turn_10():
+    return _history_turn_cost(10)
+
+
+def bench_chat_history_turn_200():
+    return _history_turn_cost(200)
+
+
+def bench_orchestrator_construction():
+    return measure(lambda: Agents.OrchestratorAgent(model="gemini-1.5-pro-001"), min_time=0.5)
+
+
+BENCHMARKS = {
+    name[len("bench_"):]: function
+    for name, function in sorted(globals().items())
+    if name.startswith("bench_") and callable(function) and function is not bench_echo
+}
+
+
+########################################################################################################################
+# RUNNER
+########################################################################################################################
+
+def compare(results, baseline, tolerance):
+    """Returns the names of the benchmarks that regressed against the baseline."""
+    regressions = []
+    print(f"\n{'benchmark':<40}{'median (us)':>14}{'baseline (us)':>16}{'change':>10}")
+    for name, result in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            print(f"{name:<40}{result['median_us']:>14.2f}{'-':>16}{'new':>10}")
+            continue
+        change = result["median_us"] / previous["median_us"] - 1
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{result['median_us']:>14.2f}{previous['median_us']:>16.2f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="The baseline JSON to compare against.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a regression is reported.")
+    args = parser.parse_args(argv)
+
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"No baseline found at {args.baseline}; run with --save-baseline to create one.", file=sys.stderr)
+        return 2
+
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "benchmarks": {},
+    }
+    for name, function in BENCHMARKS.items():
+        if args.only and args.only not in name:
+            continue
+        print(f"Running {name}...")
+        results["benchmarks"][name] = function()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
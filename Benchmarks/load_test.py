@@ -0,0 +1,315 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Concurrent-user load test of the OrchestratorAgent against fake model and tool backends.
+
+Every simulated technician gets their own orchestrator session and runs scripted
+conversations (image inspection, manual search, engine maintenance scheduling
+and customs preference lookup) on one event loop. Model and tool latencies are
+drawn from log-normal distributions given by their median and p99.
+
+Usage (from the repository root):
+    python -m Benchmarks.load_test --users 200 --turns 4
+    python -m Benchmarks.load_test --users 50 --model-median-ms 800 --model-p99-ms 4000 --tool-median-ms 150
+
+Reports throughput, p50/p95/p99 latency of user turns, sub-agent delegations,
+model calls and tool calls, the tail amplification between those layers, and
+the memory held per session.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from Tools.model_backends import ScriptedBackend, ScriptedModel, set_backend
+
+import Agents
+from Tools import TOOL_REGISTRY
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "load_test.json")
+
+# name: (user message, target agent, function calls of the sub-agent)
+SCENARIOS = {
+    "inspection": (
+        "I need to inspect an aircraft image: Files/TL-2000_StingSport.jpg",
+        "InspectorAgent",
+        ["analyze_image('Files/TL-2000_StingSport.jpg')"],
+    ),
+    "manual_search": (
+        "What does the maintenance manual of the TL-2000 StingSport say about the engine oil change?",
+        "DocumentAgent",
+        ["search_manuals('TL-2000 StingSport engine oil change')"],
+    ),
+    "scheduling": (
+        "I need to schedule for Engine Maintenance.",
+        "ScheduleAgent",
+        ["find_qualified_employees('Engine Maintenance')", "get_upcoming_events('workshop')", "get_upcoming_events('John Smith')"],
+    ),
+    "customs": (
+        "Is the wing slat of the TL Sting Sport 2000 eligible for preferential treatment in the EU?",
+        "CustomsAgent",
+        ["getBOM()", "get_preference_status()"],
+    ),
+}
+
+
+def percentile(values, q):
+    """Returns the q-th percentile (0-100) of a list using linear interpolation."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def lognormal(median_ms, p99_ms):
+    """Returns a sampler of seconds from a log-normal distribution with the given median and p99."""
+    mu = math.log(max(median_ms, 1e-3) / 1000)
+    sigma = max(math.log(max(p99_ms, median_ms) / max(median_ms, 1e-3)) / 2.326, 0.0)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class Recorder:
+    """Collects latency samples per layer."""
+
+    def __init__(self):
+        self.samples = {"turn": [], "delegation": [], "model": [], "tool": []}
+
+    @contextlib.contextmanager
+    def timed(self, layer):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[layer].append(time.perf_counter() - start)
+
+    def summary(self, layer):
+        values = self.samples[layer]
+        return {
+            "count": len(values),
+            "mean_ms": statistics.fmean(values) * 1000 if values else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000 if values else 0.0,
+        }
+
+
+RECORDER = Recorder()
+
+
+########################################################################################################################
+# FAKE MODEL
+########################################################################################################################
+
+def _text(content):
+    return "".join(part.text or "" for part in getattr(content, "parts", []))
+
+
+def _item(schema_properties, response="", **fields):
+    item = {"understanding": "Scripted understanding.", "chain_of_thought": "Scripted chain of thought.", "response": response}
+    if "target_agent" in schema_properties:
+        item.update({"target_agent": "", "agent_prompt": "", "execute_agent": "False"})
+    else:
+        item.update({"function": "", "function_name": "", "function_args": "", "execute_function": "False"})
+    item.update(fields)
+    return item
+
+
+def script(model_name, contents, generation_config):
+    """Plays the orchestrator and sub-agent side of the scenarios."""
+    schema = generation_config.to_dict().get("response_schema") if generation_config else None
+    if not schema or not isinstance(contents, list):
+        # analyze_image
+        return [{"image_description": "The left wing slat shows a dent.", "damaged": True}]
+
+    properties = schema["items"]["properties"]
+    last = _text(contents[-1])
+    if "<USER_INPUT>" not in last:
+        return [_item(properties, response="Here is the summary of the results: " + last[-120:])]
+
+    scenario = next((value for value in SCENARIOS.values() if value[0] in last), None)
+    if scenario is None:
+        return [_item(properties, response="How can I help you?")]
+    message, target_agent, calls = scenario
+
+    if "target_agent" in properties:
+        return [_item(properties, target_agent=target_agent, agent_prompt=message, execute_agent="True")]
+    return [
+        _item(properties, function=call, function_name=call.split("(")[0], execute_function="True")
+        for call in calls
+    ]
+
+
+class TimedScriptedBackend(ScriptedBackend):
+    """A ScriptedBackend that records the wall time of every model call."""
+
+    def get_model(self, model_name, system_instruction=None):
+        return TimedScriptedModel(self, model_name, system_instruction)
+
+
+class TimedScriptedModel(ScriptedModel):
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        with RECORDER.timed("model"):
+            return await super().generate_content_async(contents, generation_config, stream=stream, **kwargs)
+
+
+########################################################################################################################
+# FAKE TOOLS
+########################################################################################################################
+
+FAKE_RESULTS = {
+    "analyze_image": ("The left wing slat shows a dent.", True),
+    "search_manuals": "Filename: TL-2000 Maintenance Manual, pageNumber: 42, searchResult: Change the engine oil every 50 hours.",
+    "get_employees": [
+        {"Employee Name": "John Smith", "License Held": "A&P (Airframe & Powerplant)",
+         "License Expiration Date": "2025-12-15", "Specialization": "Engine Maintenance"},
+    ],
+    "find_qualified_employees": ["John Smith"],
+    "get_upcoming_events": [{"summary": "Busy", "start": {"date": "2024-10-01"}, "end": {"date": "2024-10-02"}}] * 10,
+    "getBOM": [{"Product ID": 100, "Name": "Slat for Airplane wings TL 2000 Sting Sport", "Origin": "DE"}] * 10,
+    "get_preference_status": [{"MATNR": 100, "GZOLX": "EU", "PREFE": "E", "PREDA": "30.09.2024"}] * 4,
+}
+
+
+def install_fake_tools(sample_latency, rng):
+    """Replaces the scenario tools in the TOOL_REGISTRY with fakes of the given latency."""
+    for name, result in FAKE_RESULTS.items():
+        def make(result):
+            async def fake_async(*args, **kwargs):
+                with RECORDER.timed("tool"):
+                    await asyncio.sleep(sample_latency(rng))
+                return result
+
+            def fake(*args, **kwargs):
+                return asyncio.run(fake_async(*args, **kwargs))
+            return fake, fake_async
+
+        fake, fake_async = make(result)
+        TOOL_REGISTRY.register(fake, name=name, async_function=fake_async)
+
+
+class TimedOrchestratorAgent(Agents.OrchestratorAgent):
+    """An OrchestratorAgent that records the wall time of every delegation."""
+
+    async def delegate(self, target_agent, agent_prompt, on_event=None):
+        with RECORDER.timed("delegation"):
+            return await super().delegate(target_agent, agent_prompt, on_event)
+
+
+########################################################################################################################
+# RUNNER
+########################################################################################################################
+
+async def simulate_user(user_id, orchestrator, turns, think_time):
+    scenarios = list(SCENARIOS.values())
+    for turn in range(turns):
+        message = scenarios[(user_id + turn) % len(scenarios)][0]
+        with RECORDER.timed("turn"):
+            await orchestrator.send_message_async(message)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+async def run(args):
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    orchestrators = [TimedOrchestratorAgent(model="gemini-1.5-pro-001") for _ in range(args.users)]
+    for orchestrator in orchestrators:
+        await orchestrator.start_conversation_async()
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await asyncio.gather(*(
+            simulate_user(user_id, orchestrator, args.turns, args.think_time_ms / 1000)
+            for user_id, orchestrator in enumerate(orchestrators)
+        ))
+    elapsed = time.perf_counter() - start
+
+    memory_after, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, (memory_after - memory_before) / args.users, memory_peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="Number of simultaneous users.")
+    parser.add_argument("--turns", type=int, default=4, help="Conversation turns per user.")
+    parser.add_argument("--think-time-ms", type=float, default=0.0, help="Pause between the turns of a user.")
+    parser.add_argument("--model-median-ms", type=float, default=50.0)
+    parser.add_argument("--model-p99-ms", type=float, default=200.0)
+    parser.add_argument("--tool-median-ms", type=float, default=20.0)
+    parser.add_argument("--tool-p99-ms", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON report.")
+    args = parser.parse_args(argv)
+
+    backend = TimedScriptedBackend(
+        script=script,
+        latency=lognormal(args.model_median_ms, args.model_p99_ms),
+        seed=args.seed,
+    )
+    set_backend(backend)
+    install_fake_tools(lognormal(args.tool_median_ms, args.tool_p99_ms), backend.random)
+
+    elapsed, memory_per_session, memory_peak = asyncio.run(run(args))
+
+    layers = {layer: RECORDER.summary(layer) for layer in RECORDER.samples}
+    turn, delegation, model, tool = (layers[name] for name in ("turn", "delegation", "model", "tool"))
+    report = {
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": turn["count"] / elapsed if elapsed else 0.0,
+        "model_calls": backend.calls,
+        "memory_per_session_kb": memory_per_session / 1024,
+        "memory_peak_mb": memory_peak / 1024 / 1024,
+        "latency": layers,
+        # How much the p99/p50 spread grows from one layer of the chain to the next
+        "tail_amplification": {
+            f"{layer}_p99_over_p50": (values["p99_ms"] / values["p50_ms"]) if values["p50_ms"] else 0.0
+            for layer, values in layers.items()
+        },
+    }
+
+    print(f"\n{args.users} users x {args.turns} turns in {elapsed:.2f}s "
+          f"-> {report['throughput_turns_per_s']:.1f} turns/s, {backend.calls} model calls")
+    print(f"Memory per session: {report['memory_per_session_kb']:.1f} KiB (peak {report['memory_peak_mb']:.1f} MiB)\n")
+    print(f"{'layer':<12}{'count':>8}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}{'p99/p50':>10}")
+    for layer, values in layers.items():
+        print(f"{layer:<12}{values['count']:>8}{values['p50_ms']:>12.1f}{values['p95_ms']:>12.1f}"
+              f"{values['p99_ms']:>12.1f}{report['tail_amplification'][f'{layer}_p99_over_p50']:>10.2f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
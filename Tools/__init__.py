@@ -13,72 +13,53 @@
 # limitations under the License.
 
 
-import re
-import ast
-import importlib
+from Tools import python_functions
 from Tools.python_functions import *
 from Tools.tool_instructions import return_tool_instruction, return_agent_instruction
+from Tools.tool_registry import ToolCallError, ToolRegistry, parse_args
 
 
-__all__ = ["return_tool_instruction", "return_agent_instruction"]
-
+__all__ = ["return_tool_instruction", "return_agent_instruction", "run_function", "run_function_async",
+           "ToolCallError", "ToolRegistry", "TOOL_REGISTRY"]
 
 
+# Built once at import; dispatch is a dictionary lookup plus a signature bind
+TOOL_REGISTRY = ToolRegistry.from_module(python_functions)
 
 
 def args_string_to_dict(args_string):
-    args_dict = {}
-    positional_arg_count = 0
+    """
+    Parses a function_args string such as "'workshop', days=30".
+
+    Returns:
+        A dictionary of the keyword arguments, with the positional arguments
+        under 'arg_list', or None if there are no arguments.
+
+    Arguments that are not valid call syntax are split on commas (see parse_args).
 
+    Raises:
+        ToolCallError: If an argument in call syntax is not a literal value.
+    """
     if args_string == '' or args_string == "":
         return None
 
-    for arg in args_string.split(","):
-        arg = arg.strip()
-        if "=" in arg:
-            key, value_str = arg.split("=")
-            try:
-                args_dict[key.strip()] = ast.literal_eval(value_str.strip())
-            except (ValueError, SyntaxError):
-                print(f"Warning: Could not parse argument: {arg}")
-        else:
-            # Directly append positional arguments to a list
-            if "arg_list" not in args_dict:
-                args_dict["arg_list"] = []
-            args_dict["arg_list"].append(arg) 
-
+    args, kwargs = parse_args("f", args_string)
+    args_dict = dict(kwargs)
+    if args:
+        args_dict["arg_list"] = args
     return args_dict
 
 
 def run_function(function, function_name, function_args):
-    try:
-        args = args_string_to_dict(function_args)
-
-        module_name = "Tools"
-        module = importlib.import_module(module_name)
-        function_to_call = getattr(module, function_name, None)
-
-        if function_to_call:
-            try:
-                if args == None: 
-                    result = function_to_call()
-                # If there are positional arguments, unpack them
-                elif "arg_list" in args:
-                    result = function_to_call(*args["arg_list"]) 
-                else:
-                    result = function_to_call(**args)
-                return result
-
-            except (SyntaxError, NameError, ValueError) as e:
-                return f"Error parsing arguments: {e}"
-        else:
-            return f"Function '{function_name}' not found in module '{module_name}'."
-
-    except ImportError:
-        return f"Module '{module_name}' not found."
-
-
+    """Runs a function call from an agent through the TOOL_REGISTRY."""
+    return TOOL_REGISTRY.run(function, function_name, function_args)
 
-    
 
+async def run_function_async(function, function_name, function_args):
+    """
+    Awaitable variant of `run_function`.
 
+    Uses the `<function_name>_async` implementation of a tool if there is one,
+    and otherwise runs the synchronous tool on a worker thread.
+    """
+    return await TOOL_REGISTRY.run_async(function, function_name, function_args)
@@ -0,0 +1,62 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+
+
+_loop = None
+_lock = threading.Lock()
+
+
+def background_loop():
+    """
+    Returns the process-wide event loop used by the synchronous API.
+
+    The loop runs forever on a daemon thread. Keeping a single loop (instead of
+    a new one per asyncio.run) lets loop-bound clients such as the async gRPC
+    channels of GenerativeModel and pooled HTTP clients be reused across calls.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="agents-event-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def run_sync(coroutine):
+    """
+    Runs a coroutine on the background event loop and blocks until it is done.
+
+    Args:
+        coroutine: The coroutine to run.
+
+    Returns:
+        The result of the coroutine.
+
+    Raises:
+        RuntimeError: If called from the background event loop itself, which would deadlock.
+    """
+    loop = background_loop()
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError("run_sync() cannot be called from the agents event loop; await the coroutine instead.")
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
@@ -0,0 +1,309 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batch inspection of aircraft images without the agent conversation.
+
+Every image goes straight to the vision model of `analyze_image`, with bounded
+concurrency and a rate limit, and its result is appended to the report as soon
+as it is done.
+
+Usage (from the repository root):
+    python -m Tools.batch_inspection photos/ --output report.jsonl
+    python -m Tools.batch_inspection manifest.csv --output report.parquet --concurrency 16 --rate 10
+
+The input is a folder (searched recursively) or a CSV/JSONL manifest with a
+'path' column and optional 'aircraft_model' and 'part' columns. The report
+format follows the output extension: .jsonl, .csv or .parquet.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import statistics
+import time
+
+from Tools.vision import get_vision_client
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif")
+
+BATCH_INSPECTION_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "image_description": {"type": "string"},
+            "damaged": {"type": "boolean"},
+            "aircraft_model": {"type": "string"},
+            "part": {"type": "string"},
+        },
+        "required": ["image_description", "damaged", "aircraft_model", "part"],
+    },
+}
+
+BATCH_INSPECTION_INSTRUCTIONS = """
+                Tell me if the aircraft parts in the image are broken. Be very specific in your response.
+                If the image contains an aircraft wing, tell me if the broken part is the slat or the flap.
+                Also name the aircraft model (or "unknown") and the part shown in the image.
+                Respond with a valid JSON array of objects in this format:
+                {image_description: "", damaged: "", aircraft_model: "", part: ""}. Where 'damaged' is a boolean variable.
+                """
+
+# cache_hit marks verdicts reused from a previously inspected photo; hash_distance is the perceptual
+# hash distance of a reused near-duplicate, and empty if the reused photo had identical content
+REPORT_FIELDS = [
+    "path", "aircraft_model", "part", "damaged", "image_description", "cache_hit", "hash_distance", "latency_s", "error",
+]
+
+
+def load_images(source):
+    """
+    Returns the images to inspect as dictionaries with a 'path' and optional
+    'aircraft_model' and 'part' keys.
+
+    Args:
+        source: A folder of images, or a CSV or JSONL manifest.
+    """
+    if os.path.isdir(source):
+        return [
+            {"path": os.path.join(root, name)}
+            for root, _, names in sorted(os.walk(source))
+            for name in sorted(names)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        if source.lower().endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    for row in rows:
+        # Manifest paths are relative to the manifest
+        row["path"] = os.path.join(base_dir, row["path"])
+    return rows
+
+
+class RateLimiter:
+    """
+    A token bucket limiting how many requests start per second.
+
+    Attributes:
+        rate: The sustained requests per second, or None for no limit.
+        burst: The number of requests that may start at once after an idle period.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a request may start."""
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ReportWriter:
+    """Appends inspection results to a .jsonl, .csv or .parquet report as they arrive."""
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower().lstrip(".")
+        if self.format not in ("jsonl", "csv", "parquet"):
+            raise ValueError(f"Unknown report format '{self.format}'. Valid options are: jsonl, csv, parquet")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.batch_size = batch_size
+        self._rows = []
+        self._parquet_writer = None
+        if self.format == "parquet":
+            self._file = None
+        else:
+            self._file = open(path, "w", newline="")
+            if self.format == "csv":
+                self._csv = csv.DictWriter(self._file, fieldnames=REPORT_FIELDS)
+                self._csv.writeheader()
+
+    def write(self, row):
+        row = {field: row.get(field) for field in REPORT_FIELDS}
+        if self.format == "jsonl":
+            self._file.write(json.dumps(row) + "\n")
+            self._file.flush()
+        elif self.format == "csv":
+            self._csv.writerow(row)
+            self._file.flush()
+        else:
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._flush_parquet()
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([
+            ("path", pa.string()), ("aircraft_model", pa.string()), ("part", pa.string()),
+            ("damaged", pa.bool_()), ("image_description", pa.string()),
+            ("cache_hit", pa.bool_()), ("hash_distance", pa.int64()),
+            ("latency_s", pa.float64()), ("error", pa.string()),
+        ])
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        self._parquet_writer.write_table(pa.Table.from_pylist(self._rows, schema=schema))
+        self._rows = []
+
+    def close(self):
+        if self.format == "parquet":
+            if self._rows or self._parquet_writer is None:
+                self._flush_parquet()
+            self._parquet_writer.close()
+        else:
+            self._file.close()
+
+
+async def inspect_image(image, client=None):
+    """
+    Inspects one image.
+
+    Args:
+        image: A dictionary with the 'path' and optional 'aircraft_model' and
+               'part' of the image. Given values take precedence over the
+               ones recognized by the model.
+
+    Returns:
+        The report row of the image. Failures are reported in its 'error' field.
+    """
+    client = client or get_vision_client()
+    start = time.perf_counter()
+    row = {"path": image["path"], "aircraft_model": image.get("aircraft_model"), "part": image.get("part")}
+    try:
+        results, reuse = await client.generate_json(
+            image["path"], BATCH_INSPECTION_INSTRUCTIONS, BATCH_INSPECTION_SCHEMA, return_reuse=True
+        )
+        result = results[0]
+        row.update(
+            aircraft_model=row["aircraft_model"] or result.get("aircraft_model"),
+            part=row["part"] or result.get("part"),
+            damaged=result["damaged"],
+            image_description=result["image_description"],
+            cache_hit=reuse is not None,
+            hash_distance=reuse if isinstance(reuse, int) else None,
+        )
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["latency_s"] = time.perf_counter() - start
+    return row
+
+
+async def run_batch(images, output, concurrency=8, rate=None, on_result=None):
+    """
+    Inspects images with at most `concurrency` requests in flight and at most
+    `rate` requests started per second, writing every result to the report as
+    soon as it is done.
+
+    Args:
+        images: The images as returned by `load_images`.
+        output: The path of the report.
+        concurrency: The maximum number of concurrent inspections.
+        rate: The maximum inspections started per second, or None for no limit.
+        on_result: Optional callback receiving every report row.
+
+    Returns:
+        A dictionary summarizing the run, including the throughput in images per second.
+    """
+    queue = asyncio.Queue()
+    for image in images:
+        queue.put_nowait(image)
+    limiter = RateLimiter(rate, burst=concurrency)
+    writer = ReportWriter(output)
+    client = get_vision_client()
+    latencies, damaged, failed = [], 0, 0
+
+    async def worker():
+        nonlocal damaged, failed
+        while True:
+            try:
+                image = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await limiter.acquire()
+            row = await inspect_image(image, client)
+            writer.write(row)
+            latencies.append(row["latency_s"])
+            failed += bool(row.get("error"))
+            damaged += bool(row.get("damaged"))
+            if on_result is not None:
+                on_result(row)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(images))))))
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "images": len(images),
+        "failed": failed,
+        "damaged": damaged,
+        "elapsed_s": elapsed,
+        "images_per_second": len(images) / elapsed if elapsed else 0.0,
+        "latency_p50_s": statistics.median(ordered) if ordered else 0.0,
+        "latency_p95_s": ordered[math.ceil(0.95 * len(ordered)) - 1] if ordered else 0.0,
+        "report": output,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="A folder of images or a CSV/JSONL manifest.")
+    parser.add_argument("--output", default="inspection_report.jsonl", help="The report (.jsonl, .csv or .parquet).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum concurrent model requests.")
+    parser.add_argument("--rate", type=float, default=None, help="Maximum model requests started per second.")
+    args = parser.parse_args(argv)
+
+    images = load_images(args.source)
+    print(f"Inspecting {len(images)} image(s)...")
+
+    def progress(row):
+        status = "ERROR " + row["error"] if row.get("error") else ("DAMAGED" if row["damaged"] else "ok")
+        print(f"{row['path']}: {status}")
+
+    summary = asyncio.run(run_batch(images, args.output, args.concurrency, args.rate, on_result=progress))
+    print(
+        f"\n{summary['images']} image(s) in {summary['elapsed_s']:.1f}s "
+        f"({summary['images_per_second']:.2f} images/s), {summary['damaged']} damaged, {summary['failed']} failed. "
+        f"Latency p50 {summary['latency_p50_s']:.2f}s, p95 {summary['latency_p95_s']:.2f}s."
+    )
+    print(f"Report written to {summary['report']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import threading
+
+from google.cloud import bigquery
+
+from Tools.tool_cache import config_value
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_bigquery_client(project_id=None):
+    """
+    Returns the process-wide BigQuery client of a project.
+
+    The client keeps its credentials and HTTP connection pool between calls;
+    it is thread-safe, so the tools running in worker threads share it.
+
+    Args:
+        project_id: The Google Cloud project. Defaults to the 'project_id' setting.
+    """
+    project_id = project_id or config_value("project_id")
+    with _clients_lock:
+        if ("bigquery", project_id) not in _clients:
+            _clients["bigquery", project_id] = bigquery.Client(project=project_id)
+        return _clients["bigquery", project_id]
+
+
+def get_bqstorage_client():
+    """
+    Returns the process-wide BigQuery Storage Read API client, or None if
+    google-cloud-bigquery-storage is not installed.
+
+    Results are then downloaded as Arrow record batches over gRPC instead of
+    pages of JSON rows.
+    """
+    with _clients_lock:
+        if "bqstorage" not in _clients:
+            try:
+                from google.cloud import bigquery_storage
+            except ImportError:
+                _clients["bqstorage"] = None
+            else:
+                _clients["bqstorage"] = bigquery_storage.BigQueryReadClient()
+        return _clients["bqstorage"]
+
+
+def query_parameter(name, value):
+    """Returns the BigQuery query parameter of a Python value."""
+    if isinstance(value, bool):
+        return bigquery.ScalarQueryParameter(name, "BOOL", value)
+    if isinstance(value, int):
+        return bigquery.ScalarQueryParameter(name, "INT64", value)
+    if isinstance(value, float):
+        return bigquery.ScalarQueryParameter(name, "FLOAT64", value)
+    if isinstance(value, datetime.datetime):
+        return bigquery.ScalarQueryParameter(name, "TIMESTAMP", value)
+    if isinstance(value, datetime.date):
+        return bigquery.ScalarQueryParameter(name, "DATE", value)
+    return bigquery.ScalarQueryParameter(name, "STRING", value)
+
+
+def query_arrow(sql, parameters=None, project_id=None):
+    """
+    Runs a parameterized query and returns its result as a pyarrow Table.
+
+    Args:
+        sql: The query, referring to parameters as @name.
+        parameters: Optional dictionary of parameter name to value.
+        project_id: The project running the query. Defaults to the 'project_id' setting.
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[query_parameter(name, value) for name, value in (parameters or {}).items()]
+    )
+    rows = get_bigquery_client(project_id).query(sql, job_config=job_config).result()
+    return rows.to_arrow(bqstorage_client=get_bqstorage_client(), create_bqstorage_client=False)
+
+
+def read_table_arrow(table, columns=None, max_results=None, project_id=None):
+    """
+    Reads a table, or only some of its columns, as a pyarrow Table.
+
+    Args:
+        table: The table id, e.g. 'project.dataset.table'.
+        columns: Optional list of the columns to read.
+        max_results: Optional maximum number of rows.
+        project_id: The project of the client. Defaults to the 'project_id' setting.
+    """
+    client = get_bigquery_client(project_id)
+    selected_fields = None
+    if columns:
+        # list_rows needs the schema fields of the projected columns
+        schema = {field.name: field for field in client.get_table(table).schema}
+        selected_fields = [schema[column] for column in columns]
+    rows = client.list_rows(table, selected_fields=selected_fields, max_results=max_results)
+    return rows.to_arrow(bqstorage_client=get_bqstorage_client(), create_bqstorage_client=False)
+
+
+def arrow_records(table):
+    """
+    Returns the rows of a pyarrow Table as dictionaries, with dates and
+    timestamps as ISO strings so the records stay compact in a prompt.
+    """
+    records = table.to_pylist()
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                record[key] = value.isoformat()
+    return records
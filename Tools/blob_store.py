@@ -0,0 +1,165 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import io
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from Tools.tool_cache import config_value
+
+
+BLOB_SCHEME = "blob://"
+
+
+def is_blob_handle(value):
+    """Returns whether a value is a handle of the blob store."""
+    return isinstance(value, str) and value.startswith(BLOB_SCHEME)
+
+
+class MemoryReader(io.RawIOBase):
+    """
+    A read-only, seekable file over bytes-like data.
+
+    Unlike io.BytesIO, which copies a memoryview on construction, reads are
+    served from the caller's buffer, so decoders such as Pillow's Image.open
+    can consume a blob without a copy of the whole upload.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class BlobStore:
+    """
+    An in-memory store of uploaded files, keyed by content id.
+
+    Uploads are kept as read-only memoryviews of the caller's buffer, so
+    registering an upload does not copy it, and identical uploads share one
+    entry. The handles are short strings that agents can pass around in place
+    of file paths, e.g. 'blob://3f2a9c0d1e7b4a55/TL-2000_StingSport.jpg'. The
+    original filename is kept in the handle because the agents read
+    information such as the aircraft model from it.
+
+    The least recently used uploads are evicted beyond max_bytes.
+
+    Attributes:
+        max_bytes: The maximum total size of the stored uploads.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._blobs = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the store configured in settings.yaml:
+            blob_store_max_mb: The maximum total size of the uploads kept in memory (default 256).
+        """
+        return cls(max_bytes=config_value("blob_store_max_mb", 256) * 1024 * 1024)
+
+    def put(self, data, filename="upload"):
+        """
+        Registers an upload.
+
+        Args:
+            data: The file content as bytes-like data, e.g. the memoryview of
+                  `UploadedFile.getbuffer()`. It must not be modified afterwards.
+            filename: The original filename of the upload.
+
+        Returns:
+            str: The handle of the upload.
+        """
+        view = memoryview(data).cast("B").toreadonly()
+        content_id = hashlib.sha256(view).hexdigest()[:16]
+        with self._lock:
+            if content_id in self._blobs:
+                self._blobs.move_to_end(content_id)
+            else:
+                self._blobs[content_id] = view
+                self._size += view.nbytes
+                while self._size > self.max_bytes and len(self._blobs) > 1:
+                    _, evicted = self._blobs.popitem(last=False)
+                    self._size -= evicted.nbytes
+        # Keeps handles free of path separators and whitespace
+        name = "".join(c if c.isalnum() or c in "._-" else "_" for c in filename.rsplit("/", 1)[-1])
+        return f"{BLOB_SCHEME}{content_id}/{name or 'upload'}"
+
+    def get(self, handle):
+        """
+        Returns the content of an upload as a read-only memoryview.
+
+        Raises:
+            ValueError: If the handle is unknown or the upload was evicted.
+        """
+        content_id = handle[len(BLOB_SCHEME):].split("/", 1)[0]
+        with self._lock:
+            if content_id not in self._blobs:
+                raise ValueError(f"Unknown or expired upload '{handle}'. Please upload the file again.")
+            self._blobs.move_to_end(content_id)
+            return self._blobs[content_id]
+
+    @staticmethod
+    def mime_type(handle):
+        """Returns the mime type guessed from the filename of a handle, or None."""
+        return mimetypes.guess_type(handle.rsplit("/", 1)[-1])[0]
+
+    def __len__(self):
+        return len(self._blobs)
+
+    @property
+    def size(self):
+        """The total size of the stored uploads in bytes."""
+        return self._size
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """Returns the process-wide BlobStore."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore.from_config()
+        return _store
@@ -0,0 +1,262 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import re
+import threading
+
+from Tools.http_clients import authorized_headers, get_http_client
+from Tools.tool_cache import config_value
+
+
+class SearchHit:
+    """
+    One extractive answer of a document search.
+
+    Attributes:
+        corpus: The name of the searched corpus, e.g. 'manuals'.
+        title: The title (file name) of the document.
+        page_number: The page of the answer within the document.
+        content: The answer text.
+        score: The relevance of the answer; higher is better.
+    """
+
+    def __init__(self, corpus, title, page_number, content, score):
+        self.corpus = corpus
+        self.title = title
+        self.page_number = page_number
+        self.content = content
+        self.score = score
+
+    def to_text(self, content=None):
+        """Returns the hit in the format of the original search tools."""
+        return f"Filename: {self.title}, pageNumber: {self.page_number}, searchResult: {self.content if content is None else content}"
+
+    def __repr__(self):
+        return f"SearchHit({self.corpus!r}, {self.title!r}, {self.page_number!r}, score={self.score:.3f})"
+
+
+def parse_hits(corpus, search_results):
+    """
+    Extracts the extractive answers of a Discovery Engine search response.
+
+    Results carry their relevance score if the engine returns one; otherwise
+    the score falls with the rank of the result and of the answer within it.
+    """
+    hits = []
+    for rank, result in enumerate(search_results.get("results", [])):
+        data = result.get("document", {}).get("derivedStructData", {})
+        relevance = result.get("modelScores", {}).get("relevance_score", {}).get("values")
+        score = relevance[0] if relevance else 1 / (rank + 1)
+        for position, answer in enumerate(data.get("extractive_answers", [])):
+            hits.append(SearchHit(
+                corpus=corpus,
+                title=data.get("title", ""),
+                page_number=answer.get("pageNumber"),
+                content=answer.get("content", ""),
+                score=score / (position + 1),
+            ))
+    return hits
+
+
+def _dedup_key(hit):
+    return re.sub(r"\W+", " ", hit.content).strip().lower()
+
+
+def merge_hits(hit_lists, top_k):
+    """Returns the top_k hits of several searches by score, without duplicate answers."""
+    merged = {}
+    for hit in (hit for hits in hit_lists for hit in hits):
+        key = _dedup_key(hit)
+        if key not in merged or hit.score > merged[key].score:
+            merged[key] = hit
+    return sorted(merged.values(), key=lambda hit: -hit.score)[:top_k]
+
+
+def format_hits(hits, max_chars=None, errors=None):
+    """
+    Formats search hits as the tool result, one line per hit.
+
+    Args:
+        hits: The SearchHits, best first.
+        max_chars: Optional size cap of the result. The last hit that fits is
+                   shortened, and the remaining hits are left out.
+        errors: Optional dictionary of corpus name to the error of its search.
+
+    Returns:
+        str: The formatted hits, or a message if there are none.
+    """
+    lines = [
+        f"Search of corpus '{corpus}' failed: {(str(error).splitlines() or [type(error).__name__])[0]}"
+        for corpus, error in (errors or {}).items()
+    ]
+    if not hits:
+        lines.append("No results found.")
+        return "\n".join(lines)
+
+    remaining = max_chars - sum(len(line) + 1 for line in lines) if max_chars else None
+    # Keep room for the note about left-out hits so it stays within the cap
+    note_chars = len(f"({len(hits)} more result(s) left out to fit the size limit.)") + 1
+    for i, hit in enumerate(hits):
+        prefix = f"[{i + 1}] corpus: {hit.corpus}, score: {hit.score:.2f}, "
+        line = prefix + hit.to_text()
+        reserve = note_chars if i + 1 < len(hits) else 0
+        if remaining is not None and len(line) + reserve > remaining:
+            # Shorten the hit if a useful part of it still fits
+            room = remaining - note_chars - (len(line) - len(hit.content)) - 3
+            if room >= 200:
+                lines.append(prefix + hit.to_text(hit.content[:room] + "..."))
+                i += 1
+            if i < len(hits):
+                lines.append(f"({len(hits) - i} more result(s) left out to fit the size limit.)")
+            break
+        lines.append(line)
+        if remaining is not None:
+            remaining -= len(line) + 1
+    return "\n".join(lines)
+
+
+class SearchClient:
+    """
+    Base class of the document search backends.
+
+    Subclasses implement `search_corpus`; `search` fans out over the corpora.
+
+    Attributes:
+        corpora: The names of the searchable corpora.
+    """
+
+    corpora = ()
+
+    async def search_corpus(self, corpus, query, top_k=5):
+        """
+        Searches a single corpus.
+
+        Returns:
+            A list of SearchHits, best first.
+
+        Raises:
+            ValueError: If the corpus is unknown.
+        """
+        raise NotImplementedError
+
+    def _check_corpus(self, corpus):
+        if corpus not in self.corpora:
+            raise ValueError(f"Unknown corpus '{corpus}'. Valid options are: {', '.join(self.corpora)}")
+
+    async def search(self, query, corpora=None, top_k=5):
+        """
+        Searches several corpora at the same time.
+
+        A failing corpus does not fail the search; its error is returned instead.
+
+        Args:
+            query: The search query text.
+            corpora: The names of the corpora to search. Defaults to all.
+            top_k: The number of hits to return.
+
+        Returns:
+            A tuple of the top_k deduplicated SearchHits over all corpora, best
+            first, and a dictionary of corpus name to error for the failed ones.
+        """
+        corpora = list(corpora or self.corpora)
+        results = await asyncio.gather(
+            *(self.search_corpus(corpus, query, top_k) for corpus in corpora), return_exceptions=True
+        )
+        errors = {corpus: result for corpus, result in zip(corpora, results) if isinstance(result, BaseException)}
+        if errors and len(errors) == len(corpora):
+            raise next(iter(errors.values()))
+        hits = [result for result in results if not isinstance(result, BaseException)]
+        return merge_hits(hits, top_k), errors
+
+
+class DiscoveryEngineSearchClient(SearchClient):
+    """
+    Searches one or more Vertex AI Search (Discovery Engine) apps concurrently.
+
+    Attributes:
+        project_id: The Google Cloud project of the search apps.
+        engines: A dictionary of corpus name to search app (engine) id.
+        answers_per_result: The maximum number of extractive answers per document.
+    """
+
+    def __init__(self, project_id, engines, answers_per_result=3):
+        self.project_id = project_id
+        self.engines = engines
+        self.answers_per_result = answers_per_result
+
+    @property
+    def corpora(self):
+        return tuple(self.engines)
+
+    def url(self, engine_id):
+        return (
+            f"https://discoveryengine.googleapis.com/v1/projects/{self.project_id}/locations/global/collections/"
+            f"default_collection/engines/{engine_id}/servingConfigs/default_search:search"
+        )
+
+    async def search_corpus(self, corpus, query, top_k=5):
+        """
+        Searches a single corpus.
+
+        Returns:
+            A list of SearchHits in the order of the engine.
+
+        Raises:
+            ValueError: If the corpus is unknown.
+            httpx.HTTPError: If the request fails.
+        """
+        self._check_corpus(corpus)
+        request_body = {
+            "query": query,
+            "pageSize": top_k,
+            "contentSearchSpec": {
+                "extractiveContentSpec": {"maxExtractiveAnswerCount": self.answers_per_result},
+            },
+        }
+        response = await get_http_client().post(
+            self.url(self.engines[corpus]), headers=await authorized_headers(), json=request_body
+        )
+        response.raise_for_status()
+        return parse_hits(corpus, response.json())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_search_client():
+    """
+    Returns the process-wide search client of the 'search_backend' setting:
+        discovery_engine (default): Vertex AI Search apps, configured by 'search_corpora'
+            (corpus name to search app id), defaulting to 'manuals' and 'safety_reports'
+            with app_id_manuals and app_id_safety_reports.
+        local: The offline BM25 index of Tools.local_search.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            backend = config_value("search_backend", "discovery_engine")
+            if backend == "discovery_engine":
+                engines = config_value("search_corpora") or {
+                    "manuals": config_value("app_id_manuals"),
+                    "safety_reports": config_value("app_id_safety_reports"),
+                }
+                _client = DiscoveryEngineSearchClient(config_value("project_id"), engines)
+            elif backend == "local":
+                from Tools.local_search import LocalSearchClient
+                _client = LocalSearchClient.from_config()
+            else:
+                raise ValueError(f"Unknown search_backend '{backend}'. Valid options are: discovery_engine, local")
+        return _client
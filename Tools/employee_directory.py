@@ -0,0 +1,285 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An in-memory directory of the maintenance employees, indexed by specialization
+and license expiry, so "who is qualified and licensed for X" is answered
+without sending the employee table to the model.
+"""
+
+import bisect
+import csv
+import datetime
+import os
+import re
+import threading
+import time
+from array import array
+
+from Tools.tool_cache import config_value
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", str(text)).strip().lower()
+
+
+def _date_ordinal(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().toordinal()
+    if isinstance(value, datetime.date):
+        return value.toordinal()
+    return datetime.date.fromisoformat(str(value).strip()[:10]).toordinal()
+
+
+class Employee:
+    """One row of the employees table."""
+
+    __slots__ = ("employee_id", "name", "license", "expiry", "specialization")
+
+    def __init__(self, employee_id, name, license, expiry, specialization):
+        self.employee_id = employee_id
+        self.name = name
+        self.license = license
+        self.expiry = expiry
+        self.specialization = specialization
+
+    @classmethod
+    def from_record(cls, record):
+        """Creates an employee from a row with the column names of the employees table."""
+        return cls(
+            employee_id=str(record["Employee ID"]).strip(),
+            name=str(record["Employee Name"]).strip(),
+            license=str(record["License Held"]).strip(),
+            expiry=_date_ordinal(record["License Expiration Date"]),
+            specialization=str(record["Specialization"]).strip(),
+        )
+
+    def _key(self):
+        return (self.name, self.license, self.expiry, self.specialization)
+
+    def __eq__(self, other):
+        return isinstance(other, Employee) and self.employee_id == other.employee_id and self._key() == other._key()
+
+
+class EmployeeDirectory:
+    """
+    Employees indexed by specialization, with the license expiry dates of every
+    specialization kept in a sorted array.
+
+    Finding the employees of a specialization whose license is valid on a date
+    is a dictionary lookup plus a binary search, O(log n), followed by a slice of
+    the matches. Refreshes only re-index the employees that were added, changed
+    or removed.
+    """
+
+    def __init__(self):
+        self._employees = {}
+        # Normalized specialization -> (sorted expiry ordinals, employee ids in the same order)
+        self._by_specialization = {}
+        self._specialization_names = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._employees)
+
+    @property
+    def specializations(self):
+        """The specializations of the directory, as spelled in the source."""
+        return sorted(self._specialization_names.values())
+
+    def _index(self, employee):
+        key = _normalize(employee.specialization)
+        self._specialization_names.setdefault(key, employee.specialization)
+        expiries, ids = self._by_specialization.setdefault(key, (array("l"), []))
+        position = bisect.bisect_right(expiries, employee.expiry)
+        expiries.insert(position, employee.expiry)
+        ids.insert(position, employee.employee_id)
+
+    def _unindex(self, employee):
+        key = _normalize(employee.specialization)
+        expiries, ids = self._by_specialization[key]
+        position = bisect.bisect_left(expiries, employee.expiry)
+        position = ids.index(employee.employee_id, position)
+        del expiries[position]
+        del ids[position]
+        if not ids:
+            del self._by_specialization[key]
+            del self._specialization_names[key]
+
+    def update(self, employees):
+        """
+        Makes the directory match a complete list of employees, re-indexing
+        only the added, changed and removed ones.
+
+        Returns:
+            The number of employees added, changed or removed.
+        """
+        employees = {employee.employee_id: employee for employee in employees}
+        changes = 0
+        with self._lock:
+            for employee_id in set(self._employees) - set(employees):
+                self._unindex(self._employees.pop(employee_id))
+                changes += 1
+            for employee_id, employee in employees.items():
+                current = self._employees.get(employee_id)
+                if current == employee:
+                    continue
+                if current is not None:
+                    self._unindex(current)
+                self._employees[employee_id] = employee
+                self._index(employee)
+                changes += 1
+        return changes
+
+    def _matching_specializations(self, specialization):
+        query = _normalize(specialization)
+        if query in self._by_specialization:
+            return [query]
+        # e.g. 'structural repairs' or 'engine' for 'Structural Repair' and 'Engine Maintenance'
+        return [key for key in self._by_specialization if query in key or key in query]
+
+    def find_qualified(self, specialization, valid_on=None, license_type=None):
+        """
+        Returns the employees of a specialization whose license is valid on a date.
+
+        Args:
+            specialization: The specialization, or a part of it. Case-insensitive.
+            valid_on: The date the license must still be valid on. Defaults to today.
+            license_type: Optional part of the license held, e.g. 'A&P' or 'IA'.
+
+        Returns:
+            A list of Employees, the longest valid license first.
+        """
+        valid_on = _date_ordinal(valid_on or datetime.date.today())
+        matches = []
+        with self._lock:
+            for key in self._matching_specializations(specialization):
+                expiries, ids = self._by_specialization[key]
+                first_valid = bisect.bisect_left(expiries, valid_on)
+                matches.extend(self._employees[employee_id] for employee_id in ids[first_valid:])
+        if license_type:
+            license_type = _normalize(license_type)
+            matches = [employee for employee in matches if license_type in _normalize(employee.license)]
+        return sorted(matches, key=lambda employee: -employee.expiry)
+
+
+class CSVEmployeeSource:
+    """Reads the employees from a CSV file with the columns of the employees table."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def version(self):
+        """Returns a value that changes whenever the file does."""
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read(self):
+        with open(self.path, newline="") as f:
+            return [Employee.from_record(record) for record in csv.DictReader(f)]
+
+
+class BigQueryEmployeeSource:
+    """Reads the employees from a BigQuery table."""
+
+    COLUMNS = ["Employee ID", "Employee Name", "License Held", "License Expiration Date", "Specialization"]
+
+    def __init__(self, table):
+        self.table = table
+
+    def version(self):
+        """Returns the last modification time of the table, read from its metadata."""
+        from Tools.bigquery_client import get_bigquery_client
+        return get_bigquery_client().get_table(self.table).modified
+
+    def read(self):
+        from Tools.bigquery_client import read_table_arrow
+        return [Employee.from_record(record) for record in read_table_arrow(self.table, columns=self.COLUMNS).to_pylist()]
+
+
+class DirectoryService:
+    """
+    Keeps an EmployeeDirectory in sync with its source.
+
+    At most every `refresh_interval` seconds a query checks whether the source
+    changed (file modification time, or table metadata), and only then reads
+    it and applies the differences to the directory.
+
+    Attributes:
+        source: A CSVEmployeeSource or BigQueryEmployeeSource.
+        refresh_interval: Seconds between checks of the source.
+        directory: The EmployeeDirectory.
+    """
+
+    def __init__(self, source, refresh_interval=300):
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.directory = EmployeeDirectory()
+        self._version = None
+        self._checked_at = None
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the service configured in settings.yaml:
+            employee_directory_source: csv (default) | bigquery.
+            employee_directory_csv: The CSV file (default Files/employees.csv).
+            employee_directory_refresh_seconds: Seconds between checks of the source for changes (default 300).
+        """
+        source_name = config_value("employee_directory_source", "csv")
+        if source_name == "csv":
+            source = CSVEmployeeSource(config_value("employee_directory_csv", os.path.join("Files", "employees.csv")))
+        elif source_name == "bigquery":
+            source = BigQueryEmployeeSource(f"{config_value('project_id')}.ascm.employees")
+        else:
+            raise ValueError(f"Unknown employee_directory_source '{source_name}'. Valid options are: csv, bigquery")
+        return cls(source, refresh_interval=config_value("employee_directory_refresh_seconds", 300))
+
+    def refresh(self, force=False):
+        """
+        Reloads the source if it changed since the last refresh.
+
+        Returns:
+            The number of employees added, changed or removed.
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+                return 0
+            version = self.source.version()
+            self._checked_at = now
+            if not force and version == self._version:
+                return 0
+            changes = self.directory.update(self.source.read())
+            self._version = version
+            return changes
+
+    def find_qualified(self, specialization, valid_on=None, license_type=None):
+        """Refreshes the directory if it is due and returns `EmployeeDirectory.find_qualified`."""
+        self.refresh()
+        return self.directory.find_qualified(specialization, valid_on, license_type)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_employee_directory():
+    """Returns the process-wide DirectoryService."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = DirectoryService.from_config()
+        return _service
@@ -0,0 +1,152 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import datetime
+import threading
+import weakref
+
+import httpx
+
+from Tools.tool_cache import config_value
+
+
+CLOUD_PLATFORM_SCOPES = ("https://www.googleapis.com/auth/cloud-platform",)
+
+
+class AccessTokenProvider:
+    """
+    Hands out a cached Google Cloud access token of the application default credentials.
+
+    The token is reused until shortly before it expires. Within `refresh_ahead`
+    seconds of the expiry it is refreshed on a background thread while callers
+    keep getting the current token; only a token that is about to expire is
+    refreshed in the foreground. Concurrent callers share a single refresh.
+
+    Attributes:
+        scopes: The OAuth scopes of the token.
+        refresh_ahead: Seconds before the expiry at which a background refresh starts.
+        min_validity: Seconds a handed out token must at least remain valid.
+    """
+
+    def __init__(self, scopes=CLOUD_PLATFORM_SCOPES, refresh_ahead=300, min_validity=60, credentials=None):
+        self.scopes = scopes
+        self.refresh_ahead = refresh_ahead
+        self.min_validity = min_validity
+        self._credentials = credentials
+        self._token = None
+        self._expiry = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def _seconds_left(self):
+        if self._token is None:
+            return 0
+        if self._expiry is None:
+            return float("inf")
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (self._expiry - now).total_seconds()
+
+    def _refresh(self):
+        with self._refresh_lock:
+            if self._seconds_left() > self.refresh_ahead:
+                # Refreshed by another thread while we waited for the lock
+                return
+            import google.auth
+            import google.auth.transport.requests
+
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=list(self.scopes))
+            self._credentials.refresh(google.auth.transport.requests.Request())
+            # google-auth reports the expiry as a naive UTC datetime
+            self._token, self._expiry = self._credentials.token, self._credentials.expiry
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            print(f"Could not refresh the access token in the background: {e}")
+        finally:
+            self._refreshing = False
+
+    def token(self):
+        """Returns a valid access token, refreshing it first only if it is about to expire."""
+        seconds_left = self._seconds_left()
+        if seconds_left <= self.min_validity:
+            self._refresh()
+        elif seconds_left <= self.refresh_ahead and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name="token-refresh", daemon=True).start()
+        return self._token
+
+    async def token_async(self):
+        """Awaitable variant of `token`, which never blocks the event loop on a refresh."""
+        if self._seconds_left() > self.min_validity:
+            return self.token()
+        return await asyncio.to_thread(self.token)
+
+
+_token_provider = AccessTokenProvider()
+
+
+def get_token_provider():
+    """Returns the process-wide AccessTokenProvider."""
+    return _token_provider
+
+
+########################################################################################################################
+# POOLED HTTP CLIENTS
+########################################################################################################################
+
+# httpx.AsyncClient connections belong to the event loop that opened them, so
+# there is one pooled client per loop (in practice the background loop of run_sync).
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def new_http_client():
+    """
+    Creates an AsyncClient with keep-alive connection pooling and the timeouts of settings.yaml:
+        http_timeout_seconds: Read, write and pool timeout of a request (default 30).
+        http_connect_timeout_seconds: Timeout to establish a connection (default 5).
+        http_max_connections: Maximum open connections of the pool (default 20).
+    """
+    timeout = config_value("http_timeout_seconds", 30)
+    max_connections = config_value("http_max_connections", 20)
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=config_value("http_connect_timeout_seconds", 5)),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60,
+        ),
+    )
+
+
+def get_http_client():
+    """Returns the pooled AsyncClient of the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None or client.is_closed:
+            client = _clients[loop] = new_http_client()
+        return client
+
+
+async def authorized_headers():
+    """Returns request headers carrying a cached access token of the application default credentials."""
+    return {
+        "Authorization": f"Bearer {await get_token_provider().token_async()}",
+        "Content-Type": "application/json",
+    }
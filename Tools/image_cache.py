@@ -0,0 +1,344 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A cache of image inspection results keyed by the content of the image.
+
+Re-uploads of the same photo are recognized by the SHA-256 of their content,
+so their inspection is answered from the cache instead of the model.
+
+Near-identical photos (re-encoded, resized, slightly cropped or brightened)
+hash to the same or close 64-bit perceptual hashes. Photos of different parts
+with similar framing can do so as well, so reusing results of near-duplicates
+is opt-in (image_cache_threshold above 0).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from Tools.blob_store import MemoryReader
+from Tools.tool_cache import config_value
+
+
+HASH_BITS = 64
+
+
+def content_digest(data):
+    """Returns the SHA-256 hex digest of the encoded image."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data):
+    """
+    Returns the 64-bit difference hash (dHash) of an image.
+
+    The image is decoded, turned upright, shrunk to 9x8 grayscale pixels, and
+    every bit records whether a pixel is brighter than its right neighbour.
+
+    Args:
+        data: The encoded image as bytes-like data.
+
+    Returns:
+        int: The hash, or None if Pillow cannot decode the image.
+    """
+    try:
+        image = Image.open(MemoryReader(data))
+        # Lets the JPEG decoder skip most of the full-resolution work
+        image.draft("L", (64, 64))
+        image = ImageOps.exif_transpose(image)
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+class HammingIndex:
+    """
+    Finds stored hashes within a Hamming distance of a query hash.
+
+    Multi-index hashing: the 64 bits are split into threshold + 1 bands, and
+    any two hashes within the threshold agree exactly on at least one band. A
+    lookup therefore only compares the hashes sharing a band value with the
+    query rather than the whole store.
+
+    Attributes:
+        threshold: The maximum Hamming distance of a match in bits.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        bands = min(threshold + 1, HASH_BITS)
+        self._bands = [
+            (HASH_BITS * i // bands, (1 << (HASH_BITS * (i + 1) // bands - HASH_BITS * i // bands)) - 1)
+            for i in range(bands)
+        ]
+        self._buckets = [{} for _ in self._bands]
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, image_hash, value):
+        """Stores a value under a hash, replacing the value of an equal hash."""
+        if image_hash not in self._values:
+            for (shift, mask), buckets in zip(self._bands, self._buckets):
+                buckets.setdefault((image_hash >> shift) & mask, []).append(image_hash)
+        self._values[image_hash] = value
+
+    def nearest(self, image_hash):
+        """
+        Returns a tuple of the value of the closest stored hash and its
+        distance, or None if no hash is within the threshold.
+        """
+        if image_hash in self._values:
+            return self._values[image_hash], 0
+        best, best_distance = None, self.threshold + 1
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            for candidate in buckets.get((image_hash >> shift) & mask, ()):
+                distance = (candidate ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        if best is None:
+            return None
+        return self._values[best], best_distance
+
+
+class InspectionCacheStats:
+    """Hit and miss counters of the inspection cache."""
+
+    def __init__(self):
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.unhashable = 0
+
+    def to_dict(self):
+        hits = self.exact_hits + self.near_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "unhashable": self.unhashable,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+class InspectionCache:
+    """
+    Inspection results by image content, kept in memory and in a local SQLite
+    file so they survive restarts.
+
+    Results are reused for byte-identical images, keyed by the SHA-256 of the
+    content. With a threshold above 0, images whose perceptual hashes are
+    within `threshold` bits of a cached image reuse its result as well.
+
+    Results are stored per namespace, so different prompts or models over the
+    same image do not share results.
+
+    Attributes:
+        path: The SQLite file, or None to keep the cache in memory only.
+        threshold: The maximum Hamming distance (of 64 bits) between the
+                   perceptual hashes of two images that count as the same
+                   photo, or 0 to only reuse results of identical content.
+        ttl: Seconds a result stays valid, or None to keep it forever.
+    """
+
+    def __init__(self, path=None, threshold=0, ttl=None):
+        if not 0 <= threshold < HASH_BITS:
+            raise ValueError(f"threshold must be between 0 and {HASH_BITS - 1} bits, got {threshold}")
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.stats = InspectionCacheStats()
+        self._exact = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            with self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS inspection_results ("
+                    "namespace TEXT, digest TEXT, hash TEXT, result TEXT, created_at REAL, "
+                    "PRIMARY KEY (namespace, digest))"
+                )
+                if ttl is not None:
+                    self._connection.execute("DELETE FROM inspection_results WHERE created_at <= ?", (time.time() - ttl,))
+            rows = self._connection.execute("SELECT namespace, digest, hash, result, created_at FROM inspection_results")
+            for namespace, digest, image_hash, result, created_at in rows:
+                self._add(namespace, digest, int(image_hash, 16) if image_hash else None, (json.loads(result), created_at))
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the cache configured in settings.yaml:
+            image_cache_threshold: The maximum Hamming distance of near-duplicates in bits
+                                   (default 0, only identical images share a result).
+            image_cache_path: The SQLite file (default <tool_cache_dir>/image_cache.sqlite);
+                              empty to keep the cache in memory only.
+            image_cache_ttl_hours: How long results stay valid (default: forever).
+        """
+        path = config_value("image_cache_path", os.path.join(config_value("tool_cache_dir", ".cache"), "image_cache.sqlite"))
+        ttl_hours = config_value("image_cache_ttl_hours")
+        return cls(
+            path=path or None,
+            threshold=config_value("image_cache_threshold", 0),
+            ttl=ttl_hours * 3600 if ttl_hours else None,
+        )
+
+    @property
+    def near_duplicates(self):
+        """Whether results are reused for near-identical images."""
+        return self.threshold > 0
+
+    def _index(self, namespace):
+        if namespace not in self._indexes:
+            self._indexes[namespace] = HammingIndex(self.threshold)
+        return self._indexes[namespace]
+
+    def _add(self, namespace, digest, image_hash, entry):
+        self._exact.setdefault(namespace, {})[digest] = entry
+        if image_hash is not None and self.near_duplicates:
+            self._index(namespace).add(image_hash, entry)
+
+    def _valid(self, entry):
+        return self.ttl is None or entry[1] > time.time() - self.ttl
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._exact.values())
+
+    def lookup(self, namespace, digest, image_hash=None):
+        """
+        Returns the cached result of an image, or None.
+
+        Args:
+            namespace: The key of the prompt and model of the inspection.
+            digest: The SHA-256 hex digest of the image content, see `content_digest`.
+            image_hash: The perceptual hash of the image, to look for near-duplicates.
+
+        Returns:
+            A tuple of the result and the Hamming distance of the near-duplicate it
+            was taken from (None for an image with identical content), or None.
+        """
+        with self._lock:
+            entry = self._exact.get(namespace, {}).get(digest)
+            if entry is not None and self._valid(entry):
+                self.stats.exact_hits += 1
+                return entry[0], None
+            if image_hash is not None and self.near_duplicates:
+                match = self._index(namespace).nearest(image_hash)
+                if match is not None and self._valid(match[0]):
+                    (result, _), distance = match
+                    self.stats.near_hits += 1
+                    return result, distance
+            self.stats.misses += 1
+            return None
+
+    def set(self, namespace, digest, result, image_hash=None):
+        """Caches the (JSON serializable) result of an image."""
+        now = time.time()
+        with self._lock:
+            self._add(namespace, digest, image_hash, (result, now))
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO inspection_results VALUES (?, ?, ?, ?, ?)",
+                        (namespace, digest, f"{image_hash:016x}" if image_hash is not None else None,
+                         json.dumps(result), now),
+                    )
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._indexes.clear()
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute("DELETE FROM inspection_results")
+
+    async def get_or_inspect(self, data, namespace, inspect, return_reuse=False):
+        """
+        Returns the cached result of an image, or inspects and caches it.
+
+        Args:
+            data: The encoded image as bytes-like data.
+            namespace: The key of the prompt and model of the inspection, see `inspection_namespace`.
+            inspect: A coroutine function inspecting the image and returning a
+                     JSON serializable result.
+            return_reuse: Whether to return a tuple of the result and its reuse:
+                          None if the image was inspected, "identical" if the result
+                          of an image with the same content was reused, or the Hamming
+                          distance of the near-duplicate it was taken from.
+        """
+        digest = content_digest(data)
+        image_hash = None
+        if self.near_duplicates:
+            image_hash = await asyncio.to_thread(perceptual_hash, data)
+            if image_hash is None:
+                self.stats.unhashable += 1
+        match = self.lookup(namespace, digest, image_hash)
+        if match is not None:
+            result, distance = match
+            reuse = "identical" if distance is None else distance
+        else:
+            result, reuse = await inspect(), None
+            if self._connection is not None:
+                # The SQLite write may wait for a lock, so it stays off the event loop
+                await asyncio.to_thread(self.set, namespace, digest, result, image_hash)
+            else:
+                self.set(namespace, digest, result, image_hash)
+        return (result, reuse) if return_reuse else result
+
+
+def inspection_namespace(model_name, instructions, response_schema):
+    """Returns the cache namespace of an inspection prompt on a model."""
+    key = json.dumps([model_name, instructions, response_schema], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inspection_cache():
+    """Returns the process-wide InspectionCache, or None if 'image_cache_enabled' is false."""
+    global _cache
+    if not config_value("image_cache_enabled", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = InspectionCache.from_config()
+        return _cache
+
+
+def set_inspection_cache(cache):
+    """Replaces the process-wide InspectionCache, e.g. with an in-memory one for tests."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,393 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An offline document index as a drop-in for the Discovery Engine search apps.
+
+Every corpus is a folder of PDF, text or markdown files (pages of text files
+are separated by form feeds). The pages are split into overlapping chunks and
+indexed for BM25, optionally together with dense embeddings. The index is
+stored as numpy arrays that are memory-mapped when opened, so a cold start only
+reads the vocabulary.
+
+Usage (from the repository root):
+    python -m Tools.local_search build                 # (re)build the indexes of all corpora
+    python -m Tools.local_search search "oil change"   # query them
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from Tools.document_search import SearchClient, SearchHit, format_hits
+from Tools.tool_cache import config_value
+
+
+SOURCE_EXTENSIONS = (".pdf", ".txt", ".md")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it its of on or that the this to was what when "
+    "where which who will with".split()
+)
+
+
+def tokenize(text):
+    """Returns the lowercase index terms of a text."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def read_pages(path):
+    """Returns the text of every page of a PDF, text or markdown file."""
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError as e:
+            raise ImportError("Indexing PDF files requires pypdf: pip install pypdf") from e
+        return [page.extract_text() or "" for page in PdfReader(path).pages]
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read().split("\f")
+
+
+def chunk_pages(pages, chunk_words=120, overlap=30):
+    """
+    Splits pages into chunks of about chunk_words words that overlap by `overlap` words.
+
+    Yields:
+        Tuples of the 1-based page number and the chunk text.
+    """
+    step = max(chunk_words - overlap, 1)
+    for page_number, text in enumerate(pages, start=1):
+        words = text.split()
+        for start in range(0, max(len(words) - overlap, 1), step):
+            chunk = " ".join(words[start:start + chunk_words])
+            if chunk:
+                yield page_number, chunk
+
+
+def source_files(source_dir):
+    """Returns a dictionary of the indexable files of a folder to their (mtime, size)."""
+    files = {}
+    for root, _, names in os.walk(source_dir):
+        for name in sorted(names):
+            if name.lower().endswith(SOURCE_EXTENSIONS):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files[os.path.relpath(path, source_dir)] = [stat.st_mtime, stat.st_size]
+    return files
+
+
+def build_index(source_dir, index_dir, chunk_words=120, overlap=30, embed=None):
+    """
+    Indexes the files of a folder.
+
+    The index is written next to index_dir and moved into place at the end, so
+    readers never see a partial index.
+
+    Args:
+        source_dir: The folder with the documents of the corpus.
+        index_dir: The folder of the index.
+        chunk_words: The number of words per chunk.
+        overlap: The number of words shared by consecutive chunks.
+        embed: Optional callable returning the normalized embeddings (a 2D array)
+               of a list of texts, to add a dense index.
+    """
+    if not os.path.isdir(source_dir):
+        raise FileNotFoundError(f"The document folder '{source_dir}' does not exist.")
+    sources = source_files(source_dir)
+    titles, chunk_doc, chunk_page, chunk_len, texts = [], [], [], [], []
+    vocabulary = {}
+    postings = []
+
+    for doc_id, relative_path in enumerate(sources):
+        titles.append(os.path.basename(relative_path))
+        for page_number, text in chunk_pages(read_pages(os.path.join(source_dir, relative_path)), chunk_words, overlap):
+            chunk_id = len(texts)
+            terms = tokenize(text)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((chunk_id, count))
+            chunk_doc.append(doc_id)
+            chunk_page.append(page_number)
+            chunk_len.append(len(terms))
+            texts.append(text)
+
+    encoded = [text.encode("utf-8") for text in texts]
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=text_offsets[1:])
+    posting_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum([len(entries) for entries in postings], out=posting_offsets[1:])
+    flat = [entry for entries in postings for entry in entries]
+
+    tmp_dir = index_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "chunk_doc.npy"), np.asarray(chunk_doc, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "chunk_page.npy"), np.asarray(chunk_page, dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "chunk_len.npy"), np.asarray(chunk_len, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, "text_offsets.npy"), text_offsets)
+    np.save(os.path.join(tmp_dir, "posting_offsets.npy"), posting_offsets)
+    np.save(os.path.join(tmp_dir, "posting_chunks.npy"), np.asarray([c for c, _ in flat], dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "posting_tf.npy"), np.asarray([n for _, n in flat], dtype=np.float32))
+    with open(os.path.join(tmp_dir, "chunks.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    if embed is not None and texts:
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), np.asarray(embed(texts), dtype=np.float32))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({
+            "documents": titles,
+            "vocabulary": vocabulary,
+            "sources": sources,
+            "chunk_words": chunk_words,
+            "overlap": overlap,
+            "dense": embed is not None,
+        }, f)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+class LocalIndex:
+    """
+    A read-only, memory-mapped index of one corpus built by `build_index`.
+
+    Attributes:
+        k1, b: The BM25 parameters.
+    """
+
+    def __init__(self, index_dir, k1=1.5, b=0.75):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.documents = self.meta["documents"]
+        self.vocabulary = self.meta["vocabulary"]
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self.chunk_doc = load("chunk_doc.npy")
+        self.chunk_page = load("chunk_page.npy")
+        self.chunk_len = load("chunk_len.npy")
+        self.text_offsets = load("text_offsets.npy")
+        self.posting_offsets = load("posting_offsets.npy")
+        self.posting_chunks = load("posting_chunks.npy")
+        self.posting_tf = load("posting_tf.npy")
+        chunks_path = os.path.join(index_dir, "chunks.bin")
+        self.texts = np.memmap(chunks_path, dtype=np.uint8, mode="r") if os.path.getsize(chunks_path) else b""
+        embeddings_path = os.path.join(index_dir, "embeddings.npy")
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+
+        self.size = len(self.chunk_doc)
+        self.average_length = float(np.mean(self.chunk_len)) if self.size else 0.0
+
+    def is_stale(self, source_dir):
+        """Whether the files of the corpus changed since the index was built."""
+        return source_files(source_dir) != self.meta["sources"]
+
+    def text(self, chunk_id):
+        return bytes(self.texts[self.text_offsets[chunk_id]:self.text_offsets[chunk_id + 1]]).decode("utf-8")
+
+    def bm25(self, query):
+        """Returns the BM25 score of every chunk for a query."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+            chunks = self.posting_chunks[start:end]
+            tf = self.posting_tf[start:end]
+            idf = math.log(1 + (self.size - (end - start) + 0.5) / ((end - start) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.chunk_len[chunks] / self.average_length)
+            scores[chunks] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k=5, query_embedding=None, fusion_k=60):
+        """
+        Returns the best chunks for a query.
+
+        With a query embedding and a dense index, the BM25 and the embedding
+        rankings are combined by reciprocal rank fusion.
+
+        Returns:
+            A list of (chunk id, score) tuples of the matching chunks, best first.
+        """
+        if not self.size:
+            return []
+        scores = self.bm25(query)
+        if query_embedding is not None and self.embeddings is not None:
+            candidates = min(self.size, max(top_k * 10, 50))
+            fused = np.zeros(self.size, dtype=np.float32)
+            for ranking_scores in (scores, self.embeddings @ np.asarray(query_embedding, dtype=np.float32)):
+                ranking = np.argsort(-ranking_scores)[:candidates]
+                fused[ranking] += 1 / (fusion_k + np.arange(1, len(ranking) + 1))
+            scores = fused
+
+        top_k = min(top_k, self.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in best if scores[chunk_id] > 0]
+
+
+def vertex_embedder(model_name="text-embedding-004", batch_size=100):
+    """Returns an embed(texts) callable using a Vertex AI text embedding model."""
+    from vertexai.language_models import TextEmbeddingModel
+    model = TextEmbeddingModel.from_pretrained(model_name)
+
+    def embed(texts):
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embedding.values for embedding in model.get_embeddings(texts[start:start + batch_size]))
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    return embed
+
+
+class LocalSearchClient(SearchClient):
+    """
+    Searches the local indexes of several corpora.
+
+    A corpus is indexed on its first search if it has no index yet or its files
+    changed since the index was built. Afterwards its files are checked again at
+    most every `refresh_seconds`, and the index is rebuilt if they changed.
+
+    Attributes:
+        sources: A dictionary of corpus name to the folder with its documents.
+        index_dir: The folder holding one index folder per corpus.
+        chunk_words: The number of words per chunk.
+        overlap: The number of words shared by consecutive chunks.
+        embed: Optional callable returning normalized embeddings of a list of
+               texts. If given, a dense index is built and searched as well.
+        refresh_seconds: The minimum time between two checks of a loaded corpus
+                         for changed files, or None to never check again.
+    """
+
+    def __init__(self, sources, index_dir, chunk_words=120, overlap=30, embed=None, refresh_seconds=30):
+        self.sources = sources
+        self.index_dir = index_dir
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.embed = embed
+        self.refresh_seconds = refresh_seconds
+        self._indexes = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the client configured in settings.yaml:
+            local_search_corpora: Corpus name to document folder (default Files/manuals
+                                  and Files/safety_reports).
+            local_search_index_dir: Where the indexes are stored (default .cache/search_index).
+            local_search_dense: Whether to add a dense index of Vertex AI embeddings (default false).
+            local_search_refresh_seconds: How often the document folders are checked for
+                                          changes (default 30).
+        """
+        return cls(
+            sources=config_value("local_search_corpora") or {
+                "manuals": "Files/manuals",
+                "safety_reports": "Files/safety_reports",
+            },
+            index_dir=config_value("local_search_index_dir", ".cache/search_index"),
+            embed=vertex_embedder() if config_value("local_search_dense", False) else None,
+            refresh_seconds=config_value("local_search_refresh_seconds", 30),
+        )
+
+    @property
+    def corpora(self):
+        return tuple(self.sources)
+
+    def build(self, corpus):
+        """(Re)builds the index of a corpus and returns it."""
+        index_dir = os.path.join(self.index_dir, corpus)
+        build_index(self.sources[corpus], index_dir, self.chunk_words, self.overlap, self.embed)
+        return LocalIndex(index_dir)
+
+    def index(self, corpus):
+        """Returns the index of a corpus, building it if it is missing or stale."""
+        self._check_corpus(corpus)
+        with self._lock:
+            now = time.monotonic()
+            if corpus not in self._indexes:
+                index_dir = os.path.join(self.index_dir, corpus)
+                index = LocalIndex(index_dir) if os.path.exists(os.path.join(index_dir, "meta.json")) else None
+                if index is None or index.is_stale(self.sources[corpus]) or index.meta["dense"] != (self.embed is not None):
+                    index = self.build(corpus)
+                self._indexes[corpus] = index
+                self._checked_at[corpus] = now
+            elif self.refresh_seconds is not None and now - self._checked_at[corpus] >= self.refresh_seconds:
+                # Searches still running on the old index keep their memory maps
+                # of the replaced files, so the rebuilt index can be swapped in
+                if self._indexes[corpus].is_stale(self.sources[corpus]):
+                    self._indexes[corpus] = self.build(corpus)
+                self._checked_at[corpus] = now
+            return self._indexes[corpus]
+
+    def search_corpus_sync(self, corpus, query, top_k=5):
+        """Blocking variant of `search_corpus`."""
+        index = self.index(corpus)
+        query_embedding = self.embed([query])[0] if self.embed is not None and index.embeddings is not None else None
+        return [
+            SearchHit(
+                corpus=corpus,
+                title=index.documents[index.chunk_doc[chunk_id]],
+                page_number=int(index.chunk_page[chunk_id]),
+                content=index.text(chunk_id),
+                score=score,
+            )
+            for chunk_id, score in index.search(query, top_k, query_embedding)
+        ]
+
+    async def search_corpus(self, corpus, query, top_k=5):
+        return await asyncio.to_thread(self.search_corpus_sync, corpus, query, top_k)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="(Re)build the indexes.")
+    build_parser.add_argument("--corpus", action="append", help="Only build this corpus (repeatable).")
+    search_parser = subparsers.add_parser("search", help="Search the indexes.")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    client = LocalSearchClient.from_config()
+    if args.command == "build":
+        for corpus in args.corpus or client.corpora:
+            index = client.build(corpus)
+            print(f"{corpus}: {len(index.documents)} documents, {index.size} chunks, {len(index.vocabulary)} terms")
+    else:
+        hits, errors = asyncio.run(client.search(args.query, top_k=args.top_k))
+        print(format_hits(hits, errors=errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import random
+import threading
+import time
+
+
+class ModelBackend:
+    """
+    The interface between the agents/tools and a generative model provider.
+
+    Model handles returned by `get_model` provide `generate_content`,
+    `generate_content_async` (both accepting `stream=True`) and a `_model_name`
+    attribute, like vertexai's GenerativeModel.
+    """
+
+    def get_model(self, model_name, system_instruction=None):
+        """Returns a model handle, optionally with a system instruction."""
+        raise NotImplementedError
+
+    def create_cached_model(self, model_name, system_instruction, ttl):
+        """
+        Registers a system instruction as a context cache.
+
+        Returns:
+            A tuple of the cache object (with `expire_time` and `delete()`) and a
+            model handle using it.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support context caching.")
+
+    def text_message(self, role, text):
+        """Returns a chat message with a single text part."""
+        raise NotImplementedError
+
+    def generation_config(self, **kwargs):
+        """Returns a generation config object with a `to_dict()` method."""
+        raise NotImplementedError
+
+    def image_part(self, data, mime_type):
+        """Returns a message part holding an image."""
+        raise NotImplementedError
+
+
+########################################################################################################################
+# VERTEX AI
+########################################################################################################################
+
+class VertexBackend(ModelBackend):
+    """Gemini models on Vertex AI."""
+
+    def __init__(self):
+        from vertexai import generative_models
+        self._generative_models = generative_models
+
+    def get_model(self, model_name, system_instruction=None):
+        if system_instruction is None:
+            return self._generative_models.GenerativeModel(model_name)
+        return self._generative_models.GenerativeModel(model_name, system_instruction=[system_instruction])
+
+    def create_cached_model(self, model_name, system_instruction, ttl):
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+
+        cached_content = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            ttl=ttl,
+        )
+        return cached_content, PreviewGenerativeModel.from_cached_content(cached_content=cached_content)
+
+    def text_message(self, role, text):
+        return self._generative_models.Content(role=role, parts=[self._generative_models.Part.from_text(text)])
+
+    def generation_config(self, **kwargs):
+        return self._generative_models.GenerationConfig(**kwargs)
+
+    def image_part(self, data, mime_type):
+        return self._generative_models.Part.from_data(data=data, mime_type=mime_type)
+
+
+########################################################################################################################
+# LOCAL SCRIPTED STAND-IN
+########################################################################################################################
+
+class LocalPart:
+    """A message part of the scripted backend."""
+
+    def __init__(self, text=None, data=None, mime_type=None):
+        self.text = text
+        self.data = data
+        self.mime_type = mime_type
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(text=text)
+
+
+class LocalContent:
+    """A chat message of the scripted backend."""
+
+    def __init__(self, role, parts):
+        self.role = role
+        self.parts = parts
+
+
+class LocalGenerationConfig:
+    """A generation config of the scripted backend."""
+
+    def __init__(self, **kwargs):
+        self.options = kwargs
+
+    def to_dict(self):
+        return dict(self.options)
+
+
+class LocalUsage:
+    """Token counts shaped like Gemini's usage_metadata."""
+
+    def __init__(self, prompt_token_count=0, candidates_token_count=0, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class LocalResponse:
+    """A (possibly partial) response of the scripted backend."""
+
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def schema_example(schema, field=None):
+    """
+    Returns the simplest value valid against a response schema.
+
+    Enums prefer "False", so agent loops that follow scripted responses
+    terminate instead of executing functions or agents.
+    """
+    schema_type = schema.get("type")
+    if schema_type == "array":
+        return [schema_example(schema.get("items", {}))]
+    if schema_type == "object":
+        return {name: schema_example(prop, field=name) for name, prop in schema.get("properties", {}).items()}
+    if "enum" in schema:
+        return "False" if "False" in schema["enum"] else schema["enum"][0]
+    if schema_type == "boolean":
+        return False
+    if schema_type in ("integer", "number"):
+        return 0
+    if field == "response":
+        return "This is a scripted response."
+    return ""
+
+
+class ScriptedBackend(ModelBackend):
+    """
+    A local stand-in for Gemini that returns scripted, schema-valid JSON.
+
+    Used to profile and load-test the agent loop, tool dispatch and
+    orchestrator without a Vertex AI endpoint.
+
+    Attributes:
+        script: Optional callable `script(model_name, contents, generation_config)`
+                returning the response as a JSON string or as a JSON-serializable
+                value. Returning None falls back to `schema_example` of the
+                response schema.
+        latency: Simulated seconds per request, or a callable returning them
+                 (e.g. to sample a latency distribution).
+        output_tokens: Simulated output token count per response.
+        chars_per_token: Characters per simulated prompt token.
+        chunk_size: Characters per streamed chunk.
+    """
+
+    def __init__(self, script=None, latency=0.0, output_tokens=50, chars_per_token=4, chunk_size=16, seed=None):
+        self.script = script
+        self.latency = latency
+        self.output_tokens = output_tokens
+        self.chars_per_token = chars_per_token
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_model(self, model_name, system_instruction=None):
+        return ScriptedModel(self, model_name, system_instruction)
+
+    def text_message(self, role, text):
+        return LocalContent(role=role, parts=[LocalPart.from_text(text)])
+
+    def generation_config(self, **kwargs):
+        return LocalGenerationConfig(**kwargs)
+
+    def image_part(self, data, mime_type):
+        return LocalPart(data=data, mime_type=mime_type)
+
+    def delay(self):
+        """Returns the simulated latency of the next request in seconds."""
+        if callable(self.latency):
+            with self._lock:
+                return max(self.latency(self.random), 0.0)
+        return self.latency
+
+    def respond(self, model, contents, generation_config):
+        """Returns the response text and usage of a request."""
+        with self._lock:
+            self.calls += 1
+
+        text = None
+        if self.script is not None:
+            text = self.script(model._model_name, contents, generation_config)
+        if text is None:
+            schema = (generation_config.to_dict() if generation_config else {}).get("response_schema")
+            text = schema_example(schema) if schema else "This is a scripted response."
+        if not isinstance(text, str):
+            text = json.dumps(text)
+
+        prompt_chars = len(model.system_instruction or "")
+        for content in contents if isinstance(contents, list) else [contents]:
+            if isinstance(content, str):
+                prompt_chars += len(content)
+            else:
+                prompt_chars += sum(len(part.text or "") for part in getattr(content, "parts", []))
+        usage = LocalUsage(
+            prompt_token_count=prompt_chars // self.chars_per_token,
+            candidates_token_count=self.output_tokens,
+        )
+        return text, usage
+
+
+class ScriptedModel:
+    """A model handle of the ScriptedBackend."""
+
+    def __init__(self, backend, model_name, system_instruction=None):
+        self.backend = backend
+        self._model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _chunks(self, text, usage):
+        size = self.backend.chunk_size
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        for i, piece in enumerate(pieces):
+            yield LocalResponse(piece, usage if i == len(pieces) - 1 else None)
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        time.sleep(self.backend.delay())
+        text, usage = self.backend.respond(self, contents, generation_config)
+        if stream:
+            return self._chunks(text, usage)
+        return LocalResponse(text, usage)
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        await asyncio.sleep(self.backend.delay())
+        text, usage = self.backend.respond(self, contents, generation_config)
+        if not stream:
+            return LocalResponse(text, usage)
+
+        async def chunks():
+            for chunk in self._chunks(text, usage):
+                yield chunk
+        return chunks()
+
+
+########################################################################################################################
+# BACKEND SELECTION
+########################################################################################################################
+
+BACKENDS = {
+    "vertex": VertexBackend,
+    "scripted": ScriptedBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the process-wide model backend selected by 'model_backend' in settings.yaml."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            from Tools.python_functions import config
+            _backend = BACKENDS[config.get("model_backend", "vertex")]()
+        return _backend
+
+
+def set_backend(backend):
+    """Replaces the process-wide model backend, e.g. with a configured ScriptedBackend."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
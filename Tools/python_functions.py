@@ -13,16 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google.cloud import aiplatform
+import asyncio
+import datetime
 import os
+import urllib.parse
 import yaml
-import requests
-import subprocess
-import json
-import csv
-import io 
+import httpx
 import pandas as pd
 
+from Tools.async_utils import run_sync
+from Tools.bigquery_client import arrow_records, query_arrow, read_table_arrow
+from Tools.document_search import format_hits, get_search_client
+from Tools.employee_directory import get_employee_directory
+from Tools.http_clients import get_http_client, get_token_provider
+from Tools.tool_cache import Uncached, cached_tool
+from Tools.vision import get_vision_client
+
 
 
 def load_config():
@@ -51,6 +57,23 @@ johnSmith_gcal_ID = config["johnSmith_gcal_ID"]
 # ANALYZE IMAGE 
 ########################################################################################################################
 
+IMAGE_ANALYSIS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "image_description": {
+                "type": "string",
+            },
+            "damaged": {
+                "type": "boolean",
+            },
+        },
+        "required": ["image_description", "damaged"],
+    },
+}
+
+
 def analyze_image(image_path: str):
     """Analyzes an image to detect damage in insulator parts.
 
@@ -59,25 +82,24 @@ def analyze_image(image_path: str):
     to return a JSON array with image descriptions and damage information.
 
     Args:
-        image_path (str): The path to the image file to be analyzed.
+        image_path (str): The path to the image file to be analyzed, or the handle
+                          of an upload in the blob store (blob://...). The encoded
+                          image itself (bytes or a memoryview) is accepted as well.
 
     Returns:
         tuple: A tuple containing the image description and a boolean value 
-               indicating whether damage was detected.
+               indicating whether damage was detected. If the result was reused
+               from an earlier inspection of the same (or a near-identical) image,
+               the description says so.
 
     Raises:
         JSONDecodeError: If the model output is not a valid JSON array.
         IndexError: If the JSON array is empty or does not contain the expected fields.
     """
-    from vertexai.generative_models import GenerativeModel, Content, Part, GenerationConfig, Image
-    import json 
-
-    model = GenerativeModel("gemini-1.5-flash-001")
+    return run_sync(analyze_image_async(image_path))
 
-    # text_part = Part.from_text("Why is sky blue?")
-    image_part = Part.from_image(Image.load_from_file(image_path))
 
-    instructions= """
+IMAGE_ANALYSIS_INSTRUCTIONS = """
                 Tell me if the aircraft parts in the image are broken. Be very specific in your response. 
                 If the image contains an aircraft wing, tell me if the broken part is the slat or the flap. 
                 Respond with a valid JSON array of objects in this format:
@@ -85,18 +107,21 @@ def analyze_image(image_path: str):
                 Don't append anything other than the objects in response like "```json" etc.}
                 """
 
-    # Now construct the content with the image bytes
-    contents = [
-        instructions,
-        image_part 
-    ]
 
-    output = model.generate_content(contents, stream=False).text
-
-    outputjson=json.loads(output)
+async def analyze_image_async(image_path: str):
+    """Awaitable implementation of `analyze_image`, using the shared (downscaling) vision client."""
+    outputjson, reuse = await get_vision_client().generate_json(
+        image_path, IMAGE_ANALYSIS_INSTRUCTIONS, IMAGE_ANALYSIS_SCHEMA, return_reuse=True
+    )
     first_item = outputjson[0]
     image_description = first_item['image_description']
     damaged = first_item['damaged']
+    if reuse == "identical":
+        image_description += " (Reused result of an earlier inspection of an identical image.)"
+    elif reuse is not None:
+        image_description += (
+            f" (Reused result of an earlier inspection of a near-identical image, {reuse} of 64 hash bits differ.)"
+        )
     return image_description, damaged
 
 
@@ -106,55 +131,49 @@ def analyze_image(image_path: str):
 # SEARCH MANUALS AND REPORTS 
 ########################################################################################################################
 
-def search_manuals(query):
+async def get_access_token_async():
+    """Returns a cached access token of the application default credentials."""
+    return await get_token_provider().token_async()
+
+
+def search_documents(query, corpora="manuals, safety_reports", top_k=5):
     """
-    Performs a search query to retrieve information for a question on aircraft manuals. 
+    Searches aircraft manuals and annual safety reports at the same time and returns the best answers.
 
     Args:
         query: The search query text.
+        corpora: Comma-separated corpora to search: 'manuals', 'safety_reports' or both (default).
+        top_k: The number of answers to return (default 5).
 
     Returns:
-        str: string with filename in which the info was found, the page number, and the answer to the question.
+        str: One line per answer, best first, with the corpus, the relevance score, the filename
+             in which the info was found, the page number, and the answer to the question.
     """
-    # Get access token
-    access_token = (
-        subprocess.check_output("gcloud auth print-access-token", shell=True)
-        .decode("utf-8")
-        .strip()
-    )
-
-    # Construct API URL
-    url = f"https://discoveryengine.googleapis.com/v1/projects/{project_id}/locations/global/collections/default_collection/engines/{app_id_manuals}/servingConfigs/default_search:search"
-
-    # Prepare request headers
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
-
-    # Prepare request body
-    request_body = {
-        "query": query
+    return run_sync(search_documents_async(query, corpora, top_k))
 
-    }
 
-    # Make API request
-    response = requests.post(url, headers=headers, data=json.dumps(request_body))
+@cached_tool(ttl=3600)
+async def search_documents_async(query, corpora="manuals, safety_reports", top_k=5):
+    """Awaitable implementation of `search_documents`."""
+    corpus_names = [corpus.strip() for corpus in corpora.split(",") if corpus.strip()]
+    hits, errors = await get_search_client().search(query, corpus_names, int(top_k))
+    result = format_hits(hits, max_chars=config.get("search_max_result_chars", 4000), errors=errors)
+    if errors:
+        # Do not serve a partial result for the lifetime of the cache
+        return Uncached(result)
+    return result
 
-    # Check for errors
-    response.raise_for_status()
 
-    # Return response
-    search_results = response.json()
-    title = search_results["results"][0]["document"]["derivedStructData"]["title"]
-    pageNumber = search_results["results"][0]["document"]["derivedStructData"]["extractive_answers"][0]["pageNumber"]
-    content = search_results["results"][0]["document"]["derivedStructData"]["extractive_answers"][0]["content"]
-    return (f"Filename: {title}, pageNumber: {pageNumber}, searchResult: {content}")
+async def _search_corpus_top_answer(corpus, query):
+    hits = await get_search_client().search_corpus(corpus, query, top_k=1)
+    if not hits:
+        return "No results found."
+    return hits[0].to_text()
 
 
-def search_safety_reports(query):
+def search_manuals(query):
     """
-    Performs a search query to retrieve information for a question on aircraft annual safety reports. 
+    Performs a search query to retrieve information for a question on aircraft manuals. 
 
     Args:
         query: The search query text.
@@ -162,40 +181,32 @@ def search_safety_reports(query):
     Returns:
         str: string with filename in which the info was found, the page number, and the answer to the question.
     """
-    # Get access token
-    access_token = (
-        subprocess.check_output("gcloud auth print-access-token", shell=True)
-        .decode("utf-8")
-        .strip()
-    )
+    return run_sync(search_manuals_async(query))
 
-    # Construct API URL
-    url = f"https://discoveryengine.googleapis.com/v1/projects/{project_id}/locations/global/collections/default_collection/engines/{app_id_safety_reports}/servingConfigs/default_search:search"
 
-    # Prepare request headers
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+@cached_tool(ttl=3600)
+async def search_manuals_async(query):
+    """Awaitable implementation of `search_manuals`."""
+    return await _search_corpus_top_answer("manuals", query)
 
-    # Prepare request body
-    request_body = {
-        "query": query
 
-    }
+def search_safety_reports(query):
+    """
+    Performs a search query to retrieve information for a question on aircraft annual safety reports. 
 
-    # Make API request
-    response = requests.post(url, headers=headers, data=json.dumps(request_body))
+    Args:
+        query: The search query text.
+
+    Returns:
+        str: string with filename in which the info was found, the page number, and the answer to the question.
+    """
+    return run_sync(search_safety_reports_async(query))
 
-    # Check for errors
-    response.raise_for_status()
 
-    # Return response
-    search_results = response.json()
-    title = search_results["results"][0]["document"]["derivedStructData"]["title"]
-    pageNumber = search_results["results"][0]["document"]["derivedStructData"]["extractive_answers"][0]["pageNumber"]
-    content = search_results["results"][0]["document"]["derivedStructData"]["extractive_answers"][0]["content"]
-    return (f"Filename: {title}, pageNumber: {pageNumber}, searchResult: {content}")
+@cached_tool(ttl=3600)
+async def search_safety_reports_async(query):
+    """Awaitable implementation of `search_safety_reports`."""
+    return await _search_corpus_top_answer("safety_reports", query)
 
 
 
@@ -213,8 +224,13 @@ def joe_systems_determination(csv_file_path):
     Returns:
         str: The query ID of the uploaded file, or an error message.
     """
+    return run_sync(joe_systems_determination_async(csv_file_path))
+
+
+async def joe_systems_determination_async(csv_file_path):
+    """Awaitable implementation of `joe_systems_determination`."""
     BASE_URL = "https://stage-app.joe.systems"
-    auth_response = joe_systems_authorize("", "")
+    auth_response = await joe_systems_authorize_async("", "")
     if "security" in auth_response and "token" in auth_response["security"]:
         token = auth_response["security"]["token"]
         userid = auth_response["id"]
@@ -227,10 +243,10 @@ def joe_systems_determination(csv_file_path):
     try:
         with open(csv_file_path, 'rb') as file:
             files = {'uploadedFile': ('file.csv', file, 'text/csv')}
-            response = requests.post(url, headers=headers, files=files)
+            response = await get_http_client().post(url, headers=headers, files=files)
             response.raise_for_status()  # Raise an exception for bad status codes
             return response.text  # Return the query ID
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         return f"Error: {e}"
     except FileNotFoundError:
         return f"Error: CSV file not found at {csv_file_path}"
@@ -246,15 +262,20 @@ def joe_systems_authorize(login, password):
     Returns:
         dict: The API response containing the auth token, or an error message.
     """
+    return run_sync(joe_systems_authorize_async(login, password))
+
+
+async def joe_systems_authorize_async(login, password):
+    """Awaitable implementation of `joe_systems_authorize`."""
     BASE_URL = "https://stage-app.joe.systems"
     url = f"{BASE_URL}/api/v0.3/Authorization/External/Authorize?login={login}&password={password}"
     headers = {"accept": "text/plain"}
 
     try:
-        response = requests.get(url, headers=headers)
+        response = await get_http_client().get(url, headers=headers)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:  
+    except httpx.HTTPError as e:  
         return f"Error: {e}"
     
 
@@ -268,43 +289,81 @@ def joe_systems_authorize(login, password):
 # GET EMPLOYEES FROM BIGQUERY TABLE  
 ########################################################################################################################
 
-from google.cloud import bigquery
-import pandas as pd
-
-def read_bigquery_table(project_id, dataset_id, table_id):
+def read_bigquery_table(project_id, dataset_id, table_id, columns=None):
   """Reads a BigQuery table into a Pandas DataFrame.
 
   Args:
     project_id: The ID of the Google Cloud project.
     dataset_id: The ID of the BigQuery dataset.
     table_id: The ID of the BigQuery table.
+    columns: Optional list of the columns to read. Defaults to all.
 
   Returns:
     A Pandas DataFrame containing the data from the BigQuery table.
   """
+  table = read_table_arrow(f"{project_id}.{dataset_id}.{table_id}", columns=columns, project_id=project_id)
+  return table.to_pandas()
 
-  client = bigquery.Client(project=project_id)
-  table_ref = client.dataset(dataset_id).table(table_id)
-  table = client.get_table(table_ref) 
 
-  df = client.list_rows(table).to_dataframe()
-  return df
+# The columns of the employees table returned to the agents. The ScheduleAgent
+# needs the contact number to reach the employees it schedules.
+EMPLOYEE_COLUMNS = [
+    "Employee ID", "Employee Name", "License Held", "License Expiration Date", "Contact Number", "Specialization",
+]
 
 
-def get_employees(): 
-    """Retrieves employee data from BigQuery and returns a DataFrame.
+def _employees_query(specialization=None, license_type=None, license_valid_on=None, limit=20):
+    """
+    Returns the parameterized SQL query of `get_employees` and its parameters.
+
+    Filters are case-insensitive substring matches, so that e.g. 'engine'
+    finds 'Engine Maintenance' and 'A&P' finds 'A&P (Airframe & Powerplant)'.
+    """
+    conditions, parameters = [], {"limit": int(limit)}
+    if specialization:
+        conditions.append("STRPOS(LOWER(`Specialization`), LOWER(@specialization)) > 0")
+        parameters["specialization"] = specialization.strip()
+    if license_type:
+        conditions.append("STRPOS(LOWER(`License Held`), LOWER(@license_type)) > 0")
+        parameters["license_type"] = license_type.strip()
+    if license_valid_on:
+        conditions.append("SAFE_CAST(`License Expiration Date` AS DATE) >= @license_valid_on")
+        parameters["license_valid_on"] = _parse_date(license_valid_on)
+
+    columns = ", ".join(f"`{column}`" for column in EMPLOYEE_COLUMNS)
+    sql = f"SELECT {columns} FROM `{project_id}.ascm.employees`"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY `Employee Name` LIMIT @limit"
+    return sql, parameters
+
+
+def _parse_date(value):
+    """Returns the date of a 'YYYY-MM-DD' string or of 'today'."""
+    if isinstance(value, datetime.date):
+        return value
+    if value.strip().lower() == "today":
+        return datetime.date.today()
+    return datetime.date.fromisoformat(value.strip())
+
+
+def get_employees(specialization=None, license_type=None, license_valid_on=None, limit=20):
+    """Retrieves the employees matching the given filters from BigQuery.
 
     Fetches employee information, including their specializations and licenses,
-    from the 'employees' table in the 'ascm' dataset in BigQuery.
+    from the 'employees' table in the 'ascm' dataset in BigQuery. The filters
+    run in BigQuery, so only the matching employees are returned.
 
     Args:
-        project_id: The ID of the Google Cloud project where the BigQuery dataset
-                    is located. This should be provided as an argument to the
-                    function or set as an environment variable.
+        specialization: Optional part of the specialization, e.g. 'Engine Maintenance'
+                        or 'structural'. Case-insensitive.
+        license_type: Optional part of the license held, e.g. 'A&P' or 'IA'. Case-insensitive.
+        license_valid_on: Optional date 'YYYY-MM-DD' (or 'today') on which the
+                          license must still be valid.
+        limit: The maximum number of employees returned (default 20).
 
     Returns:
-        A Pandas DataFrame containing the employee data, including the following
-        columns:
+        A list of dictionaries, one per employee, with the keys:
         - Employee ID
         - Employee Name
         - License Held
@@ -312,19 +371,63 @@ def get_employees():
         - Contact Number
         - Specialization
     """
-    dataset_id = 'ascm'
-    table_id = 'employees'
-    df = read_bigquery_table(project_id, dataset_id, table_id)
-    data = df.to_dict(orient='records')
-    return data 
+    return run_sync(get_employees_async(specialization, license_type, license_valid_on, limit))
+
+
+async def get_employees_async(specialization=None, license_type=None, license_valid_on=None, limit=20):
+    """Awaitable implementation of `get_employees`."""
+    # 'today' is resolved before the cache, so a cached result never outlives its day
+    if license_valid_on:
+        license_valid_on = _parse_date(license_valid_on).isoformat()
+    return await _query_employees_async(specialization, license_type, license_valid_on, limit)
+
+
+@cached_tool(ttl=600)
+async def _query_employees_async(specialization, license_type, license_valid_on, limit):
+    sql, parameters = _employees_query(specialization, license_type, license_valid_on, limit)
+    table = await asyncio.to_thread(query_arrow, sql, parameters)
+    return arrow_records(table)
+
+
+def find_qualified_employees(specialization, license_valid_on="today", license_type=None):
+    """Finds the employees of a specialization whose license is valid on a date.
+
+    Looks the employees up in the in-memory employee directory (Tools.employee_directory),
+    so only the names of the matching employees are returned.
+
+    Args:
+        specialization: The specialization, or a part of it, e.g. 'Engine Maintenance'
+                        or 'structural repair'. Case-insensitive.
+        license_valid_on: The date 'YYYY-MM-DD' (or 'today', the default) on which
+                          the license must still be valid.
+        license_type: Optional part of the license held, e.g. 'A&P' or 'IA'.
+
+    Returns:
+        A list of the names of the matching employees, the longest valid license
+        first, or a message listing the known specializations if none match.
+    """
+    return run_sync(find_qualified_employees_async(specialization, license_valid_on, license_type))
+
+
+async def find_qualified_employees_async(specialization, license_valid_on="today", license_type=None):
+    """Awaitable implementation of `find_qualified_employees`."""
+    service = get_employee_directory()
+    # The lookup is instant, but a due refresh reads the source
+    employees = await asyncio.to_thread(
+        service.find_qualified, specialization, _parse_date(license_valid_on), license_type
+    )
+    if not employees:
+        return (
+            f"No employee with a valid license found for '{specialization}'. "
+            f"Known specializations: {', '.join(service.directory.specializations)}"
+        )
+    return [employee.name for employee in employees]
 
 
 ########################################################################################################################
 # GET CALENDARS 
 ########################################################################################################################
 
-from googleapiclient.discovery import build
-import datetime
 
 def get_upcoming_events(calendar_instance):
     """Retrieves upcoming events from a specified public Google Calendar.
@@ -343,7 +446,12 @@ def get_upcoming_events(calendar_instance):
         A list of event objects from the specified calendar, or a string error 
         message if the provided `calendar_instance` is invalid.
     """
+    return run_sync(get_upcoming_events_async(calendar_instance))
+
 
+@cached_tool(ttl=60)
+async def get_upcoming_events_async(calendar_instance):
+    """Awaitable implementation of `get_upcoming_events`, using the Calendar REST API directly."""
     if calendar_instance == 'workshop':
         calendar_id = workshop_gcal_ID
 
@@ -359,15 +467,22 @@ def get_upcoming_events(calendar_instance):
 
     API_KEY = gcal_api_key
 
-    service = build('calendar', 'v3', developerKey=API_KEY)  # No credentials needed
-
     now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
     time_max = (datetime.datetime.utcnow() + datetime.timedelta(days=30)).isoformat()  + 'Z'
 
-    events_result = service.events().list(
-        calendarId=calendar_id, timeMin=now, timeMax=time_max,
-        singleEvents=True, orderBy='startTime').execute()
-    events = events_result.get('items',  [])
+    # Calendar IDs may contain reserved characters, e.g. '#' in holiday calendars
+    url = f"https://www.googleapis.com/calendar/v3/calendars/{urllib.parse.quote(calendar_id, safe='')}/events"
+    params = {
+        "key": API_KEY,  # No credentials needed
+        "timeMin": now,
+        "timeMax": time_max,
+        "singleEvents": "true",
+        "orderBy": "startTime",
+    }
+
+    response = await get_http_client().get(url, params=params)
+    response.raise_for_status()
+    events = response.json().get('items',  [])
 
     return events
 
@@ -376,6 +491,7 @@ def get_upcoming_events(calendar_instance):
 
 
 
+@cached_tool(ttl=600)
 def get_preference_status() -> pd.DataFrame:
     """Analyzes a CSV file to determine the preferential status of materials.
 
@@ -441,6 +557,7 @@ def get_preference_status() -> pd.DataFrame:
 
 
 
+@cached_tool(ttl=600)
 def getBOM() -> pd.DataFrame:
     """Reads a CSV file ('Files/guidebushBOM.csv') and returns a Pandas DataFrame.
 
@@ -0,0 +1,260 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cachetools import TTLCache
+
+
+_MISSING = object()
+
+# All cached tools of the process, by name
+CACHED_TOOLS = {}
+
+
+class MemoryCacheBackend:
+    """An in-process LRU cache with a time-to-live, for a single worker."""
+
+    # Whether get and set may block, so async tools call them on a worker thread
+    blocking = False
+
+    def __init__(self, name, ttl, maxsize):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._cache.get(key, _MISSING)
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class DiskCacheBackend:
+    """
+    A cache in a local SQLite file, shared by all worker processes on the machine.
+
+    Values are pickled. Entries expire after `ttl` seconds and the least
+    recently used entries of a tool are evicted beyond `maxsize`.
+    """
+
+    blocking = True
+
+    def __init__(self, name, ttl, maxsize, path=None):
+        if path is None:
+            path = os.path.join(config_value("tool_cache_dir", ".cache"), "tools.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache ("
+                "tool TEXT, key TEXT, value BLOB, expires_at REAL, last_access REAL, "
+                "PRIMARY KEY (tool, key))"
+            )
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT value FROM tool_cache WHERE tool = ? AND key = ? AND expires_at > ?",
+                (self.name, key, now),
+            ).fetchone()
+            if row is None:
+                return _MISSING
+            connection.execute(
+                "UPDATE tool_cache SET last_access = ? WHERE tool = ? AND key = ?", (now, self.name, key)
+            )
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, pickle.dumps(value), now + self.ttl, now),
+            )
+            connection.execute("DELETE FROM tool_cache WHERE tool = ? AND expires_at <= ?", (self.name, now))
+            connection.execute(
+                "DELETE FROM tool_cache WHERE tool = ? AND key NOT IN ("
+                "SELECT key FROM tool_cache WHERE tool = ? ORDER BY last_access DESC LIMIT ?)",
+                (self.name, self.name, self.maxsize),
+            )
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM tool_cache WHERE tool = ?", (self.name,))
+
+
+BACKENDS = {
+    "memory": MemoryCacheBackend,
+    "disk": DiskCacheBackend,
+}
+
+
+def config_value(key, default=None):
+    """Returns a setting from settings.yaml."""
+    from Tools.python_functions import config
+    return config.get(key, default)
+
+
+class CacheStats:
+    """Hit and miss counters of a cached tool."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Sync tools run on worker threads
+        self._lock = threading.Lock()
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_dict(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+class Uncached:
+    """
+    Wraps a tool result that is returned to the caller but not cached, e.g. a
+    result that includes a transient failure.
+
+    Usage:
+        if errors:
+            return Uncached(result)
+        return result
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+def cached_tool(ttl, maxsize=128, backend=None):
+    """
+    Caches the results of a tool, keyed by the tool name and its normalized arguments.
+
+    Calls that only differ in how the arguments are passed (positionally, by
+    keyword, or relying on defaults) share a cache entry. Works for plain and
+    async functions.
+
+    Args:
+        ttl: Seconds a result stays valid.
+        maxsize: Maximum number of cached results of the tool.
+        backend: 'memory' or 'disk'. Defaults to the 'tool_cache_backend' setting,
+                 or 'memory'.
+
+    Usage:
+        @cached_tool(ttl=600)
+        def get_employees(): ...
+
+    Results wrapped in `Uncached` are returned unwrapped and not cached.
+    The decorated function has `cache_stats()` and `cache_clear()` attributes.
+    """
+    def decorator(function):
+        name = function.__name__
+        signature = inspect.signature(function)
+        state = {"backend": None}
+        state_lock = threading.Lock()
+        stats = CacheStats()
+
+        def cache():
+            # Created on first use so that settings.yaml is fully loaded
+            if state["backend"] is None:
+                with state_lock:
+                    if state["backend"] is None:
+                        backend_name = backend or config_value("tool_cache_backend", "memory")
+                        state["backend"] = BACKENDS[backend_name](name, ttl, maxsize)
+            return state["backend"]
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return json.dumps([name, bound.arguments], sort_keys=True, default=repr)
+
+        def lookup(args, kwargs):
+            key = make_key(args, kwargs)
+            value = cache().get(key)
+            stats.count(value is not _MISSING)
+            return key, value
+
+        def store(key, value):
+            if isinstance(value, Uncached):
+                return value.value
+            cache().set(key, value)
+            return value
+
+        async def off_loop(method, *args):
+            # Keeps blocking backends (e.g. SQLite waiting for a lock) off the event loop
+            if cache().blocking:
+                return await asyncio.to_thread(method, *args)
+            return method(*args)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                key, value = await off_loop(lookup, args, kwargs)
+                if value is _MISSING:
+                    value = await off_loop(store, key, await function(*args, **kwargs))
+                return value
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                key, value = lookup(args, kwargs)
+                if value is _MISSING:
+                    value = store(key, function(*args, **kwargs))
+                return value
+
+        wrapper.cache_stats = stats.to_dict
+        wrapper.cache_clear = lambda: cache().clear()
+        CACHED_TOOLS[name] = wrapper
+        return wrapper
+
+    return decorator
+
+
+def cache_stats():
+    """Returns the hit and miss counters of every cached tool."""
+    return {name: tool.cache_stats() for name, tool in CACHED_TOOLS.items()}
@@ -60,6 +60,8 @@ def return_tool_instruction(tools: str) -> str:
                 You are provided the below tools to support you with your duties.  
                 Do not hallucinate any data in your response. Only strictly stick to the information provided to you. 
                 The tool will be executed by the application. The response of the tool execution will be provided back to you, indicated by the tag <SYSTEM_INPUT>. 
+                If you need several tools whose arguments do not depend on each other's results, return one item per function call in your response array, each with "execute_function": "True". 
+                They will be executed at the same time and all responses will be provided back to you together, each prefixed with its function call. 
 
                 Here is the list of tools available to you: 
                 {tools}
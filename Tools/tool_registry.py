@@ -0,0 +1,260 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ast
+import asyncio
+import inspect
+
+
+class ToolCallError(Exception):
+    """Raised when a function call from an agent cannot be parsed or bound."""
+
+    def __init__(self, reason, function_name, message, expected=None):
+        super().__init__(message)
+        self.reason = reason
+        self.function_name = function_name
+        self.message = message
+        self.expected = expected
+
+    def to_dict(self):
+        """Returns the error in the structured form sent back to the agent."""
+        error = {"error": self.reason, "function": self.function_name, "message": self.message}
+        if self.expected:
+            error["expected"] = self.expected
+        return error
+
+
+class Tool:
+    """
+    A registered tool.
+
+    Attributes:
+        name: The name the agents call the tool by.
+        function: The synchronous implementation.
+        async_function: The awaitable implementation, or None.
+        signature: The pre-computed inspect.Signature of the tool.
+    """
+
+    def __init__(self, name, function, async_function=None):
+        self.name = name
+        self.function = function
+        self.async_function = async_function
+        self.signature = inspect.signature(function)
+
+    def bind(self, args, kwargs):
+        """Validates the arguments against the signature and returns the BoundArguments."""
+        try:
+            return self.signature.bind(*args, **kwargs)
+        except TypeError as e:
+            raise ToolCallError("invalid_arguments", self.name, str(e), expected=f"{self.name}{self.signature}")
+
+
+def _strip_quotes(text):
+    text = (text or "").strip()
+    while len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"`":
+        text = text[1:-1].strip()
+    return text
+
+
+def _literal(node, function_name):
+    """Evaluates an argument node; bare names are taken as strings (e.g. workshop -> 'workshop')."""
+    if isinstance(node, ast.Name):
+        return node.id
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ToolCallError(
+            "invalid_arguments", function_name,
+            f"Argument '{ast.unparse(node)}' is not a literal value.",
+        )
+
+
+def parse_call(call):
+    """
+    Parses a function call such as "get_upcoming_events('workshop')".
+
+    Args:
+        call: The call in Python call syntax.
+
+    Returns:
+        A tuple of (function name, positional arguments, keyword arguments).
+
+    Raises:
+        ToolCallError: If the text is not a single call with literal arguments.
+    """
+    call = _strip_quotes(call)
+    try:
+        node = ast.parse(call, mode="eval").body
+    except SyntaxError as e:
+        raise ToolCallError("invalid_syntax", None, f"Could not parse '{call}': {e.msg}")
+
+    if isinstance(node, ast.Name):
+        return node.id, [], {}
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        raise ToolCallError("invalid_syntax", None, f"'{call}' is not a function call.")
+
+    function_name = node.func.id
+    args = [_literal(arg, function_name) for arg in node.args]
+    kwargs = {keyword.arg: _literal(keyword.value, function_name) for keyword in node.keywords}
+    return function_name, args, kwargs
+
+
+def _loose_literal(text):
+    """Evaluates a literal, taking anything else as a string (e.g. Jane Doe -> 'Jane Doe')."""
+    text = text.strip()
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return _strip_quotes(text)
+
+
+def _split_args(args_string):
+    """Splits arguments that are not valid call syntax on commas, e.g. "Jane Doe, days=30"."""
+    args, kwargs = [], {}
+    for arg in args_string.split(","):
+        if not arg.strip():
+            continue
+        key, separator, value = arg.partition("=")
+        if separator and key.strip().isidentifier():
+            kwargs[key.strip()] = _loose_literal(value)
+        else:
+            args.append(_loose_literal(arg))
+    return args, kwargs
+
+
+def parse_args(function_name, args_string):
+    """
+    Parses the arguments of a call such as "'workshop', days=30".
+
+    Arguments in call syntax are parsed like `parse_call` does. Anything else,
+    e.g. unquoted text with spaces, is split on commas into strings and
+    `key=value` keyword arguments.
+
+    Returns:
+        A tuple of (positional arguments, keyword arguments).
+
+    Raises:
+        ToolCallError: If an argument in call syntax is not a literal value.
+    """
+    args_string = (args_string or "").strip()
+    if not args_string:
+        return [], {}
+    for candidate in dict.fromkeys((args_string, _strip_quotes(args_string))):
+        try:
+            _, args, kwargs = parse_call(f"{function_name}({candidate})")
+            return args, kwargs
+        except ToolCallError as e:
+            if e.reason != "invalid_syntax":
+                e.function_name = function_name
+                raise
+    return _split_args(args_string)
+
+
+class ToolRegistry:
+    """
+    A registry of the functions agents can call, built once at startup.
+
+    Dispatch is a dictionary lookup plus a validated bind against the
+    pre-computed signature; malformed calls are rejected before anything runs.
+    """
+
+    def __init__(self):
+        self.tools = {}
+
+    @classmethod
+    def from_module(cls, module):
+        """
+        Registers every public function defined in a module.
+
+        A coroutine function named `<name>_async` is registered as the awaitable
+        implementation of `<name>`.
+        """
+        registry = cls()
+        functions = {
+            name: obj for name, obj in inspect.getmembers(module, inspect.isfunction)
+            if not name.startswith("_") and obj.__module__ == module.__name__
+        }
+        for name, function in functions.items():
+            if name.endswith("_async"):
+                continue
+            registry.register(function, name=name, async_function=functions.get(f"{name}_async"))
+        return registry
+
+    def register(self, function, name=None, async_function=None):
+        """Registers a function as a tool and returns the Tool."""
+        tool = Tool(name or function.__name__, function, async_function)
+        self.tools[tool.name] = tool
+        return tool
+
+    def resolve(self, function, function_name, function_args):
+        """
+        Resolves an agent's function call to a tool and its bound arguments.
+
+        The call in `function` is used if it is valid call syntax for
+        `function_name`. Otherwise, e.g. if `function` is only the name of the
+        function, the call is assembled from `function_name` and `function_args`.
+
+        Returns:
+            A tuple of the Tool and the inspect.BoundArguments.
+
+        Raises:
+            ToolCallError: If the call is malformed or the tool does not exist.
+        """
+        function_name = _strip_quotes(function_name)
+        call = _strip_quotes(function)
+        name = None
+        if "(" in call:
+            try:
+                name, args, kwargs = parse_call(call)
+                if function_name and name != function_name:
+                    raise ToolCallError("invalid_syntax", function_name, "function does not match function_name.")
+            except ToolCallError as e:
+                if e.reason != "invalid_syntax":
+                    raise
+                name = None
+
+        if name is None:
+            name = function_name or call.partition("(")[0].strip()
+            if not name.isidentifier():
+                raise ToolCallError("invalid_syntax", name or None, f"Could not find the function to call in '{call}'.")
+            args, kwargs = parse_args(name, function_args)
+
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolCallError("unknown_function", name, f"Function '{name}' not found.",
+                                expected=", ".join(sorted(self.tools)))
+        return tool, tool.bind(args, kwargs)
+
+    def run(self, function, function_name, function_args):
+        """Runs an agent's function call. Malformed calls return a structured error."""
+        try:
+            tool, bound = self.resolve(function, function_name, function_args)
+        except ToolCallError as e:
+            return e.to_dict()
+        return tool.function(*bound.args, **bound.kwargs)
+
+    async def run_async(self, function, function_name, function_args):
+        """
+        Awaitable variant of `run`.
+
+        Uses the tool's awaitable implementation if it has one, and otherwise
+        runs the synchronous tool on a worker thread.
+        """
+        try:
+            tool, bound = self.resolve(function, function_name, function_args)
+        except ToolCallError as e:
+            return e.to_dict()
+        if tool.async_function is not None:
+            return await tool.async_function(*bound.args, **bound.kwargs)
+        return await asyncio.to_thread(tool.function, *bound.args, **bound.kwargs)
@@ -0,0 +1,211 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import io
+import json
+import mimetypes
+import threading
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from Tools.blob_store import MemoryReader, get_blob_store, is_blob_handle
+from Tools.image_cache import get_inspection_cache, inspection_namespace
+from Tools.model_backends import get_backend
+from Tools.tool_cache import config_value
+
+
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def read_image(image):
+    """
+    Returns the bytes and the guessed mime type of an image given as a file
+    path, a handle of the blob store or bytes-like data.
+
+    Uploads in the blob store are returned as memoryviews, without a copy.
+    """
+    if is_blob_handle(image):
+        store = get_blob_store()
+        return store.get(image), store.mime_type(image) or "image/jpeg"
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read(), mimetypes.guess_type(image)[0] or "image/jpeg"
+    return image, "image/jpeg"
+
+
+def preprocess_image(data, max_edge=1536, image_format="webp", quality=85):
+    """
+    Prepares an image for upload to the model.
+
+    The image is decoded, rotated upright according to its EXIF orientation,
+    downscaled so its longer edge is at most max_edge pixels and re-encoded
+    without any metadata (EXIF, GPS, ICC profile).
+
+    Args:
+        data: The encoded image as bytes-like data.
+        max_edge: The maximum width and height in pixels.
+        image_format: The upload format, one of IMAGE_FORMATS.
+        quality: The encoder quality of jpeg and webp (1-100).
+
+    Returns:
+        A tuple of the encoded image bytes and their mime type, or None if
+        Pillow cannot decode the image (e.g. an SVG), in which case it should be
+        uploaded as is.
+    """
+    pil_format, mime_type = IMAGE_FORMATS[image_format]
+    try:
+        image = Image.open(MemoryReader(data))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGBA" if pil_format != "JPEG" and "A" in image.getbands() else "RGB")
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output = io.BytesIO()
+    options = {"quality": quality} if pil_format in ("JPEG", "WEBP") else {"optimize": True}
+    image.save(output, format=pil_format, **options)
+    return output.getvalue(), mime_type
+
+
+class VisionClient:
+    """
+    Sends images with an instruction to a multimodal Gemini model.
+
+    The model handle is created once and reused, and every image goes through
+    `preprocess_image` before the upload.
+
+    Attributes:
+        model_name: The name of the Gemini model.
+        max_edge: The maximum width and height of uploaded images in pixels.
+        image_format: The upload format, one of IMAGE_FORMATS.
+        quality: The encoder quality of jpeg and webp.
+        backend: The ModelBackend of the model.
+    """
+
+    def __init__(self, model_name="gemini-1.5-flash-001", max_edge=1536, image_format="webp", quality=85, backend=None):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image_format '{image_format}'. Valid options are: {', '.join(IMAGE_FORMATS)}")
+        self.model_name = model_name
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.backend = backend if backend is not None else get_backend()
+        self.model = self.backend.get_model(model_name)
+
+    @classmethod
+    def from_config(cls):
+        """
+        Creates the client configured in settings.yaml:
+            vision_model: The Gemini model (default gemini-1.5-flash-001).
+            vision_max_edge: The maximum edge of uploaded images in pixels (default 1536).
+            vision_image_format: jpeg | webp (default) | png.
+            vision_image_quality: The jpeg and webp quality (default 85).
+        """
+        return cls(
+            model_name=config_value("vision_model", "gemini-1.5-flash-001"),
+            max_edge=config_value("vision_max_edge", 1536),
+            image_format=config_value("vision_image_format", "webp"),
+            quality=config_value("vision_image_quality", 85),
+        )
+
+    def image_part(self, image):
+        """
+        Returns the preprocessed message part of an image.
+
+        Args:
+            image: A file path, a blob store handle, or the encoded image as bytes-like data.
+        """
+        data, mime_type = read_image(image)
+        processed = preprocess_image(data, self.max_edge, self.image_format, self.quality)
+        if processed is not None:
+            data, mime_type = processed
+        return self.backend.image_part(bytes(data), mime_type)
+
+    async def generate_json(self, image, instructions, response_schema, use_cache=True, return_reuse=False):
+        """
+        Asks the model about an image and returns its parsed JSON response.
+
+        Responses are cached by image content (see Tools.image_cache), so asking
+        again about the same photo (or, with a non-zero 'image_cache_threshold',
+        a near-identical one) does not call the model.
+
+        Args:
+            image: A file path, a blob store handle, or the encoded image as bytes-like data.
+            instructions: The prompt sent along with the image.
+            response_schema: The schema of the JSON response.
+            use_cache: Whether to use the inspection cache, if it is enabled.
+            return_reuse: Whether to return a tuple of the response and its reuse
+                          (see InspectionCache.get_or_inspect): None if the model
+                          was called, "identical" or the Hamming distance of the
+                          near-duplicate if a cached response was reused.
+        """
+        # The first call loads the persisted cache from SQLite
+        cache = await asyncio.to_thread(get_inspection_cache) if use_cache else None
+        if cache is None:
+            result = await self._generate_json(image, instructions, response_schema)
+            return (result, None) if return_reuse else result
+        data, _ = await asyncio.to_thread(read_image, image)
+        return await cache.get_or_inspect(
+            data,
+            inspection_namespace(self.model_name, instructions, response_schema),
+            lambda: self._generate_json(image, instructions, response_schema),
+            return_reuse=return_reuse,
+        )
+
+    async def _generate_json(self, image, instructions, response_schema):
+        # Imported here because the Agents package imports the tools
+        from Agents import usage
+        from Agents.tracing import span
+
+        with span("llm.generate", model=self.model_name, request_chars=len(instructions)) as llm_span:
+            # Decoding and resizing are CPU-bound, so they run off the event loop
+            image_part = await asyncio.to_thread(self.image_part, image)
+            generation_config = self.backend.generation_config(
+                response_mime_type="application/json",
+                response_schema=response_schema,
+            )
+            response = await self.model.generate_content_async(
+                [instructions, image_part], generation_config=generation_config, stream=False
+            )
+            if llm_span.recording:
+                usage_metadata = response.usage_metadata
+                llm_span.set(
+                    response_chars=len(response.text),
+                    prompt_tokens=getattr(usage_metadata, "prompt_token_count", None),
+                    output_tokens=getattr(usage_metadata, "candidates_token_count", None),
+                )
+            # Booked on the session ledger of the agent that called the tool, if any
+            usage.record_call(self.model_name, response.usage_metadata)
+            return json.loads(response.text)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_vision_client():
+    """Returns the process-wide VisionClient of the configured model backend."""
+    backend = get_backend()
+    with _clients_lock:
+        if id(backend) not in _clients:
+            _clients[id(backend)] = VisionClient.from_config()
+        return _clients[id(backend)]
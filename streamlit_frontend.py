@@ -15,9 +15,9 @@
 
 import streamlit as st
 import yaml 
-import os
 import streamlit as st
 import Agents
+from Tools.blob_store import get_blob_store
 
 if "orchestrator" not in st.session_state:
     st.session_state.orchestrator = Agents.OrchestratorAgent(model="gemini-1.5-pro-001")
@@ -27,6 +27,36 @@ if "orchestrator" not in st.session_state:
 orchestrator = st.session_state.orchestrator
 
 
+def stream_response(message):
+    """Streams the orchestrator's answer into an assistant chat message and returns the final output."""
+    with st.chat_message("assistant"):
+        status = st.empty()
+        placeholder = st.empty()
+        text = ""
+        current_item = None
+
+        for event in orchestrator.stream_message(message):
+            if event["type"] == "progress":
+                status.caption(f"⏳ {event['text']}")
+            elif event["type"] == "message_start":
+                text, current_item = "", None
+            elif event["type"] == "token":
+                # Only show the latest item of the response array
+                if event["item"] != current_item:
+                    text, current_item = "", event["item"]
+                text += event["text"]
+                placeholder.markdown(text)
+            elif event["type"] == "final":
+                out_dict = {
+                    "trace": event["trace"], 
+                    "response": event["response"]
+                }
+
+        status.empty()
+        placeholder.write(out_dict['response'])
+    return out_dict
+
+
 ###_____________PAGE CONFIG_____________###
 st.set_page_config(
     page_title="Agentic Supply Chain Maintenance",
@@ -61,27 +91,18 @@ if st.sidebar.button("Analyze Image"):
 
     else: 
         st.chat_message("assistant").write("Thanks for uploading an image. Please wait a moment while I analyze it for you.")  # Display directly
-        # To read file as bytes:
-        image = uploaded_file.getvalue()
-        original_filename = uploaded_file.name
-        filename = os.path.join(os.getcwd(), original_filename)
-        filename = os.path.basename(filename)
-
-        with open(filename, "wb") as f:
-            f.write(image)
-
-        response, response_list = orchestrator.send_message(filename)
-        out_dict = {
-            "trace": response_list, 
-            "response": response
-        }
+        # The upload stays in memory; the agents pass its handle instead of a file path
+        image_handle = get_blob_store().put(uploaded_file.getbuffer(), uploaded_file.name)
+
+        out_dict = stream_response(image_handle)
         # st.session_state.messages.append({"role": "assistant", "content": out_dict})  # Add only the agent's response
         # st.chat_message("assistant").json(out_dict) 
-        st.chat_message("assistant").write(out_dict['response'])
 
         # Expander for the trace
         with st.expander("Show Trace"):
             st.json(out_dict['trace'])  
+        with st.expander("Show Token Usage"):
+            st.json(orchestrator.usage.report())
 
 
 
@@ -111,18 +132,15 @@ if prompt := st.chat_input():
     # st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
 
-    response, response_list = orchestrator.send_message(prompt)
-    out_dict = {
-        "trace": response_list, 
-        "response": response
-    }
+    out_dict = stream_response(prompt)
     # st.session_state.messages.append({"role": "assistant", "content": out_dict})
     # st.chat_message("assistant").json(out_dict)  
-    st.chat_message("assistant").write(out_dict['response'])
 
     # Expander for the trace
     with st.expander("Show Trace"):
         st.json(out_dict['trace'])    
+    with st.expander("Show Token Usage"):
+        st.json(orchestrator.usage.report())
 
 
 
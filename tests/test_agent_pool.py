@@ -0,0 +1,116 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import datetime
+import threading
+
+from Agents.agent_pool import AgentPool
+from Agents.core import Agent
+from Agents.replay_store import ReplayStore
+from Tools.model_backends import ScriptedBackend
+
+
+class FakeCachedContent:
+    def __init__(self, ttl):
+        self.expire_time = datetime.datetime.now(datetime.timezone.utc) + ttl
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+
+class CachingBackend(ScriptedBackend):
+    """A ScriptedBackend that records the context caches it creates."""
+
+    def __init__(self):
+        super().__init__()
+        self.caches = []
+        self.cache_threads = []
+
+    def create_cached_model(self, model_name, system_instruction, ttl):
+        self.cache_threads.append(threading.current_thread())
+        cached_content = FakeCachedContent(ttl)
+        self.caches.append(cached_content)
+        return cached_content, self.get_model(model_name, system_instruction)
+
+
+def make_pool(backend):
+    agent = Agent(
+        backend.get_model("gemini-1.5-pro-001"), {"type": "array"}, "persona", "instructions", [],
+        prefix_mode="context_cache", backend=backend, replay_store=ReplayStore(".cache/replay", mode="off"),
+    )
+    return AgentPool({"ScheduleAgent": agent}, default_size=1), agent
+
+
+def expire(cached_content):
+    cached_content.expire_time = datetime.datetime.now(datetime.timezone.utc)
+
+
+def test_forks_share_the_template_cache():
+    backend = CachingBackend()
+    pool, template = make_pool(backend)
+
+    for _ in range(3):
+        fork = pool.acquire("ScheduleAgent")
+        fork.chat_session.set_prefix(fork.system_prompt())
+        assert fork.chat_session._cached_content is template.chat_session._cached_content
+
+    assert len(backend.caches) == 1
+
+
+def test_expired_cache_is_refreshed_by_the_template_only():
+    backend = CachingBackend()
+    pool, template = make_pool(backend)
+    stale_fork = pool.acquire("ScheduleAgent")
+    expire(backend.caches[0])
+
+    fork = pool.acquire("ScheduleAgent")
+    fork.chat_session.set_prefix(fork.system_prompt())
+    stale_fork.chat_session.set_prefix(stale_fork.system_prompt())
+
+    assert len(backend.caches) == 2
+    assert backend.caches[0].deleted
+    assert fork.chat_session._cached_content is backend.caches[1]
+    assert stale_fork.chat_session._cached_content is backend.caches[1]
+
+
+def test_fork_falls_back_to_a_system_instruction_when_the_template_cache_expired():
+    backend = CachingBackend()
+    pool, template = make_pool(backend)
+    fork = pool.acquire("ScheduleAgent")
+    expire(backend.caches[0])
+
+    fork.chat_session.set_prefix(fork.system_prompt())
+
+    assert len(backend.caches) == 1
+    assert not backend.caches[0].deleted
+    assert fork.chat_session._cached_content is None
+    assert fork.chat_session._prefixed_model.system_instruction == fork.system_prompt()
+
+
+def test_context_caches_are_created_off_the_event_loop():
+    backend = CachingBackend()
+    pool, template = make_pool(backend)
+
+    async def delegate():
+        fork = await pool.acquire_async("ScheduleAgent")
+        expire(backend.caches[0])
+        await template.chat_session.set_prefix_async(template.system_prompt())
+        return fork
+
+    asyncio.run(delegate())
+
+    assert len(backend.caches) == 2
+    assert threading.main_thread() not in backend.cache_threads
@@ -0,0 +1,76 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import pytest
+from PIL import Image
+
+from Tools.blob_store import BlobStore, MemoryReader, is_blob_handle
+
+
+def test_memory_reader_decodes_an_image_from_a_memoryview():
+    output = io.BytesIO()
+    Image.new("RGB", (16, 8), (200, 10, 10)).save(output, format="PNG")
+    view = memoryview(bytearray(output.getvalue())).toreadonly()
+
+    image = Image.open(MemoryReader(view))
+    image.load()
+
+    assert image.size == (16, 8)
+    assert image.getpixel((0, 0)) == (200, 10, 10)
+
+
+def test_memory_reader_seeks_like_a_file():
+    reader = MemoryReader(memoryview(b"abcdef"))
+
+    assert reader.read(2) == b"ab"
+    assert reader.seek(-1, io.SEEK_END) == 5
+    assert reader.read() == b"f"
+    assert reader.seek(1) == 1
+    assert reader.read(10) == b"bcdef"
+
+
+def test_handles_resolve_to_the_upload():
+    store = BlobStore()
+
+    handle = store.put(bytearray(b"fuselage"), "C:/photos/left wing.JPG")
+
+    assert is_blob_handle(handle)
+    assert handle.endswith("/left_wing.JPG")
+    assert bytes(store.get(handle)) == b"fuselage"
+    assert store.mime_type(handle) == "image/jpeg"
+    assert not is_blob_handle("left_wing.jpg")
+
+
+def test_identical_uploads_share_one_blob():
+    store = BlobStore()
+
+    first = store.put(b"same", "a.png")
+    second = store.put(b"same", "b.png")
+
+    assert first.rsplit("/", 1)[0] == second.rsplit("/", 1)[0]
+    assert len(store) == 1 and store.size == 4
+
+
+def test_evicted_and_unknown_handles_raise():
+    store = BlobStore(max_bytes=10)
+    old = store.put(b"x" * 6, "old.png")
+    new = store.put(b"y" * 6, "new.png")
+
+    assert bytes(store.get(new)) == b"y" * 6
+    with pytest.raises(ValueError, match="upload the file again"):
+        store.get(old)
+    with pytest.raises(ValueError):
+        store.get("blob://0000000000000000/missing.png")
@@ -0,0 +1,50 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from Tools.document_search import SearchHit, format_hits, merge_hits
+
+
+def hit(corpus, content, score, title="manual.pdf", page_number=1):
+    return SearchHit(corpus, title, page_number, content, score)
+
+
+def test_merge_hits_keeps_the_best_of_duplicate_answers():
+    manuals = [hit("manuals", "Torque the bolts to 25 Nm.", 0.4), hit("manuals", "Check the slat.", 0.9)]
+    reports = [hit("safety_reports", "torque the bolts to 25 nm", 0.7, title="report.pdf")]
+
+    merged = merge_hits([manuals, reports], top_k=5)
+
+    assert [(h.corpus, h.score) for h in merged] == [("manuals", 0.9), ("safety_reports", 0.7)]
+
+
+def test_merge_hits_returns_the_top_k():
+    hits = [hit("manuals", f"answer {i}", i / 10) for i in range(10)]
+
+    assert [h.content for h in merge_hits([hits], top_k=3)] == ["answer 9", "answer 8", "answer 7"]
+
+
+def test_format_hits_caps_the_result_size():
+    hits = [hit("manuals", "x" * 1000, 1 - i / 10) for i in range(5)]
+
+    result = format_hits(hits, max_chars=1500)
+
+    assert len(result) <= 1500
+    assert result.startswith("[1] corpus: manuals, score: 1.00, Filename: manual.pdf, pageNumber: 1")
+    assert result.endswith("(3 more result(s) left out to fit the size limit.)")
+
+
+def test_format_hits_reports_failed_corpora():
+    result = format_hits([], errors={"safety_reports": TimeoutError("timed out\ndetails")})
+
+    assert result == "Search of corpus 'safety_reports' failed: timed out\nNo results found."
@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from Tools.employee_directory import Employee, EmployeeDirectory
+
+
+def employee(employee_id, expiry, specialization="Structural Repair", license="A&P"):
+    return Employee.from_record({
+        "Employee ID": employee_id,
+        "Employee Name": f"Employee {employee_id}",
+        "License Held": license,
+        "License Expiration Date": expiry,
+        "Specialization": specialization,
+    })
+
+
+def ids(employees):
+    return [employee.employee_id for employee in employees]
+
+
+def test_find_qualified_skips_expired_licenses():
+    directory = EmployeeDirectory()
+    directory.update([
+        employee("1", "2026-01-31"),
+        employee("2", "2027-06-30"),
+        employee("3", "2026-03-01"),
+        employee("4", "2026-03-02"),
+        employee("5", "2028-01-01", specialization="Avionics"),
+    ])
+
+    qualified = directory.find_qualified("Structural Repair", valid_on=datetime.date(2026, 3, 2))
+
+    assert ids(qualified) == ["2", "4"]
+
+
+def test_find_qualified_matches_parts_of_specializations_and_licenses():
+    directory = EmployeeDirectory()
+    directory.update([
+        employee("1", "2027-01-01", specialization="Engine Maintenance", license="A&P, IA"),
+        employee("2", "2028-01-01", specialization="Engine Overhaul"),
+        employee("3", "2029-01-01", specialization="Avionics", license="A&P, IA"),
+    ])
+
+    assert ids(directory.find_qualified("engine", valid_on="2026-10-17")) == ["2", "1"]
+    assert ids(directory.find_qualified("ENGINE", valid_on="2026-10-17", license_type="ia")) == ["1"]
+    assert directory.specializations == ["Avionics", "Engine Maintenance", "Engine Overhaul"]
+
+
+def test_update_reindexes_only_the_differences():
+    directory = EmployeeDirectory()
+    assert directory.update([employee("1", "2027-01-01"), employee("2", "2027-01-01")]) == 2
+
+    changes = directory.update([employee("1", "2025-01-01"), employee("3", "2027-01-01", specialization="Avionics")])
+
+    assert changes == 3
+    assert ids(directory.find_qualified("structural repair", valid_on="2026-10-17")) == []
+    assert ids(directory.find_qualified("avionics", valid_on="2026-10-17")) == ["3"]
+    assert directory.specializations == ["Avionics", "Structural Repair"]
+    assert directory.update([employee("1", "2025-01-01"), employee("3", "2027-01-01", specialization="Avionics")]) == 0
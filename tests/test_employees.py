@@ -0,0 +1,53 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import datetime
+
+from Tools import python_functions
+
+
+def test_today_is_resolved_before_the_employee_cache(monkeypatch):
+    today = [datetime.date(2026, 10, 17)]
+    queries = []
+
+    class FakeDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return today[0]
+
+    def query_arrow(sql, parameters):
+        queries.append(parameters)
+        return []
+
+    monkeypatch.setattr(python_functions.datetime, "date", FakeDate)
+    monkeypatch.setattr(python_functions, "query_arrow", query_arrow)
+    monkeypatch.setattr(python_functions, "arrow_records", list)
+    python_functions._query_employees_async.cache_clear()
+
+    asyncio.run(python_functions.get_employees_async("engine", license_valid_on="today"))
+    asyncio.run(python_functions.get_employees_async("engine", license_valid_on="today"))
+    today[0] = datetime.date(2026, 10, 18)
+    asyncio.run(python_functions.get_employees_async("engine", license_valid_on="today"))
+
+    assert [parameters["license_valid_on"] for parameters in queries] == [
+        datetime.date(2026, 10, 17), datetime.date(2026, 10, 18),
+    ]
+
+
+def test_employee_query_returns_the_contact_details():
+    sql, _ = python_functions._employees_query("engine")
+
+    assert "`Employee ID`" in sql
+    assert "`Contact Number`" in sql
@@ -0,0 +1,71 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from Agents.history_manager import COMPACTED_MARKER, HistoryManager, message_text
+from Tools.model_backends import LocalContent, LocalPart
+
+
+def message(text, role="user"):
+    return LocalContent(role=role, parts=[LocalPart.from_text(text)])
+
+
+def tool_output(chars):
+    return message(f"Here is the response from your function execution: <SYSTEM_INPUT>{'x' * chars}</SYSTEM_INPUT>")
+
+
+def texts(history):
+    return [message_text(content) for content in history]
+
+
+def test_pinned_prefix_and_last_turns_are_kept_verbatim():
+    manager = HistoryManager(token_budget=100, keep_last_turns=2, stub_chars=10)
+    prefix = message("<PERSONA>" + "p" * 1000 + "</PERSONA>")
+    history = [prefix, tool_output(500), tool_output(500), message("latest question")]
+
+    compacted = manager.compact(history, pinned=1)
+
+    assert compacted[0] is prefix
+    assert texts(compacted[-2:]) == texts(history[-2:])
+
+
+def test_old_tool_outputs_are_collapsed_into_stubs():
+    manager = HistoryManager(token_budget=10_000, keep_last_turns=1, stub_chars=10)
+    history = [tool_output(500), message("latest question")]
+
+    compacted = manager.compact(history)
+
+    assert f"<SYSTEM_INPUT>{COMPACTED_MARKER}, 500 characters omitted] xxxxxxxxxx...</SYSTEM_INPUT>" in texts(compacted)[0]
+    assert texts(compacted)[1] == "latest question"
+
+
+def test_compaction_is_idempotent_on_stubs():
+    manager = HistoryManager(token_budget=10_000, keep_last_turns=1, stub_chars=10)
+    history = [tool_output(500), message("latest question")]
+
+    once = manager.compact(history)
+    twice = manager.compact(once)
+
+    assert texts(twice) == texts(once)
+    assert twice[0] is once[0]
+
+
+def test_oldest_unpinned_messages_are_dropped_over_budget():
+    manager = HistoryManager(token_budget=60, keep_last_turns=1)
+    prefix = message("p" * 40)
+    history = [prefix, message("a" * 80), message("b" * 80), message("c" * 40)]
+
+    compacted = manager.compact(history, pinned=1)
+
+    assert texts(compacted) == ["p" * 40, "b" * 80, "c" * 40]
+    assert manager.dropped_messages == 1
@@ -0,0 +1,55 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from Tools.image_cache import InspectionCache, content_digest
+
+
+def inspect_with(result):
+    calls = []
+
+    async def inspect():
+        calls.append(result)
+        return result
+
+    return inspect, calls
+
+
+def test_default_cache_only_reuses_identical_content():
+    cache = InspectionCache()
+    cache.set("inspection", content_digest(b"photo-1"), {"damaged": True}, image_hash=0b1011)
+
+    assert cache.lookup("inspection", content_digest(b"photo-1")) == ({"damaged": True}, None)
+    # Same perceptual hash, different content
+    assert cache.lookup("inspection", content_digest(b"photo-2"), image_hash=0b1011) is None
+
+
+def test_near_duplicate_hits_report_their_distance():
+    cache = InspectionCache(threshold=4)
+    cache.set("inspection", content_digest(b"photo-1"), {"damaged": True}, image_hash=0b1011)
+
+    assert cache.lookup("inspection", content_digest(b"photo-2"), image_hash=0b1000) == ({"damaged": True}, 2)
+
+
+def test_get_or_inspect_reports_reuse():
+    cache = InspectionCache()
+    inspect, calls = inspect_with({"damaged": False})
+
+    first = asyncio.run(cache.get_or_inspect(b"photo", "inspection", inspect, return_reuse=True))
+    second = asyncio.run(cache.get_or_inspect(memoryview(b"photo"), "inspection", inspect, return_reuse=True))
+
+    assert first == ({"damaged": False}, None)
+    assert second == ({"damaged": False}, "identical")
+    assert len(calls) == 1
@@ -0,0 +1,29 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from Tools.local_search import LocalSearchClient
+
+
+def test_changed_documents_are_picked_up_by_a_loaded_index(tmp_path):
+    manuals = tmp_path / "manuals"
+    manuals.mkdir()
+    (manuals / "engine.txt").write_text("Replace the engine oil filter every 50 hours.")
+    client = LocalSearchClient({"manuals": str(manuals)}, str(tmp_path / "index"), refresh_seconds=0)
+
+    assert client.search_corpus_sync("manuals", "propeller") == []
+
+    (manuals / "propeller.txt").write_text("Inspect the propeller blades for nicks before every flight.")
+    hits = client.search_corpus_sync("manuals", "propeller")
+
+    assert [hit.title for hit in hits] == ["propeller.txt"]
@@ -0,0 +1,53 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from Agents.replay_store import ReplayMissError, ReplayStore
+from Tools.model_backends import LocalContent, LocalGenerationConfig, LocalPart, LocalUsage
+
+
+def history(*texts):
+    return [LocalContent(role="user", parts=[LocalPart.from_text(text)]) for text in texts]
+
+
+def config(**kwargs):
+    return LocalGenerationConfig(temperature=0, response_schema={"type": "array"}, **kwargs)
+
+
+def test_request_key_is_stable_and_covers_the_request(tmp_path):
+    store = ReplayStore(str(tmp_path), mode="record")
+    key = store.request_key("gemini-1.5-pro-001", "prefix", history("hello"), config())
+
+    assert key == store.request_key("gemini-1.5-pro-001", "prefix", history("hello"), config())
+    assert key != store.request_key("gemini-1.5-flash-001", "prefix", history("hello"), config())
+    assert key != store.request_key("gemini-1.5-pro-001", "other prefix", history("hello"), config())
+    assert key != store.request_key("gemini-1.5-pro-001", "prefix", history("hello!"), config())
+    assert key != store.request_key("gemini-1.5-pro-001", "prefix", history("hello"), config(top_k=1))
+
+
+def test_recorded_responses_are_replayed(tmp_path):
+    key = ReplayStore(str(tmp_path)).request_key("gemini-1.5-pro-001", None, history("hello"), config())
+    ReplayStore(str(tmp_path), mode="record").save(key, "[]", LocalUsage(prompt_token_count=12, candidates_token_count=3))
+
+    text, usage = ReplayStore(str(tmp_path), mode="replay").load(key)
+
+    assert text == "[]"
+    assert (usage.prompt_token_count, usage.candidates_token_count) == (12, 3)
+
+
+def test_replay_mode_raises_on_a_missing_response(tmp_path):
+    with pytest.raises(ReplayMissError):
+        ReplayStore(str(tmp_path), mode="replay").load("0" * 64)
+    assert ReplayStore(str(tmp_path), mode="auto").load("0" * 64) is None
@@ -0,0 +1,59 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from Agents.streaming import ResponseFieldParser
+
+
+RESPONSE = json.dumps([
+    {"understanding": "a \"quoted\" response", "response": "Line 1\nTab\there é \U0001F6E9 done"},
+    {"response": "second", "nested": {"response": "not captured"}},
+])
+
+
+def feed_in_chunks(text, size):
+    parser = ResponseFieldParser("response")
+    deltas = []
+    for start in range(0, len(text), size):
+        deltas.extend(parser.feed(text[start:start + size]))
+    return deltas
+
+
+def collect(deltas):
+    items = {}
+    for item, text in deltas:
+        items[item] = items.get(item, "") + text
+    return items
+
+
+def test_field_is_decoded_with_escapes():
+    assert collect(feed_in_chunks(RESPONSE, len(RESPONSE))) == {
+        0: "Line 1\nTab\there é \U0001F6E9 done",
+        1: "second",
+    }
+
+
+def test_chunks_split_inside_escapes_decode_the_same():
+    whole = collect(feed_in_chunks(RESPONSE, len(RESPONSE)))
+
+    for size in (1, 2, 3, 5, 7):
+        assert collect(feed_in_chunks(RESPONSE, size)) == whole
+
+
+def test_text_is_returned_as_soon_as_it_arrives():
+    parser = ResponseFieldParser("response")
+
+    assert parser.feed('[{"response": "Hel') == [(0, "Hel")]
+    assert parser.feed('lo"}]') == [(0, "lo")]
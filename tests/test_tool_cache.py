@@ -0,0 +1,58 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+
+from Tools.tool_cache import DiskCacheBackend, Uncached, cached_tool
+
+
+def test_uncached_results_are_returned_but_not_cached():
+    results = iter([Uncached("Search of corpus manuals failed"), "answer", "other answer"])
+
+    @cached_tool(ttl=60, backend="memory")
+    async def flaky_search(query):
+        return next(results)
+
+    assert asyncio.run(flaky_search("engine")) == "Search of corpus manuals failed"
+    assert asyncio.run(flaky_search("engine")) == "answer"
+    assert asyncio.run(flaky_search("engine")) == "answer"
+
+
+def test_disk_backend_is_used_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "Tools.tool_cache.config_value",
+        lambda key, default=None: str(tmp_path) if key == "tool_cache_dir" else default,
+    )
+    loop_threads = []
+
+    @cached_tool(ttl=60, backend="disk")
+    async def lookup_part(part):
+        loop_threads.append(threading.current_thread())
+        return part.upper()
+
+    original_get = DiskCacheBackend.get
+    get_threads = []
+
+    def get(self, key):
+        get_threads.append(threading.current_thread())
+        return original_get(self, key)
+
+    monkeypatch.setattr(DiskCacheBackend, "get", get)
+
+    assert asyncio.run(lookup_part("slat")) == "SLAT"
+    assert asyncio.run(lookup_part("slat")) == "SLAT"
+    assert lookup_part.cache_stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+    assert loop_threads == [threading.main_thread()]
+    assert threading.main_thread() not in get_threads
@@ -0,0 +1,80 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from Tools.tool_registry import ToolCallError, ToolRegistry, parse_args, parse_call
+
+
+def get_upcoming_events(calendar_instance):
+    return calendar_instance
+
+
+def find_employee(name, days=30):
+    return name, days
+
+
+@pytest.fixture
+def registry():
+    registry = ToolRegistry()
+    registry.register(get_upcoming_events)
+    registry.register(find_employee)
+    return registry
+
+
+def test_parse_call_keeps_commas_and_equals_inside_strings():
+    assert parse_call("find_employee('Doe, Jane', days=7)") == ("find_employee", ["Doe, Jane"], {"days": 7})
+    assert parse_call("find_employee(name='a = b')") == ("find_employee", [], {"name": "a = b"})
+
+
+def test_parse_call_rejects_non_literal_arguments():
+    with pytest.raises(ToolCallError) as error:
+        parse_call("find_employee(open('x'))")
+    assert error.value.reason == "invalid_arguments"
+
+
+def test_parse_args_splits_unquoted_multi_word_arguments():
+    assert parse_args("find_employee", "Jane Doe, days=7") == (["Jane Doe"], {"days": 7})
+
+
+def test_resolve_builds_the_call_of_a_bare_function_name_from_function_args(registry):
+    tool, bound = registry.resolve("get_upcoming_events", "get_upcoming_events", "'workshop'")
+
+    assert tool.name == "get_upcoming_events"
+    assert bound.args == ("workshop",)
+    assert registry.run("get_upcoming_events", "get_upcoming_events", "'workshop'") == "workshop"
+
+
+def test_resolve_prefers_function_name_when_function_does_not_match(registry):
+    _, bound = registry.resolve("get_upcoming_events('workshop')", "find_employee", "'Jane Doe'")
+
+    assert bound.args == ("Jane Doe",)
+
+
+def test_resolve_accepts_unquoted_multi_word_arguments(registry):
+    assert registry.run("", "find_employee", "Jane Doe") == ("Jane Doe", 30)
+
+
+def test_unknown_function_returns_a_structured_error(registry):
+    error = registry.run("launch_rocket('now')", "launch_rocket", "'now'")
+
+    assert error["error"] == "unknown_function"
+    assert "find_employee" in error["expected"]
+
+
+def test_missing_arguments_return_a_structured_error(registry):
+    error = registry.run("get_upcoming_events()", "get_upcoming_events", "")
+
+    assert error["error"] == "invalid_arguments"
+    assert error["expected"] == "get_upcoming_events(calendar_instance)"
@@ -0,0 +1,56 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import types
+
+from Agents.usage import UsageLedger
+
+
+PRICES = {"gemini-1.5-pro-001": {"input": 1.25, "cached_input": 0.3125, "output": 5.0}}
+
+
+def usage_metadata(prompt_tokens, cached_tokens, output_tokens):
+    return types.SimpleNamespace(
+        prompt_token_count=prompt_tokens,
+        cached_content_token_count=cached_tokens,
+        candidates_token_count=output_tokens,
+    )
+
+
+def test_cost_of_a_vertex_resource_path_uses_the_bare_model_price():
+    ledger = UsageLedger(prices=PRICES, session_cost_budget=0.001)
+    ledger.record_call(
+        "OrchestratorAgent", "publishers/google/models/gemini-1.5-pro-001", usage_metadata(1000, 0, 100)
+    )
+
+    assert ledger.total.cost == (1000 * 1.25 + 100 * 5.0) / 1_000_000
+    assert ledger.exceeded() is not None
+
+
+def test_cost_of_an_unpriced_model_is_zero():
+    ledger = UsageLedger(prices=PRICES)
+    ledger.record_call("OrchestratorAgent", "publishers/google/models/unknown", usage_metadata(1000, 0, 100))
+
+    assert ledger.total.cost == 0.0
+
+
+def test_prefix_tokens_are_split_into_cached_and_uncached():
+    ledger = UsageLedger(prices=PRICES)
+    ledger.record_call("ScheduleAgent", "gemini-1.5-pro-001", usage_metadata(1200, 0, 10), prefix_chars=4000)
+    ledger.record_call("ScheduleAgent", "gemini-1.5-pro-001", usage_metadata(1200, 1000, 10), prefix_chars=4000)
+
+    report = ledger.report()["by_agent"]["ScheduleAgent"]
+    assert report["prefix_tokens"] == 2000
+    assert report["cached_prefix_tokens"] == 1000
+    assert report["uncached_prefix_tokens"] == 1000
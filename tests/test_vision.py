@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import io
+
+from PIL import Image
+
+from Agents import tracing, usage
+from Tools.model_backends import ScriptedBackend
+from Tools.vision import VisionClient
+
+
+SCHEMA = {"type": "array", "items": {"type": "object", "properties": {"damaged": {"type": "boolean"}}}}
+
+
+def png():
+    output = io.BytesIO()
+    Image.new("RGB", (32, 32), (90, 90, 90)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_vision_calls_are_booked_on_the_active_ledger():
+    backend = ScriptedBackend(script=lambda *args: [{"damaged": True}], output_tokens=7)
+    client = VisionClient(backend=backend)
+    ledger = usage.UsageLedger()
+
+    async def inspect():
+        with usage.bind(ledger, "InspectorAgent"):
+            return await client.generate_json(png(), "Is it damaged?", SCHEMA, use_cache=False)
+
+    assert asyncio.run(inspect()) == [{"damaged": True}]
+    assert ledger.by_agent["InspectorAgent"].calls == 1
+    assert ledger.by_agent["InspectorAgent"].output_tokens == 7
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def test_vision_calls_are_traced_as_model_calls_of_the_tool(monkeypatch):
+    exporter = ListExporter()
+    tracer = tracing.Tracer([exporter])
+    monkeypatch.setattr(tracing, "get_tracer", lambda: tracer)
+    client = VisionClient(backend=ScriptedBackend(script=lambda *args: [{"damaged": False}]))
+
+    async def inspect():
+        with tracing.span("tool.call", function_name="analyze_image"):
+            await client.generate_json(png(), "Is it damaged?", SCHEMA, use_cache=False)
+
+    asyncio.run(inspect())
+    tracer.flush()
+
+    tool_span, = [span for span in exporter.spans if span.name == "tool.call"]
+    llm_span, = [span for span in exporter.spans if span.name == "llm.generate"]
+    assert llm_span.parent_id == tool_span.span_id
+    assert llm_span.attributes["model"] == client.model_name